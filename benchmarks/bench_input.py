@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Compares text and binary (-B) input, reporting lines/sec and peak RSS.
+Each run is a separate process so that its peak RSS can be measured, and
+the best of 3 runs is reported.
+
+Usage: PYTHONPATH=. python benchmarks/bench_input.py <mail.log>
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import time
+import subprocess
+
+
+MODES = [("text", []), ("binary", ['-B']), ("binary pipe", ['-B', '-'])]
+
+
+def main(path):
+    with open(path, 'rb') as f:
+        num_lines = sum(1 for line in f)
+
+    for name, args in MODES:
+        pipe = '-' in args
+        cmd = [sys.executable, '-m', 'postscan.cli'] + args + ([] if pipe else [path])
+        runs = []
+        for i in range(3):
+            with open(os.devnull, 'w') as devnull:
+                start = time.time()
+                cat = subprocess.Popen(['cat', path], stdout=subprocess.PIPE) if pipe else None
+                proc = subprocess.Popen(cmd, stdin=cat.stdout if pipe else None, stdout=devnull)
+                if cat:
+                    cat.stdout.close()
+                pid, status, rusage = os.wait4(proc.pid, 0)
+                runs.append((time.time() - start, rusage.ru_maxrss))
+                if cat:
+                    cat.wait()
+        secs, rss = min(runs)
+        print("%-12s %6.2fs  %9.0f lines/s  peak RSS %d KB" %
+              (name, secs, num_lines / secs, rss))
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1]))
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Starts postresolved (see postresolve.socketmap) on generated tables with
+many entries, and reports the latency of lookups from several clients at
+once, each over its own connection: first of addresses not yet looked up,
+then again from the cache.
+
+The clients are threads of this process, which shares the CPU(s) with
+the daemon, so with more clients than CPUs the latencies include waiting
+for a turn.
+
+Usage: PYTHONPATH=. python benchmarks/bench_resolve.py [clients [entries]]
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import time
+import random
+import shutil
+import signal
+import tempfile
+import threading
+import subprocess
+
+from postresolve.client import connect, query
+
+
+LOOKUPS = 2000
+
+
+def write_tables(directory, entries):
+    """Writes virtual aliases leading to aliases of root, and returns postconf output."""
+    with open(os.path.join(directory, 'aliases'), 'w') as f:
+        f.write("postmaster: root\n")
+        for i in range(entries // 10):
+            f.write("list%d: user%d, postmaster, \"|/usr/bin/true %d\"\n" % (i, i, i))
+    with open(os.path.join(directory, 'virtual'), 'w') as f:
+        for i in range(entries):
+            f.write("a%d@example.com  list%d@localhost, b%d@example.org\n" % (i, i % (entries // 10), i))
+    with open(os.path.join(directory, 'postconf'), 'w') as f:
+        f.write("mydestination = localhost\n"
+                "alias_maps = hash:{0}/aliases\n"
+                "virtual_alias_maps = hash:{0}/virtual\n".format(directory))
+
+
+def client(path, addresses, latencies):
+    sock = connect(path)
+    try:
+        for address in addresses:
+            start = time.time()
+            status, value = query(sock, 'compatible-local', address)
+            latencies.append(time.time() - start)
+            assert status == 'OK', (status, value)
+    finally:
+        sock.close()
+
+
+def run_clients(path, clients, addresses):
+    """
+    Returns the latencies of looking up the <addresses>, shared between the
+    <clients>, and the time taken altogether.
+    """
+
+    start = time.time()
+    latencies = []
+    threads = [threading.Thread(target=client, args=(path, addresses[i::clients], latencies))
+               for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sorted(latencies), time.time() - start
+
+
+def report(name, latencies, elapsed):
+    print("%-6s %6d lookups: median %.3fms, 99%% %.3fms, max %.3fms (%.0f lookups/s)" % (
+        name, len(latencies), latencies[len(latencies) // 2] * 1000,
+        latencies[int(len(latencies) * 0.99)] * 1000, latencies[-1] * 1000,
+        len(latencies) / elapsed))
+
+
+def main(clients=8, entries=100000):
+    clients, entries = int(clients), int(entries)
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'postresolve.sock')
+    try:
+        write_tables(directory, entries)
+        start = time.time()
+        daemon = subprocess.Popen([sys.executable, '-m', 'postresolve.socketmap', '-S', path,
+                                   '-P', os.path.join(directory, 'postconf')])
+        while not os.path.exists(path):
+            time.sleep(0.01)
+        print("Loaded %d virtual aliases in %.2fs" % (entries, time.time() - start))
+        addresses = ["a%d@example.com" % i for i in random.sample(range(entries), LOOKUPS)]
+        try:
+            report("cold", *run_clients(path, clients, addresses))
+            report("cached", *run_clients(path, clients, addresses))
+        finally:
+            daemon.send_signal(signal.SIGTERM)
+            daemon.wait()
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    sys.exit(main(*sys.argv[1:]))
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Compares the throughput of Scanner.find with the original linear search
+through all patterns, and checks that they give the same results.
+
+Usage: PYTHONPATH=. python benchmarks/bench_scanner.py <mail.log>
+"""
+
+from __future__ import print_function
+
+import sys
+import time
+import logging
+
+from postscan.scanner import Scanner
+
+
+def find_linear(scanner, s, line_num):
+    """The original Scanner.find(), which tries every pattern in turn."""
+    for r in scanner.rd:
+        m = r[0].match(s)
+        if m:
+            return r[1], m.groups()
+
+
+def run(func, lines):
+    start = time.time()
+    results = [func(line, i + 1) for i, line in enumerate(lines)]
+    return results, time.time() - start
+
+
+def main(path):
+    scanner = Scanner(True, logging.getLogger("postscan"))
+    with open(path) as f:
+        lines = f.readlines()
+    size = sum(len(line) for line in lines) / 1e6
+
+    linear, linear_secs = run(lambda s, n: find_linear(scanner, s, n), lines)
+    indexed, indexed_secs = run(scanner.find, lines)
+
+    mismatches = sum(1 for a, b in zip(linear, indexed) if a != b)
+    matched = sum(1 for r in indexed if r)
+    print("%d lines (%.1f MB), %d matched, %d mismatches" %
+          (len(lines), size, matched, mismatches))
+    for name, secs in (("linear", linear_secs), ("indexed", indexed_secs)):
+        print("%-9s %6.2fs  %9.0f lines/s  %6.1f MB/s" %
+              (name, secs, len(lines) / secs, size / secs))
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1]))
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Sends a generated log (see postscan.loggen) to "postscan serve" at a fixed
+rate over each transport, and reports how many lines were received and
+whether the output matches a scan of the same log.
+
+Usage: PYTHONPATH=. python benchmarks/bench_serve.py [rate [messages]]
+"""
+
+from __future__ import print_function
+
+import os
+import re
+import sys
+import time
+import signal
+import socket
+import tempfile
+import subprocess
+
+from postscan import loggen
+
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def run(log, listen, send, rate):
+    """Returns (sent, the server's report, its output)."""
+    # To a file rather than a pipe, which would fill up while sending
+    out = tempfile.TemporaryFile()
+    server = subprocess.Popen([sys.executable, '-m', 'postscan.cli', 'serve'] + listen,
+                              stdout=out, stderr=subprocess.PIPE)
+    time.sleep(1)
+    sender = subprocess.run([sys.executable, '-m', 'postscan.sendlog', '--rate', str(rate)]
+                            + send + [log], stderr=subprocess.PIPE, universal_newlines=True)
+    time.sleep(1)
+    server.send_signal(signal.SIGTERM)
+    errors = server.communicate()[1]
+    out.seek(0)
+    output = out.read()
+    sent = int(re.search(r'Sent (\d+)', sender.stderr).group(1))
+    return sent, errors.decode().strip(), output
+
+
+def main(rate=50000, messages=20000):
+    rate = int(rate)
+    directory = tempfile.mkdtemp()
+    log = os.path.join(directory, "mail.log")
+    with open(log, 'w') as f:
+        f.writelines(loggen.generate(int(messages)))
+    expected = subprocess.run([sys.executable, '-m', 'postscan.cli', log],
+                              stdout=subprocess.PIPE).stdout
+    uuid_re = re.compile(br'[0-9a-f]{8}(?:-[0-9a-f]{4}){3}-[0-9a-f]{12}')
+    try:
+        port = free_port()
+        unix = os.path.join(directory, "log.sock")
+        for name, listen, send in [
+                ("udp", ['--udp', str(port)], ['--udp', str(port)]),
+                ("tcp", ['--tcp', str(port)], ['--tcp', str(port)]),
+                ("unix", ['--unix', unix], ['--unix', unix])]:
+            sent, report, output = run(log, listen, send, rate)
+            same = uuid_re.sub(b'', output) == uuid_re.sub(b'', expected)
+            print("%-5s %d lines at %d/s: %s; output %s" % (name, sent, rate, report,
+                                                          "matches" if same else "DIFFERS"))
+    finally:
+        for name in os.listdir(directory):
+            os.unlink(os.path.join(directory, name))
+        os.rmdir(directory)
+
+
+if __name__ == "__main__":
+    sys.exit(main(*sys.argv[1:]))
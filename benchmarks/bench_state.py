@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Measures the memory used per in-flight message by StateMachine, which keeps
+a Message record per queue ID and a Delivery record per user, against the
+dicts that it used to keep, and the size of each in a checkpoint.
+
+Usage: PYTHONPATH=. python benchmarks/bench_state.py [messages]
+"""
+
+from __future__ import print_function
+
+import sys
+import pickle
+import logging
+import tracemalloc
+
+from postscan.state import StateMachine
+
+
+def message_fields(i):
+    queue_id = "%X" % (0x100000000 + i)
+    msg_id = "%x@example.net" % (0x10000000000 + i)
+    return (queue_id, msg_id, "10.0.%d.%d" % (i // 256 % 256, i % 256),
+            "sender%d@example.net" % i, "user%d" % (i % 5))
+
+
+def build_dicts(count):
+    """Builds the same state as build_records(), as the original dicts."""
+    messages = {}
+    deliveries_by_id = {}
+    for i in range(count):
+        queue_id, msg_id, ip, envfrom, user = message_fields(i)
+        messages[queue_id] = {'dt': "Aug 10 16:14:36", 'ip': ip, 'msg_id_faked': False,
+                              'duplicate_msg_id': False, 'blessed': False}
+        messages[queue_id]['to'] = []
+        messages[queue_id]['msg_id'] = msg_id
+        deliveries_by_id[msg_id] = {}
+        messages[queue_id]['envfrom'] = envfrom
+        deliveries_by_id[msg_id][user] = {'int_score': 3, 'user': user, 'count': 1}
+        rcpt = user + "@example.com"
+        parts = rcpt.lower().split("@")
+        messages[queue_id]['to'].append((rcpt, None, parts[0]))
+        messages[queue_id]['blessed'] = True
+    return messages, deliveries_by_id
+
+
+def build_records(count):
+    """Feeds StateMachine the events for <count> messages, up to delivery."""
+    state = StateMachine(None, None, None, logging.getLogger("postscan"))
+    for i in range(count):
+        queue_id, msg_id, ip, envfrom, user = message_fields(i)
+        dt = "Aug 10 16:14:36"
+        state.dispatch('client', (dt, "100", queue_id, "mail.example.net", ip), i)
+        state.dispatch('cleanup', (dt, "101", queue_id, msg_id), i)
+        state.dispatch('envfrom', (dt, "102", queue_id, envfrom, "1"), i)
+        state.dispatch('result', (dt, "103", "3", "BAYES_00", user, msg_id), i)
+        state.dispatch('local', (dt, "104", queue_id, user + "@example.com", None), i)
+    return state.messages, state.deliveries_by_id
+
+
+def measure(build, count):
+    """Returns bytes per message in memory, and in a pickle."""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build(count)
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    pickled = len(pickle.dumps(result, pickle.HIGHEST_PROTOCOL))
+    return used / count, pickled / count
+
+
+def main(count=100000):
+    print("{0:>8} {1:>14} {2:>14}".format("layout", "bytes/message", "pickled bytes"))
+    for name, build in [("dicts", build_dicts), ("records", build_records)]:
+        used, pickled = measure(build, count)
+        print("{0:>8} {1:>14.0f} {2:>14.0f}".format(name, used, pickled))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Runs postscan over a generated log (see postscan.loggen) and reports:
+ - Scanner.find lines/sec for each label, and for unmatched lines
+ - StateMachine.dispatch events/sec for each label
+ - end-to-end MB/s and peak RSS of the postscan command
+
+The log is the same for a given set of arguments, so results can be
+compared between revisions.
+
+Usage: PYTHONPATH=. python benchmarks/bench_suite.py [messages [no_msg_id [fanout [zombies]]]]
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import time
+import logging
+import tempfile
+import subprocess
+import collections
+
+from postscan import loggen
+from postscan.scanner import Scanner
+from postscan.state import StateMachine
+
+
+def bench_scanner(lines):
+    """Returns the matches, and {label: (count, seconds)}."""
+    scanner = Scanner(True, logging.getLogger("postscan"))
+    clock = time.perf_counter
+    times = collections.defaultdict(lambda: [0, 0.0])
+    events = []
+    for line_num, line in enumerate(lines, 1):
+        start = clock()
+        result = scanner.find(line, line_num)
+        elapsed = clock() - start
+        label = result[0] if result else "(none)"
+        times[label][0] += 1
+        times[label][1] += elapsed
+        if result:
+            events.append((line_num, result[0], result[1]))
+    return events, times
+
+
+def bench_state(events):
+    """Returns {label: (count, seconds)} for StateMachine.dispatch."""
+    records = []
+    state = StateMachine(None, None, None, logging.getLogger("postscan"), emit=records.append)
+    clock = time.perf_counter
+    times = collections.defaultdict(lambda: [0, 0.0])
+    for line_num, label, groups in events:
+        start = clock()
+        state.dispatch(label, groups, line_num)
+        elapsed = clock() - start
+        times[label][0] += 1
+        times[label][1] += elapsed
+    return times
+
+
+def bench_command(path, args=()):
+    """Returns the best of 3 (seconds, peak RSS in KB) for the command."""
+    cmd = [sys.executable, '-m', 'postscan.cli'] + list(args) + [path]
+    runs = []
+    for i in range(3):
+        with open(os.devnull, 'w') as devnull:
+            start = time.time()
+            proc = subprocess.Popen(cmd, stdout=devnull)
+            pid, status, rusage = os.wait4(proc.pid, 0)
+            runs.append((time.time() - start, rusage.ru_maxrss))
+    return min(runs)
+
+
+def report(title, times):
+    print(title)
+    total_count = sum(count for count, secs in times.values())
+    total_secs = sum(secs for count, secs in times.values())
+    for label, (count, secs) in sorted(times.items()):
+        print("  %-12s %9d %12.0f /s" % (label, count, count / secs if secs else 0))
+    print("  %-12s %9d %12.0f /s" % ("total", total_count, total_count / total_secs))
+
+
+def main(messages=100000, no_msg_id=0.1, fanout=1, zombies=0.0):
+    with tempfile.NamedTemporaryFile('w', suffix='.log', delete=False) as f:
+        f.writelines(loggen.generate(int(messages), no_msg_id=float(no_msg_id),
+                                     fanout=int(fanout), zombies=float(zombies)))
+    try:
+        size = os.path.getsize(f.name) / 1e6
+        with open(f.name) as log:
+            num_lines = sum(1 for line in log)
+        print("%d messages, %d lines, %.1f MB" % (int(messages), num_lines, size))
+
+        # Before reading the log into memory, as a forked child's peak RSS
+        # includes the parent's
+        secs, rss = bench_command(f.name)
+
+        with open(f.name) as log:
+            lines = log.readlines()
+        events, times = bench_scanner(lines)
+        report("Scanner.find (lines)", times)
+        report("StateMachine.dispatch (events)", bench_state(events))
+
+        print("postscan")
+        print("  %6.2fs  %6.1f MB/s  %9.0f lines/s  peak RSS %d KB" %
+              (secs, size / secs, num_lines / secs, rss))
+    finally:
+        os.unlink(f.name)
+
+
+if __name__ == "__main__":
+    sys.exit(main(*sys.argv[1:]))
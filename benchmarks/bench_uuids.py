@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Compares the cost of handling a message without a Message-ID using the
+original list-based UUID queue and the indexed one, as the number of
+outstanding fake IDs grows (e.g. during a spam wave in which they're never
+removed).  Each iteration creates an ID, claims it for a spamd result and
+pops it by ID, as for "cleanup", "result" and "removed" lines.
+
+Usage: PYTHONPATH=. python benchmarks/bench_uuids.py [max_backlog]
+"""
+
+from __future__ import print_function
+
+import sys
+import time
+import uuid
+
+from postscan.uuid_helper import UUIDs
+
+
+class ListUUIDs(object):
+    """The original UUIDs class."""
+
+    def __init__(self):
+        self.uuids = []
+
+
+    def create(self):
+        u = str(uuid.uuid4())
+        self.uuids.append(u)
+        return u
+
+
+    def pop(self, target_uuid=None):
+        for index, item in enumerate(self.uuids):
+            if self.uuids[index] == target_uuid:
+                target_index = index
+                break
+        else:
+            target_index = 0
+
+        u = self.uuids[target_index]
+        del self.uuids[target_index]
+        return u
+
+
+    def peek(self, index=0):
+        return self.uuids[index]
+
+
+def cycle_list(queue, owners, user):
+    """As StateMachine did with ListUUIDs."""
+    msg_id = queue.create()
+    found = queue.peek()
+    if found not in owners or owners[found] != user:
+        queue_index = 0
+        while found in owners:
+            queue_index += 1
+            found = queue.peek(queue_index)
+        owners[found] = user
+    queue.pop(msg_id)
+    del owners[msg_id]
+
+
+def cycle_indexed(queue, owners, user):
+    msg_id = queue.create()
+    found = queue.peek()
+    if queue.owners.get(found) != user:
+        found = queue.first_unowned()
+        queue.claim(found, user)
+    queue.pop(msg_id)
+
+
+def measure(make, cycle, backlog, iterations):
+    """Returns the time per iteration in microseconds."""
+    queue = make()
+    owners = {}
+    # Zombie IDs, already claimed by another user
+    for i in range(backlog):
+        u = queue.create()
+        if isinstance(queue, UUIDs):
+            queue.claim(u, "other")
+        else:
+            owners[u] = "other"
+    start = time.time()
+    for i in range(iterations):
+        cycle(queue, owners, "user")
+    return (time.time() - start) / iterations * 1e6
+
+
+def main(max_backlog=100000):
+    print("{0:>8} {1:>12} {2:>12}".format("backlog", "list (us)", "indexed (us)"))
+    backlog = 10
+    while backlog <= max_backlog:
+        iterations = max(20, min(20000, 2000000 // backlog))
+        old = measure(ListUUIDs, cycle_list, backlog, iterations)
+        new = measure(UUIDs, cycle_indexed, backlog, 20000)
+        print("{0:>8} {1:>12.2f} {2:>12.2f}".format(backlog, old, new))
+        backlog *= 10
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
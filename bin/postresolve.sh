@@ -1,6 +1,9 @@
 #! /bin/sh
 # postresolve (Bourne shell script) -- Perform limited Postfix-style address resolution
 #
+# Superseded by the Python postresolve (see the postresolve package), which
+# runs postconf once and reads the tables itself.
+#
 # Version: 1.0.0
 # Copyright: (c)2015 Alastair Irvine <alastair@plug.org.au>
 # Keywords: postfix addresses e-mail
@@ -0,0 +1,7 @@
+# -*- coding: utf-8 -*-
+
+"""Postfix-style address resolution, like "sendmail -bv"."""
+
+__author__ = """Alastair Irvine"""
+__email__ = 'alastair@plug.org.au'
+__version__ = '1.1.2'
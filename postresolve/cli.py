@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+"""Console script for postresolve."""
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+import sys
+import logging
+import subprocess
+
+import click
+
+from .postconf import PostConf
+from .resolver import Resolver, format_lines
+from . import __version__
+
+
+def make_logger(debug):
+    logger = logging.getLogger("postresolve")
+    logger.addHandler(logging.StreamHandler())
+    logger.setLevel(logging.DEBUG if debug else logging.WARNING)
+    return logger
+
+
+def output_lines(resolver, address, mode, local_only, first_only):
+    lines = format_lines(resolver.resolve(address), mode, local_only)
+    return lines[:1] if first_only else lines
+
+
+def config_files(conf, config_dir=None, postconf_file=None):
+    """Returns the files that the parameters come from, for noticing changes."""
+    if postconf_file:
+        return [postconf_file]
+    return [os.path.join(config_dir or conf.get('config_directory', '/etc/postfix'), 'main.cf')]
+
+
+def load_conf(config_dir=None, postconf_file=None):
+    """Returns the PostConf, from <postconf_file> if given."""
+    if postconf_file:
+        return PostConf.read(postconf_file)
+    try:
+        return PostConf.load(config_dir)
+    except (OSError, subprocess.CalledProcessError) as e:
+        raise click.ClickException("Can't run postconf: %s" % e)
+
+
+@click.command(context_settings=dict(help_option_names=['-h', '--help']))
+@click.option('-b', '--brief', 'mode', flag_value='brief',
+              help="Doesn't annotate users, filenames, etc.")
+@click.option('-c', '--compatible', 'mode', flag_value='compatible',
+              help="Output similar to \"sendmail -bv\" on a sendmail system")
+@click.option('-f', '--first-only', is_flag=True, default=False,
+              help="Shows only the first destination")
+@click.option('-l', '--local-only', is_flag=True, default=False,
+              help="Shows local destinations only")
+@click.option('-v', 'sendmail', is_flag=True, default=False,
+              help="Same as --compatible --local-only, so that -bv works as for sendmail")
+@click.option('-d', '--debug', count=True, help="Shows each lookup")
+@click.option('-C', '--config-dir', type=click.Path(file_okay=False),
+              help="Uses main.cf in <config_dir>")
+@click.option('-P', '--postconf-file', type=click.Path(dir_okay=False, exists=True),
+              help="Reads the parameters from <file> (the saved output of postconf) instead of running postconf")
+@click.option('--batch', is_flag=True, default=False,
+              help="Resolves each address read from stdin, showing it before each destination")
+@click.option('-V', '--version', is_flag=True, default=False, help="Show version")
+@click.argument('address', required=False)
+def main(mode, first_only, local_only, sendmail, debug, config_dir, postconf_file, batch, version, address):
+    """
+    Shows what an address or local user resolves to, as Postfix would,
+    e.g. by processing virtual aliases and aliases.
+    """
+
+    if version:
+        print(__version__)
+        return
+    if batch == bool(address):
+        raise click.UsageError("Give one <address>, or --batch")
+    if sendmail:
+        # -b is ignored as it comes first
+        mode, local_only = 'compatible', True
+
+    logger = make_logger(debug)
+    resolver = Resolver(load_conf(config_dir, postconf_file), logger)
+    mode = mode or 'standard'
+
+    if not batch:
+        for line in output_lines(resolver, address, mode, local_only, first_only):
+            click.echo(line)
+        return
+    for address in sys.stdin:
+        address = address.strip()
+        if not address:
+            continue
+        for line in output_lines(resolver, address, mode, local_only, first_only):
+            sys.stdout.write("%s\t%s\n" % (address, line))
+        # For a program that writes an address and reads the answer
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    sys.exit(main())  # pragma: no cover
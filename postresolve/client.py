@@ -0,0 +1,129 @@
+"""
+A small client for postresolved (see socketmap.py), to run in place of
+postresolve where that's run for every message, e.g. as "sendmail -bv" by
+spamass-milter.  It takes the same options, but imports only what it needs
+to ask the daemon, and runs postresolve itself if the daemon isn't there.
+
+E.g. postresolve-client -bv alice@example.com
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+import sys
+import errno
+import getopt
+import socket
+
+
+DEFAULT_SOCKET = '/run/postresolve.sock'
+# Exit status when the daemon fails, as for sendmail (EX_TEMPFAIL)
+TEMPFAIL = 75
+USAGE = "Usage: postresolve-client [-S socket] [-C dir | -P file] [-b | -c] [-l] [-f] [-v] <address>"
+# Options that are only used by postresolve if the daemon isn't there
+FALLBACK_OPTIONS = ('-C', '--config-dir', '-P', '--postconf-file')
+
+
+def read_netstring(f):
+    """Returns the contents of the next netstring in the binary file <f>."""
+    length = b''
+    while True:
+        c = f.read(1)
+        if c == b':':
+            break
+        if not c.isdigit() or len(length) > 10:
+            raise ValueError("bad netstring length")
+        length += c
+    data = f.read(int(length) + 1)
+    if len(data) != int(length) + 1 or not data.endswith(b','):
+        raise ValueError("truncated netstring")
+    return data[:-1]
+
+
+def query(sock, name, key):
+    """
+    Returns the status ("OK", "NOTFOUND", "TEMP", etc.) and the value of a
+    lookup of <key> in the map <name> over the connected socket <sock>.
+    """
+
+    request = ("%s %s" % (name, key)).encode('utf-8')
+    sock.sendall(b"%d:%s," % (len(request), request))
+    with sock.makefile('rb') as f:
+        reply = read_netstring(f).decode('utf-8')
+    status, space, value = reply.partition(' ')
+    return status, value
+
+
+def connect(path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except socket.error:
+        sock.close()
+        raise
+    return sock
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    try:
+        opts, args = getopt.getopt(argv, 'S:C:P:bcflvdh', ['socket=', 'config-dir=', 'postconf-file=',
+                                                           'brief', 'compatible', 'first-only',
+                                                           'local-only', 'help'])
+    except getopt.GetoptError as e:
+        print("%s\n%s" % (e, USAGE), file=sys.stderr)
+        return 2
+    path = os.environ.get('POSTRESOLVE_SOCKET', DEFAULT_SOCKET)
+    mode = 'standard'
+    local_only = first_only = False
+    for opt, value in opts:
+        if opt in ('-S', '--socket'):
+            path = value
+        elif opt in ('-b', '--brief'):
+            mode = 'brief'
+        elif opt in ('-c', '--compatible'):
+            mode = 'compatible'
+        elif opt in ('-l', '--local-only'):
+            local_only = True
+        elif opt in ('-f', '--first-only'):
+            first_only = True
+        elif opt == '-v':
+            mode, local_only = 'compatible', True
+        elif opt in ('-h', '--help'):
+            print(USAGE)
+            return 0
+    if len(args) != 1:
+        print(USAGE, file=sys.stderr)
+        return 2
+
+    try:
+        sock = connect(path)
+    except socket.error as e:
+        if e.errno not in (errno.ENOENT, errno.ECONNREFUSED):
+            raise
+        # Without the daemon, resolves it here
+        from .cli import main as postresolve
+        fallback_args = []
+        for opt, value in opts:
+            if opt in FALLBACK_OPTIONS:
+                fallback_args += [opt, value]
+            elif opt not in ('-S', '--socket'):
+                fallback_args.append(opt)
+        return postresolve(fallback_args + args)
+    try:
+        status, value = query(sock, mode + ('-local' if local_only else ''), args[0])
+    finally:
+        sock.close()
+
+    if status == 'OK':
+        lines = value.split('\n')
+        print("\n".join(lines[:1] if first_only else lines))
+    elif status != 'NOTFOUND':
+        print("postresolve-client: %s %s" % (status, value), file=sys.stderr)
+        return TEMPFAIL
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())  # pragma: no cover
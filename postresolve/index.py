@@ -0,0 +1,416 @@
+"""
+An index of where every address in the tables ends up, "postresolve-index",
+for auditing e.g. which addresses reach a given mailbox without running
+postresolve once per address.
+
+"build" expands every key of $alias_maps, $virtual_alias_maps and
+$virtual_mailbox_maps in one walk, so that shared expansions (e.g. an
+alias used by thousands of virtual addresses) are only done once, and
+stores in an SQLite database:
+
+- the forward index, of each key to its destinations (see
+  resolver.Destination), each of which is stored once and numbered, with
+  an index on the numbers for the reverse lookup
+- the files read and their times, a digest of the value of each key, and
+  the edges of the walk (each address or user to those it expands to)
+
+Addresses and users are numbered by a 64-bit hash of their names, so that
+only the keys' names need to be stored.
+
+Building again only expands the keys that have changed in the tables
+whose files have changed, and those that (by the edges) lead to them.
+Anything else changing (main.cf, the password file, regexp: tables or
+:include: files) means everything is expanded again.  Tables that can't
+be listed (e.g. regexp: or ldap:) are still used for expansion, but their
+keys aren't indexed.
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+import sys
+import time
+import hashlib
+import sqlite3
+import urllib.parse
+
+import click
+
+from .cli import make_logger, load_conf, config_files
+from .resolver import Resolver, Destination, format_destination
+
+
+SCHEMA_VERSION = 1
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    mtime REAL,
+    size INTEGER
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS tables (
+    id INTEGER PRIMARY KEY,
+    spec TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS names (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS entries (
+    table_id INTEGER NOT NULL REFERENCES tables (id),
+    name_id INTEGER NOT NULL,
+    digest INTEGER NOT NULL,
+    PRIMARY KEY (table_id, name_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS edges (
+    child_id INTEGER NOT NULL,
+    parent_id INTEGER NOT NULL,
+    PRIMARY KEY (child_id, parent_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS edges_parent_id ON edges (parent_id);
+CREATE TABLE IF NOT EXISTS destinations (
+    id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    value TEXT NOT NULL COLLATE NOCASE,
+    transport TEXT
+);
+CREATE INDEX IF NOT EXISTS destinations_value ON destinations (value);
+CREATE TABLE IF NOT EXISTS forward (
+    name_id INTEGER NOT NULL REFERENCES names (id),
+    position INTEGER NOT NULL,
+    destination_id INTEGER NOT NULL REFERENCES destinations (id),
+    PRIMARY KEY (name_id, position)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS forward_destination_id ON forward (destination_id);
+"""
+TABLES = ('files', 'tables', 'names', 'entries', 'edges', 'destinations', 'forward')
+
+# Whose changes mean expanding everything again, as well as main.cf
+PASSWD = '/etc/passwd'
+# Numbers looked up at once when following edges back
+QUERY_SIZE = 500
+
+
+def connect(path):
+    db = sqlite3.connect(path, isolation_level=None)
+    db.execute("PRAGMA journal_mode = WAL")
+    db.execute("PRAGMA synchronous = NORMAL")
+    version = db.execute("PRAGMA user_version").fetchone()[0]
+    if version not in (0, SCHEMA_VERSION):
+        raise ValueError("%s has an unsupported schema version (%d)" % (path, version))
+    db.executescript(SCHEMA)
+    db.execute("PRAGMA user_version = %d" % SCHEMA_VERSION)
+    return db
+
+
+def connect_readonly(path):
+    """
+    Opens the index at <path> for reading only, so that a query doesn't
+    need write access or create an index that isn't there.
+    """
+
+    uri = 'file:%s?mode=ro' % urllib.parse.quote(os.path.abspath(path))
+    db = sqlite3.connect(uri, uri=True)
+    try:
+        version = db.execute("PRAGMA user_version").fetchone()[0]
+    except sqlite3.DatabaseError as e:
+        db.close()
+        raise ValueError("%s: %s" % (path, e))
+    if version != SCHEMA_VERSION:
+        db.close()
+        raise ValueError("%s isn't a postresolve index (schema version %d)" % (path, version))
+    return db
+
+
+def digest(value):
+    """Returns a 64-bit hash of the string <value>, e.g. a name or a table's value."""
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(),
+                          'big', signed=True)
+
+
+def file_state(path):
+    """Returns the modification time and size of <path>, or Nones."""
+    try:
+        st = os.stat(path)
+        return st.st_mtime, st.st_size
+    except OSError:
+        return None, None
+
+
+def in_chunks(items, size=QUERY_SIZE):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class TracingResolver(Resolver):
+    """A Resolver that records which address or user each one expands to."""
+
+    def __init__(self, *args, **kwargs):
+        super(TracingResolver, self).__init__(*args, **kwargs)
+        self.stack = []
+        # Set of (child, parent) tuples
+        self.edges = set()
+
+
+    def expand(self, item, depth):
+        if item.startswith(('/', '|')):
+            return super(TracingResolver, self).expand(item, depth)
+        key = item.lower()
+        if self.stack:
+            self.edges.add((key, self.stack[-1]))
+        self.stack.append(key)
+        try:
+            return super(TracingResolver, self).expand(item, depth)
+        finally:
+            self.stack.pop()
+
+
+class IndexBuilder(object):
+    """
+    Brings the index in the database <db> up to date with the tables of
+    <resolver> (a TracingResolver), where the parameters come from
+    <config_files>.
+    """
+
+    def __init__(self, db, resolver, config_files, logger):
+        self.db = db
+        self.resolver = resolver
+        self.config_files = list(config_files) + [PASSWD]
+        self.log = logger
+        # Mapping of spec to table, of the tables that can be listed
+        self.tables = {}
+        for maps in (resolver.alias_maps, resolver.virtual_alias_maps,
+                     resolver.virtual_mailbox_maps):
+            for spec, table in maps:
+                if hasattr(table, 'items'):
+                    self.tables[spec] = table
+                else:
+                    self.log.warning("Can't list the keys of %s, so they won't be indexed", spec)
+        # Mapping of Destination (as a tuple) to its number, and the rows of
+        # those that are new
+        self.destination_ids = {}
+        self.new_destinations = []
+        self.next_destination_id = 1
+        # Mapping of each key to its number
+        self.key_ids = {}
+
+
+    def keys(self):
+        """Returns a mapping of the number of each key in the tables to the key."""
+        key_ids = self.key_ids
+        for table in self.tables.values():
+            for key, value in table.items():
+                if key not in key_ids:
+                    key_ids[key] = digest(key)
+        return dict((name_id, key) for key, name_id in key_ids.items())
+
+
+    def changed_files(self):
+        """Returns the set of files that have changed, or been added, since the last build."""
+        stored = dict((path, (mtime, size)) for path, mtime, size in
+                      self.db.execute("SELECT path, mtime, size FROM files"))
+        paths = self.resolver.files() | set(self.config_files) | set(stored)
+        return set(path for path in paths if stored.get(path) != file_state(path))
+
+
+    def build(self, full=False):
+        """Returns the number of keys expanded, and of keys altogether."""
+        db = self.db
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            changed = self.changed_files()
+            table_files = dict((table.path, spec) for spec, table in self.tables.items()
+                               if hasattr(table, 'path'))
+            # The list of tables can only change with main.cf
+            full = (full or not db.execute("SELECT 1 FROM files LIMIT 1").fetchone()
+                    or any(path not in table_files for path in changed))
+            keys = self.keys()
+            if full:
+                self.log.debug("Expanding every key")
+                for table in TABLES:
+                    db.execute("DELETE FROM %s" % table)
+                db.executemany("INSERT INTO tables VALUES (?, ?)",
+                               [(table_id, spec) for table_id, spec in enumerate(sorted(self.tables), 1)])
+            table_ids = dict((spec, table_id) for table_id, spec in db.execute("SELECT id, spec FROM tables"))
+
+            if full:
+                for spec in self.tables:
+                    self.update_entries(spec, table_ids[spec])
+                expand = set(keys)
+            else:
+                self.load_destinations()
+                changed_ids = set()
+                for path in changed:
+                    self.log.debug("%s has changed", path)
+                    spec = table_files[path]
+                    changed_ids |= self.update_entries(spec, table_ids[spec])
+                affected = self.ancestors(changed_ids)
+                for chunk in in_chunks(affected):
+                    marks = ",".join("?" * len(chunk))
+                    db.execute("DELETE FROM edges WHERE parent_id IN (%s)" % marks, chunk)
+                    db.execute("DELETE FROM forward WHERE name_id IN (%s)" % marks, chunk)
+                    db.execute("DELETE FROM names WHERE id IN (%s)" % marks, chunk)
+                expand = affected.intersection(keys)
+            self.expand(sorted((keys[name_id], name_id) for name_id in expand))
+            if not full:
+                db.execute("DELETE FROM destinations WHERE id NOT IN"
+                           " (SELECT destination_id FROM forward)")
+            db.execute("DELETE FROM files")
+            db.executemany("INSERT INTO files VALUES (?, ?, ?)",
+                           [(path,) + file_state(path) for path in
+                            self.resolver.files() | set(self.config_files)])
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+        return len(expand), len(keys)
+
+
+    def load_destinations(self):
+        self.destination_ids = dict(
+            ((kind, value, transport), destination_id) for destination_id, kind, value, transport
+            in self.db.execute("SELECT id, kind, value, transport FROM destinations"))
+        self.next_destination_id = max(self.destination_ids.values() or [0]) + 1
+
+
+    def destination_id(self, destination):
+        try:
+            return self.destination_ids[destination]
+        except KeyError:
+            pass
+        destination_id = self.next_destination_id
+        self.next_destination_id += 1
+        self.destination_ids[destination] = destination_id
+        self.new_destinations.append((destination_id,) + destination)
+        return destination_id
+
+
+    def update_entries(self, spec, table_id):
+        """Stores the digests of the table's values, returning the numbers of the keys that have changed."""
+        db = self.db
+        stored = dict(db.execute("SELECT name_id, digest FROM entries WHERE table_id = ?", (table_id,)))
+        current = dict((self.key_ids[key], digest(value)) for key, value in self.tables[spec].items())
+        changed = set(name_id for name_id in set(stored) | set(current)
+                      if stored.get(name_id) != current.get(name_id))
+        db.execute("DELETE FROM entries WHERE table_id = ?", (table_id,))
+        db.executemany("INSERT INTO entries VALUES (?, ?, ?)",
+                       [(table_id, name_id, value) for name_id, value in sorted(current.items())])
+        return changed
+
+
+    def ancestors(self, name_ids):
+        """Returns the <name_ids> and those of everything that expands to them, by the stored edges."""
+        found = set(name_ids)
+        frontier = set(name_ids)
+        while frontier:
+            parents = set()
+            for chunk in in_chunks(frontier):
+                parents.update(row[0] for row in self.db.execute(
+                    "SELECT parent_id FROM edges WHERE child_id IN (%s)" % ",".join("?" * len(chunk)),
+                    chunk))
+            frontier = parents - found
+            found |= frontier
+        return found
+
+
+    def expand(self, keys):
+        """Expands the (key, number) pairs <keys>, storing the results and the edges walked."""
+        resolver = self.resolver
+        destination_id = self.destination_id
+        rows = []
+        for key, name_id in keys:
+            for position, destination in enumerate(resolver.resolve(key)):
+                rows.append((name_id, position, destination_id(tuple(destination))))
+        edges = sorted(set((digest(child), digest(parent)) for child, parent in resolver.edges))
+        db = self.db
+        db.executemany("INSERT INTO names VALUES (?, ?)", [(name_id, key) for key, name_id in keys])
+        db.executemany("INSERT INTO destinations VALUES (?, ?, ?, ?)", self.new_destinations)
+        db.executemany("INSERT INTO forward VALUES (?, ?, ?)", sorted(rows))
+        db.executemany("INSERT OR IGNORE INTO edges VALUES (?, ?)", edges)
+        self.new_destinations = []
+
+
+def forward(db, address):
+    """Returns the Destinations of <address> (or a user), or None if it isn't indexed."""
+    name_id = digest(address.lower())
+    rows = db.execute("SELECT d.kind, d.value, d.transport FROM forward f"
+                      " JOIN destinations d ON d.id = f.destination_id"
+                      " WHERE f.name_id = ? ORDER BY f.position", (name_id,)).fetchall()
+    if not rows and not db.execute("SELECT 1 FROM names WHERE id = ?", (name_id,)).fetchone():
+        return None
+    return [Destination(*row) for row in rows]
+
+
+def reverse(db, value):
+    """
+    Returns the addresses and users that end up at <value>: a mailbox
+    path, user, command or remote address.
+    """
+
+    return [row[0] for row in db.execute(
+        "SELECT DISTINCT n.name FROM destinations d JOIN forward f ON f.destination_id = d.id"
+        " JOIN names n ON n.id = f.name_id WHERE d.value = ? ORDER BY n.name", (value,))]
+
+
+@click.group()
+def main():
+    """Builds and queries an index of where each address in the tables ends up."""
+
+
+@main.command()
+@click.option('-i', '--index', 'path', type=click.Path(dir_okay=False), required=True,
+              help="SQLite database to bring up to date")
+@click.option('-C', '--config-dir', type=click.Path(file_okay=False),
+              help="Uses main.cf in <config_dir>")
+@click.option('-P', '--postconf-file', type=click.Path(dir_okay=False, exists=True),
+              help="Reads the parameters from <file> (the saved output of postconf) instead of running postconf")
+@click.option('--full', is_flag=True, default=False, help="Expands every key, even if nothing has changed")
+@click.option('-d', '--debug', count=True, help="Shows each lookup")
+def build(path, config_dir, postconf_file, full, debug):
+    """Expands the keys of the tables that have changed since the last build."""
+    logger = make_logger(debug)
+    conf = load_conf(config_dir, postconf_file)
+    start = time.time()
+    builder = IndexBuilder(connect(path), TracingResolver(conf, logger),
+                           config_files(conf, config_dir, postconf_file), logger)
+    expanded, keys = builder.build(full)
+    print("Expanded %d of %d keys in %.2fs" % (expanded, keys, time.time() - start), file=sys.stderr)
+
+
+@main.command()
+@click.option('-i', '--index', 'path', type=click.Path(exists=True, dir_okay=False), required=True,
+              help="SQLite database written by \"postresolve-index build\"")
+@click.option('-r', '--reverse', 'reverse_lookup', is_flag=True, default=False,
+              help="Shows the addresses that end up at each <value> (mailbox, user, command or address)")
+@click.option('-b', '--brief', 'mode', flag_value='brief',
+              help="Doesn't annotate users, filenames, etc.")
+@click.option('-c', '--compatible', 'mode', flag_value='compatible',
+              help="Output similar to \"sendmail -bv\" on a sendmail system")
+@click.argument('values', nargs=-1, required=True)
+def query(path, reverse_lookup, mode, values):
+    """Shows where each address ends up, or with -r what ends up at each value."""
+    try:
+        db = connect_readonly(path)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    status = 0
+    for value in values:
+        prefix = "%s\t" % value if len(values) > 1 else ""
+        if reverse_lookup:
+            lines = reverse(db, value)
+        else:
+            destinations = forward(db, value)
+            if destinations is None:
+                click.echo("%s isn't in the index" % value, err=True)
+                status = 1
+                continue
+            lines = [format_destination(destination, mode or 'standard') for destination in destinations]
+        for line in lines:
+            click.echo(prefix + line)
+    db.close()
+    sys.exit(status)
+
+
+if __name__ == "__main__":
+    sys.exit(main())  # pragma: no cover
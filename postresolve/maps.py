@@ -0,0 +1,323 @@
+"""
+Postfix lookup tables, read from the files they're made from rather than
+by running "postmap -q" or "postalias -q" for each lookup:
+
+- hash:, btree:, cdb:, lmdb:, dbm: and sdbm: tables are read from their
+  source text file (e.g. /etc/postfix/virtual for
+  hash:/etc/postfix/virtual, rather than virtual.db), as is texthash:
+- regexp: and pcre: tables are compiled as Python regexes
+- static: and inline: tables are parsed from the spec itself
+
+Any other type (e.g. ldap: or mysql:), or an indexed table whose source
+file has gone, is looked up with postmap (or postalias), once per key.
+"""
+
+from __future__ import absolute_import
+
+import re
+import subprocess
+
+
+# Tables made from a text file by postmap or postalias
+INDEXED_TYPES = ('hash', 'btree', 'cdb', 'lmdb', 'dbm', 'sdbm')
+# The default_database_type, for specs without a type
+DEFAULT_TYPE = 'hash'
+# POSIX character classes, which Python's re doesn't have
+POSIX_CLASSES = {
+    '[:alpha:]': 'a-zA-Z', '[:digit:]': '0-9', '[:alnum:]': 'a-zA-Z0-9',
+    '[:upper:]': 'A-Z', '[:lower:]': 'a-z', '[:space:]': r'\s', '[:blank:]': r' \t',
+    '[:punct:]': r'!-/:-@\[-`{-~', '[:xdigit:]': '0-9A-Fa-f',
+}
+RESULT_REFERENCE_RE = re.compile(r'\$(?:\$|(\d)|\{(\d+)\})')
+
+
+def split_maps(value):
+    """
+    Splits a list of table specs on commas and/or whitespace, except inside
+    braces, as in "inline:{ a=b, c=d }".
+    """
+
+    maps = []
+    spec = ''
+    depth = 0
+    for c in value:
+        if c == '{':
+            depth += 1
+        elif c == '}':
+            depth -= 1
+        elif depth <= 0 and (c == ',' or c.isspace()):
+            if spec:
+                maps.append(spec)
+            spec = ''
+            continue
+        spec += c
+    if spec:
+        maps.append(spec)
+    return maps
+
+
+def open_map(spec, aliases=False, logger=None):
+    """
+    Returns a table for the <spec>, e.g. "hash:/etc/aliases".  <aliases>
+    says that its source is in aliases(5) format.
+    """
+
+    map_type, colon, name = spec.partition(':')
+    if not colon:
+        map_type, name = DEFAULT_TYPE, spec
+    if map_type == 'proxy':
+        return open_map(name, aliases, logger)
+    try:
+        if map_type in INDEXED_TYPES or map_type == 'texthash':
+            return TextMap(name, aliases)
+        if map_type in ('regexp', 'pcre'):
+            return RegexpMap(name, map_type)
+        if map_type == 'static':
+            return StaticMap(name)
+        if map_type == 'inline':
+            return InlineMap(name)
+    except (IOError, OSError) as e:
+        if map_type not in INDEXED_TYPES:
+            raise
+        if logger:
+            logger.debug("Can't read the source of %s (%s); querying it instead", spec, e)
+    return CommandMap(spec, aliases)
+
+
+def logical_lines(f):
+    """
+    Yields the lines of the file <f>, with those that start with whitespace
+    joined onto the line before, skipping blank lines and comments.
+    """
+
+    line = None
+    for text in f:
+        text = text.rstrip('\r\n')
+        stripped = text.strip()
+        if not stripped or stripped.startswith('#'):
+            continue
+        if text[0].isspace() and line is not None:
+            line += ' ' + stripped
+            continue
+        if line is not None:
+            yield line
+        line = stripped
+    if line is not None:
+        yield line
+
+
+def parse_table(f):
+    """Yields the (key, value) pairs in the postmap(1) source file <f>."""
+    for line in logical_lines(f):
+        fields = line.split(None, 1)
+        if len(fields) == 2:
+            yield fields[0], fields[1]
+
+
+def parse_aliases(f):
+    """Yields the (name, value) pairs in the aliases(5) file <f>."""
+    for line in logical_lines(f):
+        if line.startswith('"'):
+            end = line.find('"', 1)
+            name, rest = line[1:end], line[end + 1:]
+            colon, value = rest[:1], rest[1:]
+        else:
+            name, colon, value = line.partition(':')
+        if colon == ':':
+            yield name.strip(), value.strip()
+
+
+class TextMap(object):
+    """An indexed table, read from its source file <path>."""
+
+    def __init__(self, path, aliases=False):
+        self.path = path
+        self.table = {}
+        with open(path) as f:
+            for key, value in (parse_aliases if aliases else parse_table)(f):
+                # As for postmap, the first of duplicate keys is kept
+                self.table.setdefault(key.lower(), value)
+
+
+    def lookup(self, key):
+        return self.table.get(key.lower())
+
+
+    def items(self):
+        """Returns the (lower-case) keys and their values, for listing the table."""
+        return self.table.items()
+
+
+def find_delimiter(text, delimiter, start):
+    """Returns the index of the first unescaped <delimiter> from <start>, or -1."""
+    i = start
+    while i < len(text):
+        if text[i] == '\\':
+            i += 2
+            continue
+        if text[i] == delimiter:
+            return i
+        i += 1
+    return -1
+
+
+def translate_posix(pattern):
+    for name, chars in POSIX_CLASSES.items():
+        pattern = pattern.replace(name, chars)
+    return pattern
+
+
+def expand_result(result, m):
+    """Substitutes $1, ${1} etc. in <result> with the groups of <m>."""
+    def substitute(ref):
+        if ref.group(0) == '$$':
+            return '$'
+        n = int(ref.group(1) or ref.group(2))
+        return (m.group(n) if m and n <= m.re.groups else None) or ''
+    return RESULT_REFERENCE_RE.sub(substitute, result)
+
+
+class RegexpMap(object):
+    """
+    A regexp: or pcre: table in the file <path>: "/pattern/flags result"
+    rules, with "!" for rules that match when the pattern doesn't, and
+    if/endif blocks.
+    """
+
+    def __init__(self, path, map_type='regexp'):
+        self.path = path
+        self.map_type = map_type
+        # List of (kind, re_object, negated, value) tuples, where kind is
+        # 'rule', 'if' (whose value is the index after its endif) or 'endif'
+        self.rules = []
+        ifs = []
+        with open(path) as f:
+            for line in logical_lines(f):
+                if line == 'endif':
+                    if ifs:
+                        start = ifs.pop()
+                        self.rules[start] = self.rules[start][:3] + (len(self.rules) + 1,)
+                    self.rules.append(('endif', None, False, None))
+                    continue
+                kind = 'rule'
+                if line.startswith('if') and line[2:3].isspace():
+                    kind = 'if'
+                    line = line[2:].lstrip()
+                regex, negated, rest = self.parse_pattern(line)
+                if regex is None:
+                    continue
+                if kind == 'if':
+                    ifs.append(len(self.rules))
+                self.rules.append((kind, regex, negated, rest.strip()))
+        for start in ifs:
+            # Without an endif, runs to the end of the file
+            self.rules[start] = self.rules[start][:3] + (len(self.rules),)
+
+
+    def parse_pattern(self, line):
+        """Returns the re_object, whether it's negated, and the rest of <line>."""
+        negated = line.startswith('!')
+        if negated:
+            line = line[1:]
+        if not line:
+            return None, False, ''
+        delimiter = line[0]
+        end = find_delimiter(line, delimiter, 1)
+        if end < 0:
+            return None, False, ''
+        pattern = line[1:end]
+        flags_end = end + 1
+        while flags_end < len(line) and line[flags_end].isalpha():
+            flags_end += 1
+        flags = re.IGNORECASE
+        for flag in line[end + 1:flags_end]:
+            if flag == 'i':
+                flags ^= re.IGNORECASE
+            elif flag == 'm':
+                flags ^= re.MULTILINE
+            elif flag == 'x' and self.map_type == 'pcre':
+                flags ^= re.VERBOSE
+        if self.map_type == 'regexp':
+            pattern = translate_posix(pattern)
+        return re.compile(pattern, flags), negated, line[flags_end:]
+
+
+    def lookup(self, key):
+        rules = self.rules
+        i = 0
+        while i < len(rules):
+            kind, regex, negated, value = rules[i]
+            i += 1
+            if kind == 'endif':
+                continue
+            m = regex.search(key)
+            if negated:
+                m, matched = None, m is None
+            else:
+                matched = m is not None
+            if kind == 'if':
+                if not matched:
+                    i = value
+            elif matched:
+                return expand_result(value, m)
+        return None
+
+
+def strip_braces(text):
+    text = text.strip()
+    if text.startswith('{') and text.endswith('}'):
+        return text[1:-1].strip()
+    return text
+
+
+class StaticMap(object):
+    """Always finds <value>, e.g. for "static:{ some text }"."""
+
+    def __init__(self, value):
+        self.value = strip_braces(value)
+
+
+    def lookup(self, key):
+        return self.value
+
+
+class InlineMap(object):
+    """A table in the spec itself, e.g. "inline:{ a=b, { c = d e } }"."""
+
+    def __init__(self, text):
+        self.table = {}
+        for item in split_maps(strip_braces(text)):
+            key, eq, value = strip_braces(item).partition('=')
+            if eq:
+                self.table.setdefault(key.strip().lower(), value.strip())
+
+
+    def lookup(self, key):
+        return self.table.get(key.lower())
+
+
+    def items(self):
+        return self.table.items()
+
+
+class CommandMap(object):
+    """Looks keys up with postmap -q (or postalias -q), remembering the results."""
+
+    def __init__(self, spec, aliases=False):
+        self.spec = spec
+        self.command = 'postalias' if aliases else 'postmap'
+        self.results = {}
+
+
+    def lookup(self, key):
+        try:
+            return self.results[key]
+        except KeyError:
+            pass
+        process = subprocess.Popen([self.command, '-q', key, self.spec],
+                                   stdout=subprocess.PIPE, universal_newlines=True)
+        output = process.communicate()[0]
+        # Exits with 1 if the key isn't found
+        result = output.rstrip('\n') if process.returncode == 0 else None
+        self.results[key] = result
+        return result
@@ -0,0 +1,96 @@
+"""
+Postfix's main.cf parameters, as printed by one run of postconf(1) (with
+the defaults of those that aren't set), with "$name" references expanded
+as Postfix would.
+"""
+
+from __future__ import absolute_import
+
+import re
+import subprocess
+
+
+# "$name", "${name}" or "$(name)", and the conditional "${name?value}" and
+# "${name:value}" forms; "$$" is a literal "$"
+REFERENCE_RE = re.compile(r'\$(?:\$|(\w+)|[{(](\w+)(?:([?:])([^})]*))?[})])')
+# Of nested references, beyond which the rest are left unexpanded
+MAX_DEPTH = 100
+
+
+def run_postconf(config_dir=None):
+    """Returns the output of postconf, for main.cf in <config_dir> if given."""
+    command = ['postconf']
+    if config_dir:
+        command += ['-c', config_dir]
+    return subprocess.check_output(command, universal_newlines=True)
+
+
+def parse(text):
+    """Returns a dict of the "name = value" lines of postconf's output."""
+    params = {}
+    for line in text.splitlines():
+        name, eq, value = line.partition('=')
+        if eq:
+            params[name.strip()] = value.strip()
+    return params
+
+
+def split_list(value):
+    """Splits a list-valued parameter on commas and/or whitespace."""
+    return [item for item in re.split(r'[\s,]+', value) if item]
+
+
+class PostConf(object):
+    """The parameters in the dict <params>, expanded when asked for."""
+
+    def __init__(self, params):
+        self.params = params
+        self.cache = {}
+
+
+    @classmethod
+    def load(cls, config_dir=None):
+        return cls(parse(run_postconf(config_dir)))
+
+
+    @classmethod
+    def read(cls, path):
+        """From a file of postconf's output."""
+        with open(path) as f:
+            return cls(parse(f.read()))
+
+
+    def get(self, name, default=''):
+        try:
+            return self.cache[name]
+        except KeyError:
+            pass
+        if name not in self.params:
+            return default
+        value = self.expand(self.params[name])
+        self.cache[name] = value
+        return value
+
+
+    def get_list(self, name):
+        return split_list(self.get(name))
+
+
+    def expand(self, value, depth=0):
+        if '$' not in value:
+            return value
+
+        def substitute(m):
+            if m.group(0) == '$$':
+                return '$'
+            name = m.group(1) or m.group(2)
+            if depth >= MAX_DEPTH:
+                return m.group(0)
+            referenced = self.expand(self.params.get(name, ''), depth + 1)
+            if m.group(3) == '?':
+                return self.expand(m.group(4), depth + 1) if referenced else ''
+            if m.group(3) == ':':
+                return '' if referenced else self.expand(m.group(4), depth + 1)
+            return referenced
+
+        return REFERENCE_RE.sub(substitute, value)
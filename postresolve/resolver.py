@@ -0,0 +1,295 @@
+"""
+Resolves an address as Postfix would, following the steps in
+http://www.postfix.org/ADDRESS_REWRITING_README.html#overview that are of
+interest for local recipients:
+
+1. virtual aliasing ($virtual_alias_maps)
+2. resolving the address to a destination: a virtual mailbox
+   ($virtual_mailbox_maps), a local domain ($mydestination etc.) or
+   somewhere else
+3. local aliasing ($alias_maps) and then the password file
+
+Canonical mapping, $transport_maps, the relocated table and .forward
+files aren't (yet) taken into account.
+
+Everything that's needed from main.cf is read once (see postconf.py), and
+the tables as they're opened (see maps.py).  The expansion of each address
+and user is remembered, so that aliases shared by several others are only
+looked up once, and an alias that leads back to itself (directly or via
+others) is delivered as it is, as Postfix does, rather than expanded again.
+"""
+
+from __future__ import absolute_import
+
+import re
+import pwd
+import collections
+
+from .postconf import split_list
+from .maps import open_map, split_maps
+
+
+# Kinds of Destination
+FILE = 'file'
+COMMAND = 'command'
+MAILBOX = 'mailbox'
+VIA = 'via'
+LOCAL = 'local'
+REMOTE = 'remote'
+MISSING = 'missing'
+
+# Nested expansions, beyond which an address is delivered as it is
+MAX_DEPTH = 100
+
+# An item in the result of an alias or virtual alias lookup: a quoted
+# string (e.g. a command with arguments) or something without spaces
+VALUE_RE = re.compile(r'"(?:[^"\\]|\\.)*"[^\s,]*|[^\s,]+')
+
+# Where an address ends up: <value> is a path, command, address or user, and
+# <transport> is only for VIA and LOCAL
+Destination = collections.namedtuple('Destination', 'kind value transport')
+
+
+def split_values(value):
+    """Splits the result of an alias lookup, leaving quoted strings intact."""
+    return [unquote(item) for item in VALUE_RE.findall(value)]
+
+
+def unquote(item):
+    if len(item) > 1 and item.startswith('"') and item.endswith('"'):
+        return item[1:-1]
+    return item
+
+
+def strip_brackets(address):
+    """Returns e.g. "a@b" for "<a@b>"."""
+    return re.sub(r'<(.*)>', r'\1', address.strip())
+
+
+def transport_name(value):
+    """Returns e.g. "local" for "local:$myhostname"."""
+    return value.partition(':')[0]
+
+
+def passwd_user_exists(user):
+    try:
+        pwd.getpwnam(user)
+        return True
+    except KeyError:
+        return False
+
+
+def format_destination(destination, mode='standard', local_only=False):
+    """
+    Returns the line that postresolve shows for the Destination in <mode>
+    ('standard', 'brief' or 'compatible', i.e. like "sendmail -bv"), or None.
+    """
+
+    kind, value, transport = destination
+    if kind == LOCAL:
+        if mode == 'brief':
+            return value
+        if mode == 'compatible':
+            # See sendmail's source, or line 861 of spamass-milter.cpp
+            return "... deliverable: mailer %s, user %s" % (transport, value)
+        return "%s: local" % value
+    if kind == COMMAND:
+        return "run command: %s" % value
+    if kind == VIA:
+        return "via: %s [%s]" % (transport, value)
+    if kind == MISSING:
+        return "%s not found!" % value
+    if kind == REMOTE and local_only:
+        return None
+    return value
+
+
+def format_lines(destinations, mode='standard', local_only=False):
+    """Returns the lines shown for the <destinations>, as for format_destination()."""
+    return [line for line in (format_destination(destination, mode, local_only)
+                              for destination in destinations)
+            if line is not None]
+
+
+class Resolver(object):
+    """
+    Resolves addresses with the main.cf parameters in <conf> (a
+    postconf.PostConf).  <user_exists> checks a local user name, by default
+    against the password file.
+    """
+
+    def __init__(self, conf, logger, user_exists=None):
+        self.conf = conf
+        self.log = logger
+        self.user_exists = user_exists or passwd_user_exists
+        # Files read other than tables, e.g. by :include:
+        self.files_read = set()
+        self.alias_maps = self.open_maps('alias_maps', aliases=True)
+        self.virtual_alias_maps = self.open_maps('virtual_alias_maps')
+        self.virtual_mailbox_maps = self.open_maps('virtual_mailbox_maps')
+        self.virtual_transport = transport_name(conf.get('virtual_transport', 'virtual'))
+        self.virtual_mailbox_base = conf.get('virtual_mailbox_base')
+        self.local_transport = transport_name(conf.get('local_transport', 'local'))
+        self.local_domains = self.find_local_domains()
+        # Mapping of (lower-case) address or user to its Destinations
+        self.expansions = {}
+        # Those being expanded
+        self.active = set()
+
+
+    def files(self):
+        """Returns the set of paths of the files that have been read."""
+        paths = set(self.files_read)
+        for maps in (self.alias_maps, self.virtual_alias_maps, self.virtual_mailbox_maps):
+            paths.update(table.path for spec, table in maps if hasattr(table, 'path'))
+        return paths
+
+
+    def forget(self):
+        """Forgets the expansions and results of postmap queries remembered so far."""
+        self.expansions.clear()
+        for maps in (self.alias_maps, self.virtual_alias_maps, self.virtual_mailbox_maps):
+            for spec, table in maps:
+                if hasattr(table, 'results'):
+                    table.results.clear()
+
+
+    def open_maps(self, name, aliases=False):
+        return [(spec, open_map(spec, aliases, self.log)) for spec in split_maps(self.conf.get(name))]
+
+
+    def find_local_domains(self):
+        """
+        Returns the set of domains in $mydestination, $inet_interfaces and
+        $proxy_interfaces, where files (e.g. $myorigin as /etc/mailname) are
+        read for their domains.
+        """
+
+        domains = set()
+        for item in split_list(" ".join(self.conf.get(name) for name in
+                                        ('mydestination', 'inet_interfaces', 'proxy_interfaces'))):
+            if item.startswith('/'):
+                self.files_read.add(item)
+                try:
+                    with open(item) as f:
+                        domains.update(split_list(f.read().lower()))
+                except (IOError, OSError) as e:
+                    self.log.warning("Can't read %s: %s", item, e)
+            elif item == 'loopback-only':
+                domains.update(('127.0.0.1', '::1'))
+            elif ':' in item and not item.startswith('['):
+                self.log.debug("Ignoring table %s in the local domains", item)
+            elif item != 'all':
+                domains.add(item.lower())
+        return domains
+
+
+    def lookup(self, maps, key):
+        """Returns the result from the first of <maps> that has <key>, or None."""
+        for spec, table in maps:
+            result = table.lookup(key)
+            self.log.debug("Looked up %s in %s: %s", key, spec, result)
+            if result:
+                return result
+        return None
+
+
+    def resolve(self, address):
+        """Returns the Destinations of the address or user, without duplicates."""
+        destinations = []
+        for destination in self.expand(unquote(strip_brackets(address)), 0)[0]:
+            if destination not in destinations:
+                destinations.append(destination)
+        return destinations
+
+
+    def expand(self, item, depth):
+        """
+        Returns the Destinations of an item from an alias or the command line,
+        and the set of those being expanded at which an alias loop was cut
+        short under it.  While the latter isn't empty, the result depends on
+        where the item was reached from, so it isn't remembered.
+        """
+
+        if item.startswith('/'):
+            return [Destination(FILE, item, None)], set()
+        if item.startswith('|'):
+            return [Destination(COMMAND, item, None)], set()
+
+        key = item.lower()
+        try:
+            return self.expansions[key], set()
+        except KeyError:
+            pass
+        if key in self.active or depth >= MAX_DEPTH:
+            self.log.debug("Alias loop at %s; delivering it as it is", item)
+            if key.startswith(':include:'):
+                return [], {key}
+            destinations, loops = self.deliver(item, depth)
+            return destinations, loops | {key}
+
+        self.active.add(key)
+        try:
+            if key.startswith(':include:'):
+                destinations, loops = self.expand_include(item[len(':include:'):], depth)
+            else:
+                destinations, loops = self.expand_aliases(item, depth)
+        finally:
+            self.active.discard(key)
+        loops.discard(key)
+        if not loops:
+            self.expansions[key] = destinations
+        return destinations, loops
+
+
+    def expand_aliases(self, item, depth):
+        """Expands the virtual alias of an address or the alias of a user, if any."""
+        if '@' in item:
+            value = self.lookup(self.virtual_alias_maps, item)
+        else:
+            value = self.lookup(self.alias_maps, item)
+        if not value:
+            return self.deliver(item, depth)
+        return self.expand_values(split_values(value), depth)
+
+
+    def expand_include(self, path, depth):
+        """Expands the addresses in an ":include:" file."""
+        self.files_read.add(path)
+        try:
+            with open(path) as f:
+                values = split_values(" ".join(line for line in f if not line.lstrip().startswith('#')))
+        except (IOError, OSError) as e:
+            self.log.warning("Can't read %s: %s", path, e)
+            return [], set()
+        return self.expand_values(values, depth)
+
+
+    def expand_values(self, values, depth):
+        destinations = []
+        loops = set()
+        for value in values:
+            expanded, value_loops = self.expand(value, depth + 1)
+            destinations += expanded
+            loops |= value_loops
+        return destinations, loops
+
+
+    def deliver(self, item, depth):
+        """Returns the Destinations of an item that isn't (or wasn't) aliased."""
+        if '@' not in item:
+            if self.user_exists(item.lower()):
+                return [Destination(LOCAL, item, self.local_transport)], set()
+            return [Destination(MISSING, item, None)], set()
+
+        mailbox = self.lookup(self.virtual_mailbox_maps, item)
+        if mailbox:
+            if self.virtual_transport == 'virtual':
+                return [Destination(MAILBOX, "%s/%s" % (self.virtual_mailbox_base, mailbox),
+                                    None)], set()
+            return [Destination(VIA, mailbox, self.virtual_transport)], set()
+
+        user, domain = item.rsplit('@', 1)
+        if domain.lower().strip('[]') in self.local_domains:
+            return self.expand(user, depth + 1)
+        return [Destination(REMOTE, item, None)], set()
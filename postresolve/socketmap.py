@@ -0,0 +1,271 @@
+"""
+A resident postresolve, "postresolved", that answers lookups over a unix
+socket with Postfix's socketmap protocol (see socketmap_table(5)), so that
+the tables are only read once rather than on every run.
+
+Each request is a netstring (e.g. "27:compatible-local alice@example.com,")
+holding the name of the map and the address.  The name is the output mode,
+"standard", "brief" or "compatible", with "-local" for --local-only.  The
+reply is a netstring with "OK " and the lines postresolve would show, or
+"NOTFOUND " if there are none, or "TEMP " or "PERM " and the reason.  As a
+socketmap: table, e.g. "socketmap:unix:/run/postresolve.sock:brief".
+
+Results are kept in a cache of the most recently asked for, and the files
+that have been read (tables, main.cf, :include: files) are checked at most
+once a second, reloading everything if any of them has changed, or on
+SIGHUP.  Everything runs in one asyncio event loop, as lookups take a few
+microseconds once the tables have been read.
+"""
+
+from __future__ import absolute_import
+
+import os
+import sys
+import stat
+import time
+import errno
+import signal
+import asyncio
+import collections
+
+import click
+
+from .cli import make_logger, load_conf, config_files
+from .resolver import Resolver, format_lines
+
+
+DEFAULT_SOCKET = '/run/postresolve.sock'
+MODES = ('standard', 'brief', 'compatible')
+LOCAL_SUFFIX = '-local'
+# Results kept, unless --cache-size says otherwise
+CACHE_SIZE = 10000
+# Expansions the resolver may remember, as a multiple of the cache size,
+# before they are forgotten, so that a stream of new addresses (e.g. spam)
+# doesn't use more and more memory
+EXPANSIONS_FACTOR = 10
+# Seconds between checks for changed files
+CHECK_INTERVAL = 1.0
+# Longest request accepted, as for Postfix's socketmap_max_reply
+MAX_REQUEST = 100000
+
+
+def netstring(data):
+    """Returns the bytes <data> as a netstring."""
+    return b"%d:%s," % (len(data), data)
+
+
+def parse_name(name):
+    """Returns the mode and whether it's local-only for the map <name>, or None."""
+    local_only = name.endswith(LOCAL_SUFFIX)
+    if local_only:
+        name = name[:-len(LOCAL_SUFFIX)]
+    if name not in MODES:
+        return None
+    return name, local_only
+
+
+def file_mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+class SocketmapProtocol(asyncio.Protocol):
+    """A connection from Postfix or the client, with requests as netstrings."""
+
+    def __init__(self, server):
+        self.server = server
+        self.buffer = b''
+
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+
+    def data_received(self, data):
+        buffer = self.buffer + data if self.buffer else data
+        pos = 0
+        replies = []
+        while True:
+            colon = buffer.find(b':', pos)
+            if colon < 0:
+                if len(buffer) - pos > 10:
+                    return self.abort("bad netstring length")
+                break
+            length = buffer[pos:colon]
+            if not length.isdigit() or int(length) > MAX_REQUEST:
+                return self.abort("bad netstring length")
+            end = colon + 1 + int(length)
+            if end >= len(buffer):
+                break
+            if buffer[end:end + 1] != b',':
+                return self.abort("netstring without a comma")
+            replies.append(netstring(self.server.request(buffer[colon + 1:end])))
+            pos = end + 1
+        self.buffer = buffer[pos:]
+        if replies:
+            self.transport.write(b"".join(replies))
+
+
+    def abort(self, reason):
+        self.server.log.warning("Closing connection: %s", reason)
+        self.transport.close()
+
+
+class SocketmapServer(object):
+    """
+    Answers socketmap requests with a Resolver made by <load>(), made again
+    when any of the files it has read, or the <config_files>, change.
+    """
+
+    def __init__(self, load, logger, config_files=(), cache_size=None):
+        self.load = load
+        self.log = logger
+        self.config_files = set(config_files)
+        self.cache_size = cache_size or CACHE_SIZE
+        # Mapping of (name, lower-case key) to reply, least recently used first
+        self.cache = collections.OrderedDict()
+        self.loop = asyncio.new_event_loop()
+        self.servers = []
+        self.unix_paths = []
+        self.next_check = 0
+        self.resolver = None
+        self.mtimes = {}
+        self.reload()
+
+
+    def reload(self):
+        """Makes a new Resolver, keeping the old one if that fails."""
+        try:
+            resolver = self.load()
+        except Exception as e:
+            if self.resolver is None:
+                raise
+            self.log.error("Can't reload: %s", e)
+            return
+        self.resolver = resolver
+        self.cache.clear()
+        self.mtimes = dict((path, file_mtime(path)) for path in self.files())
+        self.log.debug("Loaded %d files", len(self.mtimes))
+
+
+    def files(self):
+        return self.resolver.files() | self.config_files
+
+
+    def changed(self):
+        """Returns whether any of the files read has changed since."""
+        mtimes = self.mtimes
+        for path in self.files():
+            mtime = file_mtime(path)
+            if path not in mtimes:
+                # Read since the last check, e.g. an :include: file
+                mtimes[path] = mtime
+            elif mtimes[path] != mtime:
+                self.log.info("%s has changed; reloading", path)
+                return True
+        return False
+
+
+    def request(self, data):
+        """Returns the reply (as bytes) for a request (without its netstring)."""
+        now = time.time()
+        if now >= self.next_check:
+            self.next_check = now + CHECK_INTERVAL
+            if self.changed():
+                self.reload()
+
+        try:
+            name, space, key = data.decode('utf-8').partition(' ')
+        except UnicodeDecodeError:
+            return b"PERM invalid UTF-8"
+        parsed = parse_name(name)
+        if parsed is None or not key:
+            return b"PERM unknown map or no key"
+        # Resolved in lower case, as the resolver remembers expansions by
+        # lower-case key, so the reply doesn't depend on who asked first
+        key = key.lower()
+        cache_key = (name, key)
+        cache = self.cache
+        try:
+            reply = cache[cache_key]
+            cache.move_to_end(cache_key)
+            return reply
+        except KeyError:
+            pass
+
+        resolver = self.resolver
+        try:
+            lines = format_lines(resolver.resolve(key), *parsed)
+        except Exception as e:
+            self.log.error("Can't resolve %s: %s", key, e)
+            return ("TEMP %s" % e).encode('utf-8')
+        reply = ("OK " + "\n".join(lines) if lines else "NOTFOUND ").encode('utf-8')
+        cache[cache_key] = reply
+        if len(cache) > self.cache_size:
+            cache.popitem(last=False)
+        if len(resolver.expansions) > self.cache_size * EXPANSIONS_FACTOR:
+            resolver.forget()
+        return reply
+
+
+    def listen_unix(self, path, mode=None):
+        # Replaces a socket left behind by an earlier run, but nothing else
+        try:
+            if stat.S_ISSOCK(os.stat(path).st_mode):
+                os.unlink(path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+        server = self.loop.run_until_complete(self.loop.create_unix_server(
+            lambda: SocketmapProtocol(self), path))
+        if mode is not None:
+            os.chmod(path, mode)
+        self.servers.append(server)
+        self.unix_paths.append(path)
+
+
+    def run(self):
+        """Runs until SIGINT or SIGTERM, reloading on SIGHUP."""
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            self.loop.add_signal_handler(signum, self.loop.stop)
+        self.loop.add_signal_handler(signal.SIGHUP, self.reload)
+        try:
+            self.loop.run_forever()
+        finally:
+            for server in self.servers:
+                server.close()
+            for path in self.unix_paths:
+                os.unlink(path)
+            self.loop.close()
+
+
+@click.command()
+@click.option('-S', '--socket', 'path', type=click.Path(dir_okay=False), default=DEFAULT_SOCKET,
+              show_default=True, help="Listens on the unix socket <path>")
+@click.option('-m', '--mode', type=click.STRING, default='660', show_default=True,
+              help="Permissions of the socket, in octal")
+@click.option('-C', '--config-dir', type=click.Path(file_okay=False),
+              help="Uses main.cf in <config_dir>")
+@click.option('-P', '--postconf-file', type=click.Path(dir_okay=False, exists=True),
+              help="Reads the parameters from <file> (the saved output of postconf) instead of running postconf")
+@click.option('--cache-size', type=click.IntRange(1), default=CACHE_SIZE, show_default=True,
+              help="Results to keep")
+@click.option('-d', '--debug', count=True, help="Shows each lookup")
+def main(path, mode, config_dir, postconf_file, cache_size, debug):
+    """Answers postresolve lookups over the socketmap protocol."""
+    logger = make_logger(debug)
+    files = config_files(load_conf(config_dir, postconf_file), config_dir, postconf_file)
+    server = SocketmapServer(lambda: Resolver(load_conf(config_dir, postconf_file), logger),
+                             logger, files, cache_size)
+    try:
+        server.listen_unix(path, int(mode, 8))
+    except (OSError, ValueError) as e:
+        raise click.ClickException("Can't listen: %s" % e)
+    logger.info("Listening on %s", path)
+    server.run()
+
+
+if __name__ == "__main__":
+    sys.exit(main())  # pragma: no cover
@@ -0,0 +1,104 @@
+"""
+Saves and restores the state of a run, so that the next one can carry on
+where it left off.
+
+A checkpoint holds the in-flight messages from :class:StateMachine and, for
+each input file, how far it was read.  Files are identified by device and
+inode rather than by name, so that a file that has been renamed by logrotate
+(e.g. mail.log to mail.log.1) is still recognised.
+
+The checkpoint is stored as JSON rather than pickled, so that loading one
+can't run code from whoever was able to write the file; records are saved
+as the tuples of their __getstate__() methods.
+"""
+
+from __future__ import absolute_import
+
+import os
+import json
+import tempfile
+import collections
+
+from .records import Message, Delivery
+
+
+VERSION = 5
+
+
+def restore(cls, values):
+    """Returns a record of class <cls> from its saved __getstate__() values."""
+
+    record = cls.__new__(cls)
+    record.__setstate__(values)
+    return record
+
+
+def encode_state(state):
+    """Converts state from StateMachine.get_state() to plain JSON types."""
+
+    return {'messages': dict((queue_id, m.__getstate__())
+                             for queue_id, m in state['messages'].items()),
+            'deliveries_by_id': dict((msg_id, dict((user, d.__getstate__())
+                                                   for user, d in deliveries.items()))
+                                     for msg_id, deliveries in state['deliveries_by_id'].items()),
+            'uuids': state['uuids'],
+            'uuid_owners': state['uuid_owners'],
+            'timeline': list(state['timeline']),
+            'clock': state['clock']}
+
+
+def decode_state(state):
+    """The reverse of encode_state(), for StateMachine.set_state()."""
+
+    messages = {}
+    for queue_id, values in state['messages'].items():
+        m = messages[queue_id] = restore(Message, values)
+        if m.to is not None:
+            m.to = [tuple(recipient) for recipient in m.to]
+    return {'messages': messages,
+            'deliveries_by_id': dict((msg_id, dict((user, restore(Delivery, values))
+                                                   for user, values in deliveries.items()))
+                                     for msg_id, deliveries in state['deliveries_by_id'].items()),
+            'uuids': state['uuids'],
+            'uuid_owners': state['uuid_owners'],
+            'timeline': collections.deque(tuple(entry) for entry in state['timeline']),
+            'clock': tuple(state['clock'])}
+
+
+def load(path):
+    """
+    Returns (state, positions) from the checkpoint file, or (None, {}) if
+    it doesn't exist.  <positions> maps (device, inode) to (offset, line_num).
+    """
+
+    if not os.path.exists(path):
+        return None, {}
+    with open(path) as f:
+        try:
+            checkpoint = json.load(f)
+        except ValueError:
+            raise ValueError("%s: not a checkpoint file" % path)
+    if not isinstance(checkpoint, dict) or checkpoint.get('version') != VERSION:
+        raise ValueError("%s: unsupported checkpoint version" % path)
+    # JSON keys are strings, so each position is saved as a list of
+    # [device, inode, offset, line_num]
+    positions = dict(((dev, ino), (offset, line_num))
+                     for dev, ino, offset, line_num in checkpoint['positions'])
+    return decode_state(checkpoint['state']), positions
+
+
+def save(path, state, positions):
+    """Atomically replaces the checkpoint file."""
+
+    checkpoint = {'version': VERSION, 'state': encode_state(state),
+                  'positions': [[dev, ino, offset, line_num]
+                                for (dev, ino), (offset, line_num) in sorted(positions.items())]}
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)),
+                                     prefix=os.path.basename(path) + '.')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(checkpoint, f)
+        os.rename(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
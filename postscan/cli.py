@@ -6,15 +6,57 @@ from __future__ import absolute_import
 from __future__ import print_function
 
 import sys
+import signal
 import logging
 
 import click
 
 from .postscan import Controller
+from .inputs import open_input, open_binary
+from .output import FORMATS
+from . import database
+from . import server
+from . import timestamps
 from . import __version__
 
 
-@click.command()
+class DefaultGroup(click.Group):
+    """
+    A group of commands that runs <default> unless the first argument is the
+    name of another command, so that e.g. "postscan mail.log" is the same as
+    "postscan scan mail.log".
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.default = kwargs.pop('default')
+        super(DefaultGroup, self).__init__(*args, **kwargs)
+
+
+    def parse_args(self, ctx, args):
+        if not args or (args[0] not in self.commands and args[0] not in ctx.help_option_names):
+            args = [self.default] + list(args)
+        return super(DefaultGroup, self).parse_args(ctx, args)
+
+
+def make_logger(verbose, stdout):
+    logger = logging.getLogger("postscan")
+    if stdout:
+        logger.addHandler(logging.StreamHandler(sys.stdout))
+    else:
+        logger.addHandler(logging.StreamHandler())
+    if verbose:
+        logger.setLevel(logging.DEBUG)
+    else:
+        logger.setLevel(logging.INFO)
+    return logger
+
+
+@click.group(cls=DefaultGroup, default='scan')
+def main():
+    """Console script for postscan; runs "scan" by default."""
+
+
+@main.command()
 @click.option('-t', '--to',        type=click.STRING,
               help="Saves iff 'to' or 'orig_to' matches <addr>")
 @click.option('-C', '--client-ip', type=click.STRING,
@@ -23,44 +65,258 @@ from . import __version__
               help="Save e-mails generated locally (ignored by default)")
 @click.option('-s', '--spam-level', type=click.INT,
               help="Ignores if the integer spam level is greater than or equal to <level>")
+@click.option('-H', '--hosts', type=click.STRING,
+              help="Reads a log from several hosts: a comma-separated list of hostnames, or * for any")
+@click.option('-J', '--journal', is_flag=True, default=False,
+              help="Reads systemd journal entries, from journalctl -o export or -o json")
+@click.option('-j', '--jobs', type=click.IntRange(1), default=1,
+              help="Scans each regular file with <jobs> processes (with --hosts, shares the hosts between them, each reading the whole file)")
+@click.option('-M', '--merge', is_flag=True, default=False,
+              help="Reads the files together, merging their lines in order of time")
+@click.option('-B', '--binary', is_flag=True, default=False,
+              help="Matches undecoded lines, memory-mapping regular files")
+@click.option('-f', '--follow', is_flag=True, default=False,
+              help="Keeps reading the file as it grows, across log rotation")
+@click.option('-k', '--checkpoint', type=click.Path(dir_okay=False),
+              help="Resumes from and then saves the state and file positions in <file>")
+@click.option('-m', '--max-age', type=click.IntRange(0),
+              help="Evicts messages not removed within <seconds> of arriving (by log time)")
+@click.option('--emit-incomplete', is_flag=True, default=False,
+              help="Prints evicted messages, marked as incomplete")
+@click.option('--since', type=click.STRING,
+              help="Prints messages removed at or after <time>, as YYYY-MM-DD [HH:MM[:SS]]")
+@click.option('--until', type=click.STRING,
+              help="Stops reading at <time> (exclusive), as for --since")
+@click.option('-2', '--two-pass', is_flag=True, default=False,
+              help="With --to, finds the recipient's messages first and then correlates only those")
+@click.option('--format', 'output_format', type=click.Choice(['text', 'jsonl', 'tsv']),
+              default='text', help="Writes each message as text, JSON Lines or tab-separated values")
+@click.option('-d', '--db', type=click.Path(dir_okay=False),
+              help="Stores each message in the SQLite database <file> instead of printing it")
+@click.option('--summary', is_flag=True, default=False,
+              help="Prints top senders, client IPs and mailboxes and spam levels per user instead of each message")
+@click.option('--summary-top', type=click.IntRange(1), default=10,
+              help="Number of entries in each list with --summary")
+@click.option('--summary-keys', type=click.IntRange(1), default=1000,
+              help="Number of keys counted for each list with --summary, which limits the memory used")
+@click.option('--stats', is_flag=True, default=False,
+              help="Reports match counts, timings and peak state sizes to stderr at the end (or on SIGUSR1)")
 @click.option('-v', '--verbose', count=True)
 @click.option('-o/-e', '--stdout/--no-stdout', default=False,
               help="Logs to stdout instead of stderr")
 @click.option('-V', '--version', is_flag=True, default=False)
-@click.argument('files', type=click.File(), nargs=-1)
-def main(files, to, client_ip, local, spam_level, verbose, stdout, version, args=None):
-    """Console script for postscan."""
+@click.argument('files', type=click.Path(exists=True, dir_okay=False, allow_dash=True), nargs=-1)
+def scan(files, to, client_ip, local, spam_level, hosts, journal, jobs, merge, binary, follow, checkpoint, max_age, emit_incomplete, since, until, two_pass, output_format, db, summary, summary_top, summary_keys, stats, verbose, stdout, version, args=None):
+    """Scans mail logs for the details of each message."""
 
     if version:
         print("postscan v" + __version__)
         return 0
 
-    logger = logging.getLogger("postscan")
-    if stdout:
-        logger.addHandler(logging.StreamHandler(sys.stdout))
-    else:
-        logger.addHandler(logging.StreamHandler())
-    if verbose:
-        logger.setLevel(logging.DEBUG)
-    else:
-        logger.setLevel(logging.INFO)
+    logger = make_logger(verbose, stdout)
 
     params = {}
     params['to'] = to
     params['client_ip'] = client_ip
     params['local'] = local
     params['spam_level'] = spam_level
+    params['hosts'] = hosts and [host.strip() for host in hosts.split(',') if host.strip()]
+    params['jobs'] = jobs
+    params['binary'] = binary
+    params['max_age'] = max_age
+    params['emit_incomplete'] = emit_incomplete
+    params['format'] = output_format
+    params['db'] = db
+    params['summary'] = summary
+    params['summary_top'] = summary_top
+    params['summary_keys'] = summary_keys
+    params['stats'] = stats
+
+    try:
+        since = since and timestamps.parse_time(since)
+        until = until and timestamps.parse_time(until)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+    window = (since, until) if since is not None or until is not None else None
+
+    if summary and db:
+        raise click.UsageError("--summary can't be used with --db")
+    if window and (follow or checkpoint):
+        raise click.UsageError("--since and --until can't be used with --follow or --checkpoint")
+    if hosts and (window or two_pass or follow or checkpoint or stats):
+        raise click.UsageError("--hosts can't be used with --since, --until, --two-pass, "
+                               "--follow, --checkpoint or --stats")
+    if journal and (window or two_pass or follow or checkpoint or stats):
+        raise click.UsageError("--journal can't be used with --since, --until, --two-pass, "
+                               "--follow, --checkpoint or --stats")
+    if merge and (window or two_pass or follow or checkpoint or journal or jobs > 1):
+        raise click.UsageError("--merge can't be used with --since, --until, --two-pass, "
+                               "--follow, --checkpoint, --journal or --jobs")
+    if two_pass:
+        if not to:
+            raise click.UsageError("--two-pass needs --to")
+        if not files or '-' in files:
+            raise click.UsageError("--two-pass needs files, which are read twice")
+        if window or follow or checkpoint:
+            raise click.UsageError("--two-pass can't be used with --since, --until, --follow or --checkpoint")
+    if follow:
+        if len(files) != 1 or files[0] == '-':
+            raise click.UsageError("--follow needs exactly one file")
+        if checkpoint:
+            raise click.UsageError("--checkpoint can't be used with --follow")
+    elif checkpoint:
+        if not files or '-' in files:
+            raise click.UsageError("--checkpoint needs files")
 
     controller = Controller(params, logger)
+    if stats and hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1, lambda signum, frame: controller.stats.report(sys.stderr))
+    try:
+        process(controller, files, binary, follow, checkpoint, window, two_pass, hosts, journal, merge)
+        if summary:
+            controller.writer.report()
+    finally:
+        if stats:
+            controller.stats.report(sys.stderr)
+    return 0
 
-    if files:
-        for stream in files:
-            controller.parse_stream(stream)
-    else:
-        controller.parse_stream(sys.stdin)
 
+def process(controller, files, binary, follow, checkpoint, window=None, two_pass=False,
+            hosts=None, journal=False, merge=False):
+    if follow:
+        try:
+            controller.follow(files[0])
+        except KeyboardInterrupt:
+            pass
+        return
+
+    if checkpoint:
+        controller.parse_files_checkpointed(files, checkpoint)
+        return
+
+    if merge:
+        controller.parse_merged(files or ['-'])
+        return
+
+    for path in files or ['-']:
+        if journal:
+            controller.parse_journal(path)
+            continue
+        if window:
+            controller.parse_window(path, *window)
+            continue
+        if two_pass:
+            controller.parse_two_pass(path)
+            continue
+        if hosts:
+            controller.parse_hosts(path)
+            continue
+        if binary:
+            stream = open_binary(path)
+            parse = controller.parse_binary
+        else:
+            stream = open_input(path)
+            parse = controller.parse_stream
+        try:
+            parse(stream)
+        finally:
+            if path != '-':
+                stream.close()
+
+
+@main.command()
+@click.option('--udp', type=click.STRING,
+              help="Listens for syslog messages on UDP <[host:]port> (by default on localhost)")
+@click.option('--tcp', type=click.STRING,
+              help="Listens for syslog messages on TCP <[host:]port>, framed as in RFC 6587")
+@click.option('--unix', type=click.Path(dir_okay=False),
+              help="Listens for syslog messages on the unix datagram socket <path>")
+@click.option('-t', '--to',        type=click.STRING,
+              help="Saves iff 'to' or 'orig_to' matches <addr>")
+@click.option('-C', '--client-ip', type=click.STRING,
+              help="Ignores e-mails if the client host's address matches <ipfragment>")
+@click.option('-l/-L', '--local/--no-local', default=False,
+              help="Save e-mails generated locally (ignored by default)")
+@click.option('-s', '--spam-level', type=click.INT,
+              help="Ignores if the integer spam level is greater than or equal to <level>")
+@click.option('-H', '--hosts', type=click.STRING,
+              help="Accepts messages from other hosts: a comma-separated list of hostnames, or * for any")
+@click.option('-B', '--binary', is_flag=True, default=False,
+              help="Matches undecoded lines")
+@click.option('-m', '--max-age', type=click.IntRange(0),
+              help="Evicts messages not removed within <seconds> of arriving (by log time)")
+@click.option('--emit-incomplete', is_flag=True, default=False,
+              help="Prints evicted messages, marked as incomplete")
+@click.option('--format', 'output_format', type=click.Choice(['text', 'jsonl', 'tsv']),
+              default='text', help="Writes each message as text, JSON Lines or tab-separated values")
+@click.option('-d', '--db', type=click.Path(dir_okay=False),
+              help="Stores each message in the SQLite database <file> instead of printing it")
+@click.option('-v', '--verbose', count=True)
+@click.option('-o/-e', '--stdout/--no-stdout', default=False,
+              help="Logs to stdout instead of stderr")
+def serve(udp, tcp, unix, to, client_ip, local, spam_level, hosts, binary, max_age, emit_incomplete, output_format, db, verbose, stdout):
+    """Receives mail logs from syslog over the network until interrupted."""
+
+    if not (udp or tcp or unix):
+        raise click.UsageError("Give at least one of --udp, --tcp or --unix")
+    logger = make_logger(verbose, stdout)
+
+    params = {}
+    params['to'] = to
+    params['client_ip'] = client_ip
+    params['local'] = local
+    params['spam_level'] = spam_level
+    params['hosts'] = hosts and [host.strip() for host in hosts.split(',') if host.strip()]
+    params['jobs'] = 1
+    params['binary'] = binary
+    params['max_age'] = max_age
+    params['emit_incomplete'] = emit_incomplete
+    params['format'] = output_format
+    params['db'] = db
+
+    listener = server.Server(Controller(params, logger), logger)
+    try:
+        if udp:
+            listener.listen_udp(*server.parse_address(udp))
+        if tcp:
+            listener.listen_tcp(*server.parse_address(tcp))
+        if unix:
+            listener.listen_unix(unix)
+    except (OSError, ValueError) as e:
+        raise click.ClickException("Can't listen: %s" % e)
+    listener.run()
     return 0
 
 
+@main.command()
+@click.option('-d', '--db', type=click.Path(exists=True, dir_okay=False), required=True,
+              help="SQLite database written by \"postscan scan --db\"")
+@click.option('-i', '--msg-id', type=click.STRING, help="Message-ID, without the <>")
+@click.option('-f', '--from', 'envfrom', type=click.STRING, help="Envelope sender")
+@click.option('-t', '--to', type=click.STRING, help="Recipient or original recipient")
+@click.option('-c', '--client-ip', type=click.STRING, help="Client's IP address")
+@click.option('--since', type=click.STRING, help="Start time, as YYYY-MM-DD [HH:MM[:SS]]")
+@click.option('--until', type=click.STRING, help="End time (exclusive), as for --since")
+@click.option('-n', '--limit', type=click.IntRange(1), help="Shows at most <limit> messages")
+@click.option('--format', 'output_format', type=click.Choice(['text', 'jsonl', 'tsv']),
+              default='text', help="Writes each message as text, JSON Lines or tab-separated values")
+def query(db, msg_id, envfrom, to, client_ip, since, until, limit, output_format):
+    """Looks up messages stored by "scan --db"."""
+
+    try:
+        since = since and timestamps.parse_time(since)
+        until = until and timestamps.parse_time(until)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+    try:
+        records = database.query(db, msg_id, envfrom, to, client_ip, since, until, limit)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    writer = FORMATS[output_format](sys.stdout)
+    for record in records:
+        writer.write(record)
+    writer.flush()
+    return 0
+
 if __name__ == "__main__":
     sys.exit(main())  # pragma: no cover
@@ -0,0 +1,213 @@
+"""
+Stores completed message records (see records.Completed) in an SQLite
+database, for "postscan query" to look up later.
+
+Records are inserted in batches, each in one transaction, and the tables
+are indexed on everything that can be queried: Message-ID, envelope
+sender, client IP and time for messages, and address and original address
+for recipients.  Addresses compare case-insensitively.  Times are seconds
+since the epoch, treating the log's local times as UTC.
+"""
+
+from __future__ import absolute_import
+
+import os
+import queue
+import sqlite3
+import threading
+import urllib.parse
+
+from .records import Completed, Recipient
+from .timestamps import SyslogClock
+
+
+SCHEMA_VERSION = 2
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    queue_id TEXT NOT NULL,
+    time INTEGER,
+    dt TEXT,
+    ip TEXT,
+    envfrom TEXT COLLATE NOCASE,
+    msg_id TEXT,
+    incomplete INTEGER NOT NULL DEFAULT 0,
+    host TEXT
+);
+CREATE TABLE IF NOT EXISTS recipients (
+    message_id INTEGER NOT NULL REFERENCES messages (id),
+    address TEXT COLLATE NOCASE,
+    orig_to TEXT COLLATE NOCASE,
+    user TEXT,
+    mailbox TEXT,
+    spam_level INTEGER
+);
+CREATE INDEX IF NOT EXISTS messages_msg_id ON messages (msg_id);
+CREATE INDEX IF NOT EXISTS messages_envfrom ON messages (envfrom);
+CREATE INDEX IF NOT EXISTS messages_ip ON messages (ip);
+CREATE INDEX IF NOT EXISTS messages_time ON messages (time);
+CREATE INDEX IF NOT EXISTS recipients_message_id ON recipients (message_id);
+CREATE INDEX IF NOT EXISTS recipients_address ON recipients (address);
+CREATE INDEX IF NOT EXISTS recipients_orig_to ON recipients (orig_to);
+"""
+
+# Number of records to insert per transaction
+BATCH_SIZE = 5000
+
+
+def connect(path, check_same_thread=True):
+    db = sqlite3.connect(path, isolation_level=None, check_same_thread=check_same_thread)
+    db.execute("PRAGMA journal_mode = WAL")
+    db.execute("PRAGMA synchronous = NORMAL")
+    version = db.execute("PRAGMA user_version").fetchone()[0]
+    if version not in (0, SCHEMA_VERSION):
+        raise ValueError("%s has an unsupported schema version (%d)" % (path, version))
+    db.executescript(SCHEMA)
+    db.execute("PRAGMA user_version = %d" % SCHEMA_VERSION)
+    return db
+
+
+def connect_readonly(path):
+    """
+    Opens the database at <path> for reading only, so that a lookup doesn't
+    need write access or create a database that isn't there.
+    """
+
+    uri = 'file:%s?mode=ro' % urllib.parse.quote(os.path.abspath(path))
+    db = sqlite3.connect(uri, uri=True)
+    try:
+        version = db.execute("PRAGMA user_version").fetchone()[0]
+    except sqlite3.DatabaseError as e:
+        db.close()
+        raise ValueError("%s: %s" % (path, e))
+    if version != SCHEMA_VERSION:
+        db.close()
+        raise ValueError("%s isn't a postscan database (schema version %d)" % (path, version))
+    return db
+
+
+class DatabaseWriter(object):
+    """
+    Stands in for one of the output writers (see output.py), storing records
+    in the database at <path> instead of printing them.  Batches of records
+    are inserted by a background thread, so that this overlaps with
+    scanning; sqlite3 releases the GIL while it works.
+    """
+
+    def __init__(self, path, batch_size=None):
+        self.db = connect(path, check_same_thread=False)
+        self.batch_size = batch_size or BATCH_SIZE
+        self.clock = SyslogClock()
+        self.pending = []
+        self.batches = queue.Queue(2)
+        self.error = None
+        self.thread = threading.Thread(target=self.run, name="postscan-db")
+        self.thread.daemon = True
+        self.thread.start()
+
+
+    def write(self, record):
+        self.pending.append(record)
+        if len(self.pending) >= self.batch_size:
+            self.drain()
+
+
+    def drain(self):
+        if self.error:
+            raise self.error
+        if self.pending:
+            self.batches.put(self.pending)
+            self.pending = []
+
+
+    def flush(self):
+        """Waits until everything written so far has been committed."""
+        self.drain()
+        self.batches.join()
+        if self.error:
+            raise self.error
+
+
+    def run(self):
+        while True:
+            batch = self.batches.get()
+            try:
+                if not self.error:
+                    self.insert(batch)
+            except Exception as e:
+                self.error = e
+            finally:
+                self.batches.task_done()
+
+
+    def insert(self, records):
+        messages = []
+        recipients = []
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            # IDs are allocated here so that the rows can be inserted with
+            # executemany(); the transaction stops other writers meanwhile
+            next_id = (self.db.execute("SELECT max(id) FROM messages").fetchone()[0] or 0) + 1
+            for message_id, record in enumerate(records, next_id):
+                messages.append((message_id, record.queue_id, self.clock.seconds(record.dt),
+                                 record.dt, record.ip, record.envfrom, record.msg_id,
+                                 int(record.incomplete), record.host))
+                for r in record.recipients:
+                    recipients.append((message_id, r.address, r.orig_to, r.user, r.mailbox,
+                                       r.spam_level))
+            self.db.executemany("INSERT INTO messages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", messages)
+            self.db.executemany("INSERT INTO recipients VALUES (?, ?, ?, ?, ?, ?)", recipients)
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        self.db.execute("COMMIT")
+
+
+def query(path, msg_id=None, envfrom=None, rcpt=None, ip=None, since=None, until=None,
+          limit=None):
+    """
+    Yields a Completed record for each stored message that matches all of
+    the given criteria, in order of time.  <rcpt> matches either the
+    recipient or the original recipient, and <since> and <until> are in
+    seconds (see timestamps.parse_time()).  The database is opened
+    straight away, raising ValueError if it can't be read.
+    """
+
+    db = connect_readonly(path)
+    conditions = []
+    params = []
+    for column, value in (('msg_id', msg_id), ('envfrom', envfrom), ('ip', ip)):
+        if value is not None:
+            conditions.append(column + " = ?")
+            params.append(value)
+    if rcpt is not None:
+        conditions.append("id IN (SELECT message_id FROM recipients WHERE address = ?"
+                          " UNION SELECT message_id FROM recipients WHERE orig_to = ?)")
+        params += [rcpt, rcpt]
+    if since is not None:
+        conditions.append("time >= ?")
+        params.append(since)
+    if until is not None:
+        conditions.append("time < ?")
+        params.append(until)
+    sql = "SELECT id, queue_id, dt, ip, envfrom, msg_id, incomplete, host FROM messages"
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    sql += " ORDER BY time, id"
+    if limit is not None:
+        sql += " LIMIT %d" % limit
+    return records(db, sql, params)
+
+
+def records(db, sql, params):
+    """Yields the Completed records for the messages selected by <sql>, then closes <db>."""
+
+    try:
+        for row in db.execute(sql, params).fetchall():
+            recipients = [Recipient(*r) for r in db.execute(
+                "SELECT address, orig_to, user, mailbox, spam_level FROM recipients"
+                " WHERE message_id = ? ORDER BY rowid", (row[0],))]
+            yield Completed(row[1], row[2], row[3], row[4], row[5], recipients, bool(row[6]),
+                            row[7])
+    finally:
+        db.close()
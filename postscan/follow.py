@@ -0,0 +1,300 @@
+"""
+Follows a log file as it grows, like "tail -F".
+
+Lines are read from the start of the file and then as they are appended.
+When logrotate renames the file, the old one is kept open alongside the new
+one, as syslogd carries on writing to it until it is told to reopen its
+files, and is only closed once the new file has been written to or the old
+one has been idle for a while; when the file is truncated in place,
+reading starts again from the beginning.  The file's directory is watched with
+inotify where available, so waiting for more input uses no CPU; otherwise
+the file is polled.
+"""
+
+from __future__ import absolute_import
+
+import os
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+
+
+BLOCK_SIZE = 1024 * 1024
+POLL_INTERVAL = 1.0
+# With inotify, how often to check anyway, e.g. for writes to a renamed file
+# (whose events have a different name)
+WATCH_TIMEOUT = 5.0
+# How long a renamed file is read after it was last written to, if nothing
+# is written to the new one meanwhile
+ROTATED_TIMEOUT = 30.0
+
+# From <sys/inotify.h>
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | \
+             IN_MOVED_TO | IN_CREATE | IN_DELETE
+EVENT_HEADER = struct.Struct('iIII')
+
+
+class Inotify(object):
+    """Waits for changes to a named file in a directory."""
+
+    def __init__(self, path):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        directory = os.path.dirname(os.path.abspath(path))
+        if libc.inotify_add_watch(self.fd, directory.encode(), WATCH_MASK) < 0:
+            err = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(err, "inotify_add_watch failed")
+        self.name = os.path.basename(path).encode()
+
+
+    def wait(self, timeout):
+        """
+        Blocks until there is an event for the file or the timeout expires,
+        however many events there are for other files meanwhile.
+        """
+        deadline = time.time() + timeout
+        while select.select([self.fd], [], [], max(deadline - time.time(), 0))[0]:
+            if self.name in self.read_names():
+                return
+
+
+    def read_names(self):
+        names = set()
+        try:
+            data = os.read(self.fd, 65536)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return names
+            raise
+        pos = 0
+        while pos < len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, pos)
+            pos += EVENT_HEADER.size
+            names.add(data[pos:pos + length].rstrip(b'\0'))
+            pos += length
+        return names
+
+
+    def close(self):
+        os.close(self.fd)
+
+
+class Poller(object):
+    """Waits by sleeping, when inotify isn't available."""
+
+    def __init__(self, interval):
+        self.interval = interval
+
+
+    def wait(self, timeout):
+        select.select([], [], [], self.interval)
+
+
+    def close(self):
+        pass
+
+
+def read_available(fd, partial):
+    """
+    Returns the complete lines available from <fd>, after the incomplete
+    line <partial> left from before, the incomplete line after them, and
+    the number of bytes read.
+    """
+
+    blocks = [partial]
+    count = 0
+    while True:
+        block = os.read(fd, BLOCK_SIZE)
+        if not block:
+            break
+        blocks.append(block)
+        count += len(block)
+    lines = b''.join(blocks).splitlines(True)
+    if lines and not lines[-1].endswith(b'\n'):
+        partial = lines.pop()
+    else:
+        partial = b''
+    return lines, partial, count
+
+
+class Follower(object):
+    """
+    Yields each line (as bytes) of a file as it is written, until stop()
+    is called.  <idle> is called whenever there is no more input yet.
+    """
+
+    def __init__(self, path, logger, idle=None, poll=False):
+        self.path = path
+        self.log = logger
+        self.idle = idle
+        self.stopping = False
+        self.fd = None
+        self.ino = None
+        self.offset = 0
+        self.partial = b''
+        # The file before it was rotated, while it may still be written to,
+        # its incomplete last line and when it was last written to
+        self.rotated_fd = None
+        self.rotated_partial = b''
+        self.rotated_time = None
+
+        self.watcher = None
+        if not poll:
+            try:
+                self.watcher = Inotify(path)
+            except (OSError, AttributeError) as e:
+                self.log.debug("Polling, as inotify isn't available: %s", e)
+        if not self.watcher:
+            self.watcher = Poller(POLL_INTERVAL)
+
+
+    def stop(self):
+        self.stopping = True
+
+
+    def open(self):
+        """Opens the file if it exists, returning True if so."""
+        try:
+            self.fd = os.open(self.path, os.O_RDONLY)
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                return False
+            raise
+        st = os.fstat(self.fd)
+        self.ino = (st.st_dev, st.st_ino)
+        self.offset = 0
+        self.partial = b''
+        return True
+
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+        self.close_rotated()
+
+
+    def close_rotated(self):
+        """Stops reading the rotated file, returning its incomplete last line if any."""
+        lines = []
+        if self.rotated_fd is not None:
+            os.close(self.rotated_fd)
+            self.rotated_fd = None
+            if self.rotated_partial:
+                lines.append(self.rotated_partial)
+            self.rotated_partial = b''
+        return lines
+
+
+    def read_lines(self):
+        """Returns all of the complete lines available from the open file."""
+        lines, self.partial, count = read_available(self.fd, self.partial)
+        self.offset += count
+        return lines
+
+
+    def read_rotated(self):
+        """
+        Returns the lines written to the rotated file since it was last
+        read, closing it once it has been idle for ROTATED_TIMEOUT.
+        """
+
+        lines, self.rotated_partial, count = read_available(self.rotated_fd, self.rotated_partial)
+        now = time.time()
+        if count:
+            self.rotated_time = now
+        elif now - self.rotated_time >= ROTATED_TIMEOUT:
+            self.log.debug("Finished with the rotated %s", self.path)
+            lines.extend(self.close_rotated())
+        return lines
+
+
+    def check_file(self):
+        """
+        Checks for rotation or truncation, returning any lines that were
+        left at the end of the old file and whether the file has changed.
+        """
+
+        try:
+            st = os.stat(self.path)
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                # Rotated but not yet recreated; keep reading the old file
+                return [], False
+            raise
+
+        if (st.st_dev, st.st_ino) != self.ino:
+            self.log.debug("%s has been rotated", self.path)
+            # Finishes with the file rotated before this one, if it's still
+            # open, as its lines are older
+            lines = []
+            if self.rotated_fd is not None:
+                lines, self.rotated_partial, count = read_available(self.rotated_fd,
+                                                                    self.rotated_partial)
+                lines.extend(self.close_rotated())
+            lines.extend(self.read_lines())
+            # Keeps reading the old file until it's finished with (see
+            # read_rotated())
+            self.rotated_fd, self.rotated_partial = self.fd, self.partial
+            self.rotated_time = time.time()
+            self.fd = None
+            self.open()
+            return lines, True
+        if st.st_size < self.offset:
+            self.log.debug("%s has been truncated", self.path)
+            os.lseek(self.fd, 0, os.SEEK_SET)
+            self.offset = 0
+            self.partial = b''
+            return [], True
+        return [], False
+
+
+    def __iter__(self):
+        try:
+            while not self.stopping:
+                changed = False
+                if self.fd is None:
+                    lines = []
+                    changed = self.open()
+                else:
+                    lines = []
+                    if self.rotated_fd is not None:
+                        lines = self.read_rotated()
+                    offset = self.offset
+                    new_lines = self.read_lines()
+                    if self.offset > offset and self.rotated_fd is not None:
+                        # Written to since the rotation, so syslogd has
+                        # finished with the old file
+                        self.log.debug("Finished with the rotated %s", self.path)
+                        lines.extend(self.close_rotated())
+                    lines.extend(new_lines)
+                    leftover, changed = self.check_file()
+                    lines.extend(leftover)
+                for line in lines:
+                    yield line
+                if not lines and not changed:
+                    if self.idle:
+                        self.idle()
+                    if not self.stopping:
+                        # Writes to the rotated file have another name, so
+                        # it's checked more often
+                        self.watcher.wait(WATCH_TIMEOUT if self.rotated_fd is None
+                                          else POLL_INTERVAL)
+        finally:
+            self.close()
+            self.watcher.close()
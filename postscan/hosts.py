@@ -0,0 +1,189 @@
+"""
+Processes a log collected from several hosts, e.g. by a central syslog
+server, for --hosts.
+
+Queue IDs are only unique per host, and messages without a Message-ID are
+matched up by the order of each host's lines, so every host's lines are
+handled by a StateMachine of its own.
+
+With --jobs, the hosts are divided between worker processes by a hash of
+their names.  Each worker reads the whole file, but only decodes and
+matches the lines of its own hosts, and sends back the messages it
+finishes, tagged with the number of the line that finished them; these
+are merged back into the order in which a single process would have
+written them.  This only divides the CPU work, of matching and following
+messages: the file is read once by each worker (usually from the page
+cache), unlike the byte ranges of parallel.py, as every line of a host has
+to be handled in order by the same process.
+"""
+
+from __future__ import absolute_import
+
+import re
+import zlib
+import heapq
+import queue
+import logging
+import operator
+import multiprocessing
+
+from .scanner import Scanner
+from .state import StateMachine
+from .inputs import open_binary, iter_lines
+
+
+# Number of finished messages a worker sends at once, and how many batches
+# can be waiting for the merge
+BATCH_SIZE = 1000
+QUEUE_DEPTH = 8
+# Seconds between checks that a worker is still running while waiting for it
+WORKER_CHECK_INTERVAL = 1.0
+
+# Date & host at the start of a line, e.g. "Aug 10 16:14:36 cagney "
+HOST_RE = re.compile(br'\w{3} +\d+ \d{2}:\d{2}:\d{2} (\S+) ')
+
+
+def host_of(line):
+    """Returns the host of a line (as bytes), or None."""
+    m = HOST_RE.match(line)
+    return m.group(1).decode('utf-8', 'replace') if m else None
+
+
+def shard(host, jobs):
+    """Returns which of <jobs> workers handles <host>, the same in every process."""
+    return zlib.crc32(host.encode('utf-8')) % jobs
+
+
+class HostRouter(object):
+    """
+    Hands each event to the StateMachine for its host, creating one with
+    <state_args> (as for StateMachine) and <emit> when a host first appears.
+    """
+
+    def __init__(self, state_args, emit):
+        self.state_args = state_args
+        self.emit = emit
+        self.states = {}
+        # Number of the line being handled, for tagging the messages it finishes
+        self.line_num = 0
+
+
+    def dispatch(self, host, label, match_groups, line_num):
+        self.line_num = line_num
+        try:
+            state = self.states[host]
+        except KeyError:
+            state = self.states[host] = StateMachine(*self.state_args, emit=self.emit, host=host)
+        return state.dispatch(label, match_groups, line_num)
+
+
+    def cleanup(self):
+        for host in sorted(self.states):
+            self.states[host].cleanup()
+
+
+def handle_lines(lines, scanner, router, encoding, wanted=None):
+    """
+    Matches each line (as bytes) and hands the events to <router>.  If
+    <wanted> is given, lines are only matched if it's true for their host.
+    """
+
+    decode = not scanner.binary
+    find = scanner.find if decode else scanner.find_bytes
+    hosts = {}      # Cache of wanted(host)
+    for line_num, line in enumerate(lines, 1):
+        if wanted is None:
+            result = find(line.decode(encoding, 'replace') if decode else line, line_num)
+            if result:
+                router.dispatch(host_of(line), result[0], result[1], line_num)
+            continue
+
+        host = host_of(line)
+        try:
+            mine = hosts[host]
+        except KeyError:
+            mine = hosts[host] = host is not None and wanted(host)
+        if mine:
+            result = find(line.decode(encoding, 'replace') if decode else line, line_num)
+            if result:
+                router.dispatch(host, result[0], result[1], line_num)
+
+
+def run_worker(path, index, jobs, scanner_args, state_args, encoding, results):
+    """
+    Handles the lines of the hosts in shard <index> of the file <path>,
+    putting lists of (line_num, record) on the queue <results>, then None.
+    """
+
+    try:
+        batch = []
+        def emit(record):
+            batch.append((router.line_num, record))
+            if len(batch) >= BATCH_SIZE:
+                results.put(batch[:])
+                del batch[:]
+
+        scanner = Scanner(scanner_args[0], logging.getLogger("postscan"), *scanner_args[1:])
+        router = HostRouter(state_args, emit)
+        f = open_binary(path)
+        try:
+            handle_lines(iter_lines(f), scanner, router, encoding,
+                         lambda host: shard(host, jobs) == index)
+        finally:
+            f.close()
+        router.cleanup()
+        results.put(batch)
+        results.put(None)
+    except Exception as e:
+        results.put(e)
+
+
+def received(results, worker):
+    """
+    Yields the items of the batches put on <results> by run_worker() in the
+    process <worker>, raising RuntimeError if it exits without finishing.
+    """
+
+    alive = True
+    while True:
+        try:
+            batch = results.get(timeout=WORKER_CHECK_INTERVAL)
+        except queue.Empty:
+            # Once it has exited, what it put is there to be read, so one
+            # more wait is enough
+            if not alive:
+                raise RuntimeError("%s exited with status %s" % (worker.name, worker.exitcode))
+            alive = worker.is_alive()
+            continue
+        if batch is None:
+            return
+        if isinstance(batch, Exception):
+            raise batch
+        for item in batch:
+            yield item
+
+
+def scan_file(path, jobs, scanner_args, state_args, encoding):
+    """
+    Processes the file <path> with <jobs> worker processes, yielding each
+    finished message as a Completed record, in order.  <scanner_args> is
+    (include_local, binary, hosts) as per Scanner.
+    """
+
+    queues = [multiprocessing.Queue(QUEUE_DEPTH) for i in range(jobs)]
+    workers = [multiprocessing.Process(target=run_worker, name="postscan-hosts-%d" % i,
+                                       args=(path, i, jobs, scanner_args, state_args,
+                                             encoding, queues[i]))
+               for i in range(jobs)]
+    for worker in workers:
+        worker.daemon = True
+        worker.start()
+    try:
+        for line_num, record in heapq.merge(*[received(q, worker)
+                                              for q, worker in zip(queues, workers)],
+                                            key=operator.itemgetter(0)):
+            yield record
+    finally:
+        for worker in workers:
+            worker.terminate()
+            worker.join()
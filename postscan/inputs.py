@@ -0,0 +1,215 @@
+"""
+Opens log files for reading, including rotated ones that have been
+compressed with gzip, bzip2 or xz.
+
+Compressed input is inflated by a background thread into a bounded queue
+of blocks, so decompression overlaps with scanning and memory use doesn't
+depend on the size of the file.
+
+In binary mode, lines are split out of large blocks read from the file,
+without decoding them.
+"""
+
+from __future__ import absolute_import
+
+import io
+import os
+import sys
+import stat
+import itertools
+import bz2
+import gzip
+import lzma
+import queue
+import threading
+
+
+# Magic bytes at the start of each supported compressed format, and how to
+# decompress it given a binary file object
+MAGIC = [(b'\x1f\x8b', lambda f: gzip.GzipFile(fileobj=f)),
+         (b'BZh', bz2.BZ2File),
+         (b'\xfd7zXZ\x00', lzma.LZMAFile)]
+
+BLOCK_SIZE = 1024 * 1024
+# Number of decompressed blocks that can be waiting to be read
+READ_AHEAD = 8
+
+
+def detect(f):
+    """
+    Returns a function to decompress the buffered binary file <f>, or None if
+    it isn't compressed.  Doesn't consume any input.
+    """
+
+    header = f.peek(6)[:6]
+    for magic, opener in MAGIC:
+        if header.startswith(magic):
+            return opener
+    return None
+
+
+class ReadAhead(io.RawIOBase):
+    """
+    A read-only raw stream that returns data read from another binary file
+    object by a background thread.  <raw> is the file that <source> reads
+    from, if it should be closed too, as the decompressors leave it open.
+    """
+
+    def __init__(self, source, block_size=None, depth=None, raw=None):
+        self.source = source
+        self.raw = raw
+        self.block_size = block_size or BLOCK_SIZE
+        self.blocks = queue.Queue(depth or READ_AHEAD)
+        self.current = b''
+        self.stopping = False
+        self.thread = threading.Thread(target=self.run, name="postscan-readahead")
+        self.thread.daemon = True
+        self.thread.start()
+
+
+    def run(self):
+        """Fills the queue, ending with b'' for EOF or an exception."""
+        try:
+            while not self.stopping:
+                block = self.source.read(self.block_size)
+                self.put(block)
+                if not block:
+                    break
+        except Exception as e:
+            self.put(e)
+
+
+    def put(self, item):
+        # Give up if the reader has gone away
+        while not self.stopping:
+            try:
+                self.blocks.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+
+    def readable(self):
+        return True
+
+
+    def readinto(self, b):
+        if not self.current:
+            if self.stopping:
+                return 0
+            block = self.blocks.get()
+            if isinstance(block, Exception):
+                self.stopping = True
+                raise block
+            if not block:
+                self.stopping = True
+                return 0
+            self.current = memoryview(block)
+        n = min(len(b), len(self.current))
+        b[:n] = self.current[:n]
+        self.current = self.current[n:]
+        return n
+
+
+    def close(self):
+        if not self.closed:
+            self.stopping = True
+            self.thread.join()
+            self.source.close()
+            if self.raw is not None:
+                self.raw.close()
+        super(ReadAhead, self).close()
+
+
+def open_input(path, encoding=None, errors=None):
+    """
+    Opens the named file (or stdin for "-") as text, in the same way as
+    click.File(), but decompressing if necessary.
+    """
+
+    if path == '-':
+        raw = getattr(sys.stdin, 'buffer', None)
+        if not hasattr(raw, 'peek') or not detect(raw):
+            return sys.stdin
+        f = raw
+    else:
+        f = io.open(path, 'rb')
+        if not detect(f):
+            f.close()
+            return io.open(path, encoding=encoding, errors=errors)
+
+    source = detect(f)(f)
+    raw = None if path == '-' else f
+    return io.TextIOWrapper(io.BufferedReader(ReadAhead(source, raw=raw), BLOCK_SIZE),
+                            encoding=encoding, errors=errors)
+
+
+def open_binary(path):
+    """
+    Opens the named file (or stdin for "-") for binary reading,
+    decompressing if necessary.
+    """
+
+    if path == '-':
+        f = getattr(sys.stdin, 'buffer', sys.stdin)
+        if not hasattr(f, 'peek'):
+            return f
+    else:
+        f = io.open(path, 'rb')
+    opener = detect(f)
+    if opener:
+        raw = None if path == '-' else f
+        return io.BufferedReader(ReadAhead(opener(f), raw=raw), BLOCK_SIZE)
+    return f
+
+
+def is_regular(f):
+    try:
+        return stat.S_ISREG(os.fstat(f.fileno()).st_mode)
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        return False
+
+
+def read_blocks(f):
+    while True:
+        block = f.read(BLOCK_SIZE)
+        if not block:
+            break
+        yield block
+
+
+def iter_lines(f):
+    """
+    Yields each line of the binary file <f> as bytes, split in the same way
+    as a text file with universal newlines.
+    """
+
+    return itertools.chain.from_iterable(split_blocks(read_blocks(f)))
+
+
+def split_blocks(blocks):
+    """Yields lists of lines, joining those that span blocks."""
+
+    tail = b''
+    for block in blocks:
+        lines = (tail + block if tail else block).splitlines(True)
+        # A trailing "\r" could be the first half of "\r\n"
+        if lines and not lines[-1].endswith(b'\n'):
+            tail = lines.pop()
+        else:
+            tail = b''
+        yield lines
+    if tail:
+        yield [tail]
+
+
+def skip_bytes(f, count):
+    """Skips forward in a binary file, which doesn't have to be seekable."""
+    if is_regular(f):
+        f.seek(count, io.SEEK_CUR)
+        return
+    while count > 0:
+        block = f.read(min(count, BLOCK_SIZE))
+        if not block:
+            break
+        count -= len(block)
@@ -0,0 +1,204 @@
+"""
+Reads mail logs from the systemd journal, as written by "journalctl -o
+export" or "journalctl -o json", for --journal.
+
+Each entry's program (SYSLOG_IDENTIFIER), pid, host and time are fields of
+their own, so only the message itself has to be matched: by the part of
+each of Scanner's patterns after the program tag, chosen by the
+identifier.  The time (__REALTIME_TIMESTAMP) is formatted as it would be
+in the log file, in local time, so the StateMachine gets the same groups
+as it would for the same line of text.
+"""
+
+from __future__ import absolute_import
+
+import io
+import re
+import json
+import time
+import socket
+import struct
+
+from .scanner import Scanner, PROGRAMS, SMTPD_PREFIXES, ANY_HOST
+from .timestamps import MONTHS
+
+
+# Fields that are kept from each entry
+FIELDS = ('MESSAGE', 'SYSLOG_IDENTIFIER', 'SYSLOG_PID', '_PID', '_HOSTNAME',
+          '__REALTIME_TIMESTAMP')
+# The pid in a pattern, e.g. "postfix/qmgr[37259]: ", or dovecot's tag
+PID_REGEX = r'\[(\d+)\]: '
+DOVECOT_REGEX = 'dovecot: '
+
+MONTH_NAMES = sorted(MONTHS, key=MONTHS.get)
+
+
+def split_pattern(pattern, dh_regex):
+    """
+    Returns whether the Scanner <pattern> (a string starting with
+    <dh_regex>) has a pid group, and the rest of it after the program tag.
+    """
+
+    rest = pattern[len(dh_regex):]
+    if rest.startswith(DOVECOT_REGEX):
+        return False, rest[len(DOVECOT_REGEX):]
+    return True, rest[rest.index(PID_REGEX) + len(PID_REGEX):]
+
+
+def read_exactly(f, size):
+    data = f.read(size)
+    if len(data) != size:
+        raise ValueError("truncated journal export: expected %d bytes" % size)
+    return data
+
+
+def read_export(f):
+    """
+    Yields a dict of the FIELDS in each entry of the binary file <f> in
+    journal export format: "NAME=value" lines, or for a value that isn't
+    plain text, "NAME", its length as a little-endian 64-bit integer and
+    then the value; a blank line ends each entry.
+    """
+
+    entry = {}
+    wanted = set(name.encode('ascii') for name in FIELDS)
+    for line in iter(f.readline, b''):
+        if line == b'\n':
+            if entry:
+                yield entry
+                entry = {}
+            continue
+        if line.endswith(b'\n'):
+            line = line[:-1]
+        name, eq, value = line.partition(b'=')
+        if not eq:
+            size, = struct.unpack('<Q', read_exactly(f, 8))
+            value = read_exactly(f, size + 1)[:-1]
+        if name in wanted:
+            entry[name.decode('ascii')] = value.decode('utf-8', 'replace')
+    if entry:
+        yield entry
+
+
+def json_value(value):
+    """
+    Returns a field from journalctl's JSON as text: a value that isn't
+    plain text is a list of byte values, and a field with several values is
+    a list of those, of which the first is used.
+    """
+
+    if isinstance(value, list):
+        if value and all(isinstance(v, int) for v in value):
+            return bytearray(value).decode('utf-8', 'replace')
+        return json_value(value[0]) if value else None
+    return value
+
+
+def read_json(f):
+    """Yields a dict of the FIELDS in each line of JSON in the binary file <f>."""
+    for line in f:
+        line = line.strip().lstrip(b'\x1e')     # Also allow -o json-seq
+        if not line:
+            continue
+        fields = json.loads(line.decode('utf-8'))
+        entry = {}
+        for name in FIELDS:
+            value = json_value(fields.get(name))
+            if value is not None:
+                entry[name] = value
+        yield entry
+
+
+def read_entries(f):
+    """Yields the entries of the binary file <f>, in either format."""
+    if not hasattr(f, 'peek'):
+        f = io.BufferedReader(f)
+    head = f.peek(1)[:1]
+    if head in (b'{', b'\x1e'):
+        return read_json(f)
+    return read_export(f)
+
+
+class JournalClock(object):
+    """
+    Converts __REALTIME_TIMESTAMP (microseconds since the epoch) to a
+    syslog timestamp in local time, e.g. "Aug 10 16:14:36".
+    """
+
+    def __init__(self):
+        self.last_seconds = None
+        self.last_dt = None
+
+
+    def dt(self, timestamp):
+        seconds = int(timestamp) // 1000000
+        if seconds != self.last_seconds:
+            t = time.localtime(seconds)
+            self.last_dt = "%s %2d %02d:%02d:%02d" % (MONTH_NAMES[t.tm_mon - 1], t.tm_mday,
+                                                     t.tm_hour, t.tm_min, t.tm_sec)
+            self.last_seconds = seconds
+        return self.last_dt
+
+
+class JournalScanner(object):
+    """
+    Matches journal entries like Scanner.find() matches lines.  Only
+    entries from the <hosts> are matched, by default just this one.
+    """
+
+    def __init__(self, include_local, logger, hosts=None):
+        self.log = logger
+        scanner = Scanner(include_local, logger, hosts=hosts)
+        # Mapping of program tag to a list of (re_object, label, has_pid)
+        # tuples, in the same order as Scanner.rd
+        self.by_prog = {}
+        for regex, label in scanner.rd:
+            has_pid, message_regex = split_pattern(regex.pattern, scanner.dh_regex)
+            self.by_prog.setdefault(PROGRAMS[label], []).append(
+                (re.compile(message_regex), label, has_pid))
+        hosts = hosts or [socket.gethostname()]
+        self.hosts = None if ANY_HOST in hosts else set(hosts)
+        self.prog_cache = {}
+        self.clock = JournalClock()
+
+
+    def patterns(self, prog):
+        """As for Scanner.patterns()."""
+        try:
+            return self.prog_cache[prog]
+        except KeyError:
+            pass
+
+        rd = self.by_prog.get(prog)
+        if rd is None:
+            if prog and prog.startswith(SMTPD_PREFIXES):
+                rd = self.by_prog.get('postfix/smtpd', [])
+            else:
+                rd = []
+        self.prog_cache[prog] = rd
+        return rd
+
+
+    def find(self, entry):
+        """
+        Returns the label and match groups for the entry, with the date and
+        pid (if any) first as for a line, or None.
+        """
+
+        patterns = self.patterns(entry.get('SYSLOG_IDENTIFIER'))
+        if not patterns:
+            return None
+        if self.hosts is not None and entry.get('_HOSTNAME') not in self.hosts:
+            return None
+        message = entry.get('MESSAGE')
+        timestamp = entry.get('__REALTIME_TIMESTAMP')
+        if message is None or timestamp is None:
+            return None
+        for regex, label, has_pid in patterns:
+            m = regex.match(message)
+            if m:
+                dt = self.clock.dt(timestamp)
+                if has_pid:
+                    pid = entry.get('SYSLOG_PID') or entry.get('_PID')
+                    return label, (dt, pid) + m.groups()
+                return label, (dt,) + m.groups()
@@ -0,0 +1,157 @@
+"""
+Generates synthetic mail logs for tests and benchmarks.
+
+Several messages are in progress at once, so the smtpd, cleanup, spamd,
+qmgr, local, dovecot lda and qmgr "removed" lines of each are interleaved
+with each other's, and with lines from other programs that postscan
+ignores.  The output depends only on the arguments, including the seed, so
+the same log can be regenerated anywhere.
+
+E.g. python -m postscan.loggen --messages 100000 --no-msg-id 0.2 > mail.log
+"""
+
+from __future__ import absolute_import
+
+import sys
+import time
+import socket
+import random
+import calendar
+
+import click
+
+
+# Lines from programs and events that postscan doesn't match
+NOISE = [
+    "postfix/anvil[123]: statistics: max connection rate 1/60s for (smtp:1.2.3.4) at Aug 10 16:14:36",
+    "postfix/tlsmgr[42]: prng_exch cache update",
+    "postfix/smtp[999]: 1234ABC: to=<x@example.org>, relay=mx.example.org[5.6.7.8]:25, delay=1, status=sent (250 ok)",
+    "postfix/smtpd[4242]: lost connection after AUTH from unknown[185.234.218.10]",
+    "amavis[2222]: (02222-01) Passed CLEAN {RelayedInbound}, [1.2.3.4]:1234 <a@b.c> -> <d@e.f>, Hits: -1",
+    "kernel: [12345.6789] eth0: link up",
+    "dovecot: imap(user1): Logged out in=12 out=345",
+]
+
+# When the log starts; fixed so that the output is reproducible
+START = calendar.timegm((2018, 8, 10, 0, 0, 0))
+
+
+def syslog_time(seconds):
+    t = time.gmtime(seconds)
+    return "%s %2d %02d:%02d:%02d" % (time.strftime("%b", t), t.tm_mday,
+                                     t.tm_hour, t.tm_min, t.tm_sec)
+
+
+def message(rng, num, no_msg_id, fanout, zombies):
+    """Returns the lines (minus date & host) for the <num>th message."""
+
+    queue_id = "%X" % rng.randint(0x100000000, 0xFFFFFFFFF)
+    ip = "%d.%d.%d.%d" % (rng.randint(1, 223), rng.randint(0, 255),
+                          rng.randint(0, 255), rng.randint(1, 254))
+    client = "mail%d.example.net" % rng.randint(1, 50)
+    smtpd_pid = rng.randint(1000, 99999)
+    if rng.random() < no_msg_id:
+        msg_id, mid, msgid = "", "(unknown)", "unspecified"
+    else:
+        msg_id = "%x.%d@%s" % (rng.getrandbits(48), num, client)
+        mid = msgid = "<%s>" % msg_id
+    score = rng.randint(-5, 15)
+    users = rng.sample(range(1, 31), rng.randint(1, fanout))
+
+    lines = [
+        "postfix/smtpd[%d]: connect from %s[%s]" % (smtpd_pid, client, ip),
+        "postfix/smtpd[%d]: %s: client=%s[%s]" % (smtpd_pid, queue_id, client, ip),
+        "postfix/cleanup[%d]: %s: message-id=<%s>" % (rng.randint(1000, 99999), queue_id, msg_id),
+        "spamd[%d]: spamd: result: %s %d - BAYES_50,HTML_MESSAGE scantime=0.5,size=%d,"
+        "user=spamass-milter,uid=124,required_score=5.0,rhost=localhost,raddr=127.0.0.1,"
+        "rport=35658,mid=%s,autolearn=no" % (rng.randint(1000, 99999), "Y" if score >= 5 else ".",
+                                             score, rng.randint(1000, 99999), mid),
+    ]
+    if rng.random() < zombies:
+        # Rejected by the milter, so there's never a "removed" line
+        lines += [
+            "postfix/cleanup[4499]: %s: milter-reject: END-OF-MESSAGE from %s[%s]: "
+            "5.7.1 Blocked by SpamAssassin" % (queue_id, client, ip),
+            "postfix/smtpd[%d]: disconnect from %s[%s] ehlo=1 mail=1 rcpt=1 data=0/1 quit=1 commands=4/5"
+            % (smtpd_pid, client, ip),
+        ]
+        return lines
+
+    lines += [
+        "postfix/qmgr[37259]: %s: from=<sender%d@example.net>, size=%d, nrcpt=%d (queue active)"
+        % (queue_id, num, rng.randint(1000, 99999), len(users)),
+        "postfix/smtpd[%d]: disconnect from %s[%s] ehlo=1 mail=1 rcpt=%d data=1 quit=1 commands=%d"
+        % (smtpd_pid, client, ip, len(users), 4 + len(users)),
+    ]
+    mailbox = "Junk" if score >= 5 else "INBOX"
+    for user in users:
+        local_pid = rng.randint(1000, 99999)
+        if rng.random() < 0.5:
+            lines.append("postfix/local[%d]: %s: to=<user%d@example.com>, orig_to=<info@example.com>, "
+                         "relay=local, delay=3.3, delays=3.2/0/0/0.04, dsn=2.0.0, status=sent "
+                         "(delivered to command: /usr/lib/dovecot/dovecot-lda)" % (local_pid, queue_id, user))
+        else:
+            lines.append("postfix/local[%d]: %s: to=<user%d@example.com>, relay=local, delay=0.2, "
+                         "delays=0.1/0/0/0.04, dsn=2.0.0, status=sent "
+                         "(delivered to command: /usr/lib/dovecot/dovecot-lda)" % (local_pid, queue_id, user))
+        lines.append("dovecot: lda(user%d): sieve: msgid=%s: stored mail into mailbox '%s'"
+                     % (user, msgid, mailbox))
+    lines.append("postfix/qmgr[37259]: %s: removed" % queue_id)
+    return lines
+
+
+def generate(messages, seed=0, no_msg_id=0.1, fanout=1, zombies=0.0, noise=1.0,
+             concurrency=4, host=None):
+    """
+    Yields the lines of a log with <messages> messages, of which <no_msg_id>
+    (a fraction) have no Message-ID and <zombies> are rejected and never
+    removed.  Each has between 1 and <fanout> local recipients.  There are
+    <noise> unrelated lines per message line on average, and up to
+    <concurrency> messages are interleaved at once.
+    """
+
+    rng = random.Random(seed)
+    host = host or socket.gethostname()
+    seconds = START
+    started = 0
+    active = []
+    while active or started < messages:
+        while len(active) < concurrency and started < messages:
+            active.append(iter(message(rng, started, no_msg_id, fanout, zombies)))
+            started += 1
+            seconds += rng.randint(0, 2)
+        index = rng.randrange(len(active))
+        text = next(active[index], None)
+        if text is None:
+            del active[index]
+            continue
+        dt = syslog_time(seconds)
+        yield "%s %s %s\n" % (dt, host, text)
+        while rng.random() * (1 + noise) >= 1:
+            yield "%s %s %s\n" % (dt, host, rng.choice(NOISE))
+
+
+@click.command()
+@click.option('-n', '--messages', type=click.IntRange(0), default=1000,
+              help="Number of messages")
+@click.option('--seed', type=click.INT, default=0)
+@click.option('--no-msg-id', type=click.FloatRange(0, 1), default=0.1,
+              help="Fraction of messages without a Message-ID")
+@click.option('--fanout', type=click.IntRange(1, 30), default=1,
+              help="Maximum number of recipients per message")
+@click.option('--zombies', type=click.FloatRange(0, 1), default=0.0,
+              help="Fraction of messages that are never removed")
+@click.option('--noise', type=click.FloatRange(0), default=1.0,
+              help="Average number of unrelated lines per message line")
+@click.option('--concurrency', type=click.IntRange(1), default=4,
+              help="Number of messages in progress at once")
+@click.option('--host', type=click.STRING,
+              help="Hostname in each line (defaults to this host's)")
+def main(messages, seed, no_msg_id, fanout, zombies, noise, concurrency, host):
+    """Writes a synthetic mail log to stdout."""
+    sys.stdout.writelines(generate(messages, seed, no_msg_id, fanout, zombies, noise,
+                                   concurrency, host))
+
+
+if __name__ == "__main__":
+    sys.exit(main())  # pragma: no cover
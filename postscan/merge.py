@@ -0,0 +1,70 @@
+"""
+Merges several logs into one stream in time order, for --merge: e.g.
+rotated files given in any order, or the logs of different daemons or
+hosts, whose lines have to be seen together for a message to be followed.
+
+The files are all read at once, holding one line from each on a heap, so
+memory doesn't grow with their length.  Each file is assumed to be in
+order already.  Lines with the same time are taken from the file that
+starts first, or that was given first if they start at the same time, so
+that e.g. the last second of a rotated file comes before the first second
+of the next one; lines without a timestamp stay after the line before.
+
+Syslog timestamps have no year, so each file's are placed in sequence, as
+for a single log (see timestamps.SyslogClock), starting from the last year
+in which its first line isn't later than the file was last modified.  A
+set of logs that spans New Year is then still merged in order months later.
+"""
+
+from __future__ import absolute_import
+
+import time
+import heapq
+import operator
+import itertools
+
+from .inputs import iter_lines
+from .timestamps import SyslogClock
+from .window import DT_RE
+
+
+def timed_lines(f, clock):
+    """
+    Yields the (seconds, line) of each line of the binary file <f>, using
+    the SyslogClock <clock>, where a line without a timestamp has the time
+    of the line before.
+    """
+
+    seconds = 0
+    for line in iter_lines(f):
+        m = DT_RE.match(line)
+        if m:
+            t = clock.seconds(m.group(1).decode('ascii'))
+            if t is not None:
+                seconds = t
+        yield seconds, line
+
+
+def merge(files, times=None, now=None):
+    """
+    Yields the lines (as bytes) of the binary files <files> in order of
+    their timestamps.  <times> gives the time each file was last modified,
+    or None where that isn't known (e.g. for stdin), in which case <now> is
+    used instead.
+    """
+
+    now = time.time() if now is None else now
+    times = times or [None] * len(files)
+    # List of (time of the first line, index, lines) tuples, for ranking
+    # the files; each has a clock of its own, to infer its years in sequence
+    streams = []
+    for index, (f, mtime) in enumerate(zip(files, times)):
+        lines = timed_lines(f, SyslogClock(now=now if mtime is None else mtime))
+        first = next(lines, None)
+        if first is not None:
+            streams.append((first[0], index, itertools.chain([first], lines)))
+    streams.sort(key=operator.itemgetter(0, 1))
+    # heapq.merge() takes equal lines from the earlier iterable first
+    for seconds, line in heapq.merge(*[lines for first, index, lines in streams],
+                                     key=operator.itemgetter(0)):
+        yield line
@@ -0,0 +1,114 @@
+"""
+Writes completed message records (see records.Completed) in the format
+chosen with --format:
+
+text
+    The original human-readable layout.
+jsonl
+    One JSON object per line.
+tsv
+    Tab-separated columns, after a header line: queue_id, time, ip,
+    envfrom, msg_id, incomplete, then to, orig_to, user, mailbox and
+    spam_level, each a comma-separated list with one entry per recipient,
+    and finally host (with --hosts).
+    Tabs, newlines, commas and backslashes in values are escaped with a
+    backslash, and missing values are empty.
+
+Records are formatted into a buffer that is written out in large chunks,
+rather than with several print() calls per message.
+"""
+
+from __future__ import absolute_import
+
+import json
+
+
+BUFFER_SIZE = 256 * 1024
+
+
+class Writer(object):
+    """Buffers formatted records, writing them to the text file <out>."""
+
+    header = None
+
+    def __init__(self, out, buffer_size=None):
+        self.out = out
+        self.buffer_size = BUFFER_SIZE if buffer_size is None else buffer_size
+        self.pending = []
+        self.size = 0
+        if self.header:
+            self.pending.append(self.header)
+
+
+    def write(self, record):
+        s = self.format(record)
+        self.pending.append(s)
+        self.size += len(s)
+        if self.size >= self.buffer_size:
+            self.drain()
+
+
+    def drain(self):
+        if self.pending:
+            self.out.write("".join(self.pending))
+            self.pending = []
+            self.size = 0
+
+
+    def flush(self):
+        self.drain()
+        self.out.flush()
+
+
+    def format(self, record):
+        raise NotImplementedError
+
+
+class TextWriter(Writer):
+    def format(self, record):
+        lines = ["{0}: ({1}) {2} [{3}]{4}{5}".format(record.queue_id, record.dt, record.envfrom,
+                                                     record.ip,
+                                                     " on " + record.host if record.host else "",
+                                                     " INCOMPLETE" if record.incomplete else ""),
+                 "  ({0})".format(record.msg_id)]
+        # Note: each delivery is not currently tied to a recipient
+        for r in record.recipients:
+            if r.orig_to:
+                lines.append("  {0} = {1}".format(r.address, r.orig_to))
+            else:
+                lines.append("  {0}".format(r.address))
+            if r.user is not None:
+                lines.append("  ...{0}: saved to '{1}', spam level {2}".format(
+                    r.user, r.mailbox, r.spam_level))
+        lines.append("\n")
+        return "\n".join(lines)
+
+
+class JsonLinesWriter(Writer):
+    def format(self, record):
+        return json.dumps({'queue_id': record.queue_id, 'time': record.dt, 'ip': record.ip,
+                           'envfrom': record.envfrom, 'msg_id': record.msg_id,
+                           'recipients': [r._asdict() for r in record.recipients],
+                           'incomplete': record.incomplete, 'host': record.host}) + "\n"
+
+
+def escape(value):
+    if value is None:
+        return ""
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t") \
+                     .replace("\n", "\\n").replace(",", "\\,")
+
+
+class TsvWriter(Writer):
+    header = "queue_id\ttime\tip\tenvfrom\tmsg_id\tincomplete\tto\torig_to\tuser\tmailbox\tspam_level\thost\n"
+
+    def format(self, record):
+        fields = [escape(record.queue_id), escape(record.dt), escape(record.ip),
+                  escape(record.envfrom), escape(record.msg_id), "1" if record.incomplete else "0"]
+        for column in zip(*record.recipients) if record.recipients else [()] * 5:
+            fields.append(",".join([escape(value) for value in column]))
+        fields.append(escape(record.host))
+        return "\t".join(fields) + "\n"
+
+
+FORMATS = {'text': TextWriter, 'jsonl': JsonLinesWriter, 'tsv': TsvWriter}
@@ -0,0 +1,112 @@
+"""
+Scans a large log file in parallel.
+
+The file is split into chunks at line boundaries, which are matched by
+:class:Scanner in a pool of worker processes.  Each worker returns a compact
+list of (line_num, label, groups) events, and the chunks' results are
+yielded in their original order so that the state can be updated serially.
+"""
+
+from __future__ import absolute_import
+
+import io
+import os
+import logging
+import collections
+import multiprocessing
+
+from .scanner import Scanner
+
+
+CHUNK_SIZE = 8 * 1024 * 1024
+
+# The worker process's Scanner, created by init_worker()
+scanner = None
+
+
+def init_worker(include_local, binary, hosts=None):
+    global scanner
+    scanner = Scanner(include_local, logging.getLogger("postscan"), binary, hosts)
+
+
+def scan_chunk(args):
+    """
+    Scans the lines between two byte offsets in a file, returning the number
+    of lines and a list of events with line numbers relative to the chunk.
+    """
+
+    path, start, end, encoding, errors = args
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+
+    events = []
+    line_num = 0
+    if scanner.binary:
+        for line_num, line in enumerate(data.splitlines(True), 1):
+            result = scanner.find_bytes(line, line_num)
+            if result:
+                events.append((line_num, result[0], result[1]))
+    else:
+        stream = io.TextIOWrapper(io.BytesIO(data), encoding=encoding, errors=errors)
+        for line_num, line in enumerate(stream, 1):
+            result = scanner.find(line, line_num)
+            if result:
+                events.append((line_num, result[0], result[1]))
+    return line_num, events
+
+
+def chunks(path, chunk_size):
+    """Yields (start, end) byte offsets of chunks ending with a newline."""
+
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        start = 0
+        while start < size:
+            f.seek(min(start + chunk_size, size))
+            f.readline()
+            end = min(f.tell(), size)
+            yield start, end
+            start = end
+
+
+def seekable_path(stream):
+    """Returns the path of a stream if it's a regular file, else None."""
+
+    path = getattr(stream, 'name', None)
+    if isinstance(path, str) and os.path.isfile(path):
+        return path
+    return None
+
+
+def scan_file(path, jobs, scanner_args, encoding=None, errors=None,
+              chunk_size=None, count_lines=None):
+    """
+    Scans the file with <jobs> processes, yielding (line_num, label, groups)
+    in order.  <scanner_args> is (include_local, binary, hosts) as per
+    :class:Scanner.  At most 2 chunks per process are in flight at once, to
+    bound memory use when the caller is slower than the workers.  If given,
+    <count_lines> is called with the number of lines in each chunk once its
+    events have been yielded.
+    """
+
+    offsets = chunks(path, chunk_size or CHUNK_SIZE)
+    pool = multiprocessing.Pool(jobs, init_worker, scanner_args)
+    try:
+        pending = collections.deque()
+        base = 0
+        while True:
+            for start, end in offsets:
+                pending.append(pool.apply_async(scan_chunk, ((path, start, end, encoding, errors),)))
+                if len(pending) >= jobs * 2:
+                    break
+            if not pending:
+                break
+            num_lines, events = pending.popleft().get()
+            for line_num, label, groups in events:
+                yield base + line_num, label, groups
+            base += num_lines
+            if count_lines:
+                count_lines(num_lines)
+    finally:
+        pool.terminate()
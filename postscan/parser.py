@@ -0,0 +1,127 @@
+"""
+A parser for using postscan as a library.  Each Parser has all of its
+state to itself, so any number can run at once in one process, e.g. one
+per stream in threads, asyncio tasks or a long-running service:
+
+    parser = Parser(to='user@example.com')
+    for chunk in stream:
+        parser.feed(chunk)
+        for record in parser.records():
+            ...
+    parser.close()
+    for record in parser.records():
+        ...
+
+Lines can be fed whole (as str or bytes) with feed_line(), or in chunks of
+any size with feed(), which keeps an incomplete last line until the next
+chunk or close().  Each message is returned as a Completed record (see
+records.py) once it has been removed from the queue, either by records()
+or, if a <callback> is given, by calling it with the record straight away.
+"""
+
+from __future__ import absolute_import
+
+import re
+import logging
+import collections
+
+from .state import StateMachine
+from .scanner import Scanner
+from . import hosts as hosts_module
+
+
+class Parser(object):
+    """
+    Parses one stream of log lines.  The options are as for the command
+    line: <to> is --to, <spam_level> --spam-level, <client_ip> (a regex)
+    --client-ip, and so on.  Lines in <encoding> that don't decode are
+    parsed with replacement characters.
+    """
+
+    def __init__(self, to=None, spam_level=None, client_ip=None, include_local=False,
+                 hosts=None, max_age=None, emit_incomplete=False,
+                 callback=None, logger=None, encoding='utf-8'):
+        self.log = logger or logging.getLogger("postscan")
+        self.encoding = encoding
+        self.scanner = Scanner(include_local, self.log, False, hosts)
+        # Records waiting to be taken by records(), unless there's a callback
+        self.pending = collections.deque()
+        emit = callback or self.pending.append
+        state_args = (to, spam_level, re.compile(client_ip) if client_ip else None,
+                      self.log.getChild('state'), max_age, emit_incomplete)
+        # As for Controller, with a StateMachine per host if any are given
+        self.hosts = hosts
+        if hosts:
+            self.handler = hosts_module.HostRouter(state_args, emit)
+        else:
+            self.handler = StateMachine(*state_args, emit=emit)
+        self.line_num = 0
+        # The incomplete line at the end of the last chunk
+        self.tail = None
+        self.closed = False
+
+
+    def feed_line(self, line):
+        """Parses one line, as str or bytes, with or without its newline."""
+        if self.closed:
+            raise ValueError("feed_line() on a closed Parser")
+        self.line_num += 1
+        if isinstance(line, bytes):
+            raw, line = line, line.decode(self.encoding, 'replace')
+        else:
+            raw = None
+        result = self.scanner.find(line, self.line_num)
+        if result:
+            label, groups = result
+            if self.hosts:
+                host = hosts_module.host_of(raw if raw is not None else line.encode(self.encoding))
+                self.handler.dispatch(host, label, groups, self.line_num)
+            else:
+                self.handler.dispatch(label, groups, self.line_num)
+
+
+    def feed(self, data):
+        """Parses a chunk of the stream, as str or bytes, split anywhere."""
+        if self.closed:
+            raise ValueError("feed() on a closed Parser")
+        if self.tail:
+            data = self.tail + data
+        lines = data.split('\n' if isinstance(data, str) else b'\n')
+        # After the last newline, which is empty if it ends the chunk
+        self.tail = lines.pop()
+        for line in lines:
+            self.feed_line(line)
+
+
+    def close(self):
+        """Parses anything left over from feed() and finishes the stream."""
+        if self.closed:
+            return
+        if self.tail:
+            self.feed_line(self.tail)
+            self.tail = None
+        self.closed = True
+        self.handler.cleanup()
+
+
+    def records(self):
+        """Yields the records of the messages finished so far, each once."""
+        pending = self.pending
+        while pending:
+            yield pending.popleft()
+
+
+def parse_lines(lines, **kwargs):
+    """
+    Yields the records of the messages in <lines> (an iterable of str or
+    bytes), with the options of a Parser.
+    """
+
+    parser = Parser(**kwargs)
+    for line in lines:
+        parser.feed_line(line)
+        for record in parser.records():
+            yield record
+    parser.close()
+    for record in parser.records():
+        yield record
@@ -9,26 +9,75 @@ Parses string input using :class:Scanner and hands events to
 
 from __future__ import absolute_import
 
+import os
 import re
+import sys
+import time
+import locale
 
 from .state import StateMachine
 from .scanner import Scanner
+from .inputs import iter_lines, open_binary, skip_bytes, is_regular
+from .follow import Follower
+from .stats import Stats
+from .output import FORMATS
+from .database import DatabaseWriter
+from .summary import Summary
+from . import checkpoint
+from . import parallel
+from . import window
+from . import twopass
+from . import hosts
+from . import journal
+from . import merge
 
 
 class Controller(object):
     def __init__(self, params, logger):
         self.log = logger
 
-        self.scanner = Scanner(params['local'], logger)
+        self.scanner = Scanner(params['local'], logger, params['binary'], params.get('hosts'))
+        self.scanner_args = (params['local'], params['binary'], params.get('hosts'))
+        self.jobs = params['jobs']
+        self.hosts = params.get('hosts')
+        # With --since, how far before it to start reading
+        self.lead_in = window.LEAD_IN if params.get('max_age') is None else params['max_age']
+        # For decoding lines that are read as bytes in text mode
+        self.encoding = locale.getpreferredencoding(False)
 
         if params['client_ip']:
             ip_re = re.compile(params['client_ip'])
         else:
             ip_re = None
-        self.handler = StateMachine(params['to'], params['spam_level'], ip_re, logger.getChild('state'))
+        if params.get('summary'):
+            self.writer = Summary(sys.stdout, params.get('format') or 'text',
+                                  params.get('summary_top'), params.get('summary_keys'))
+        elif params.get('db'):
+            self.writer = DatabaseWriter(params['db'])
+        else:
+            self.writer = FORMATS[params.get('format') or 'text'](sys.stdout)
+        self.state_args = (params['to'], params['spam_level'], ip_re, logger.getChild('state'),
+                           params.get('max_age'), params.get('emit_incomplete', False))
+        if params.get('hosts'):
+            # A StateMachine per host (see hosts.py), only used by parse_hosts()
+            self.handler = hosts.HostRouter(self.state_args, self.writer.write)
+        else:
+            self.handler = StateMachine(*self.state_args, emit=self.writer.write)
+        # Instruments the scanner and handler when profiling (see stats.py)
+        self.stats = Stats(self.scanner, self.handler) if params.get('stats') else None
+
+
+    def cleanup(self):
+        self.handler.cleanup()
+        self.writer.flush()
 
 
     def parse_stream(self, stream):
+        path = parallel.seekable_path(stream) if self.jobs > 1 else None
+        if path:
+            return self.parse_file_parallel(path, getattr(stream, 'encoding', None),
+                                            getattr(stream, 'errors', None))
+
         for i, line in enumerate(stream):
             line_num = i + 1
             result = self.scanner.find(line, line_num)
@@ -38,4 +87,327 @@ class Controller(object):
                 self.handler.dispatch(label, groups, line_num)
             ## else:
             ##     print("?")
-        self.handler.cleanup()
+        self.cleanup()
+
+
+    def parse_binary(self, f):
+        """
+        Like parse_stream() but for a binary file object, in which lines are
+        matched without decoding them (see Scanner.find_bytes()).
+        """
+
+        path = parallel.seekable_path(f) if self.jobs > 1 else None
+        if path:
+            return self.parse_file_parallel(path)
+
+        for line_num, line in enumerate(iter_lines(f), 1):
+            result = self.scanner.find_bytes(line, line_num)
+            if result:
+                label, groups = result
+                self.log.debug("Handling %s on %d", label, line_num)
+                self.handler.dispatch(label, groups, line_num)
+        self.cleanup()
+
+
+    def parse_file_parallel(self, path, encoding=None, errors=None):
+        """
+        Like parse_stream() but hands the regex matching for a regular file
+        to a pool of processes.
+        """
+
+        count_lines = self.stats.count_lines if self.stats else None
+        for line_num, label, groups in parallel.scan_file(path, self.jobs, self.scanner_args,
+                                                          encoding, errors,
+                                                          count_lines=count_lines):
+            self.log.debug("Handling %s on %d", label, line_num)
+            self.handler.dispatch(label, groups, line_num)
+        self.cleanup()
+
+
+    def follow(self, path, poll=False):
+        """
+        Processes lines as they are written to the file <path>, keeping the
+        state, until interrupted.  Output is flushed whenever the file is
+        idle, so each message appears as soon as it has been removed.
+        """
+
+        self.follower = Follower(path, self.log, self.writer.flush, poll)
+        try:
+            for line_num, line in enumerate(self.follower, 1):
+                self.parse_line_bytes(line, line_num)
+        finally:
+            self.cleanup()
+
+
+    def find_line_bytes(self, line, line_num):
+        """Matches a line read as bytes, in either text or binary mode."""
+        if self.scanner.binary:
+            return self.scanner.find_bytes(line, line_num)
+        return self.scanner.find(line.decode(self.encoding, 'replace'), line_num)
+
+
+    def parse_line_bytes(self, line, line_num):
+        """Handles a line read as bytes, in either text or binary mode."""
+
+        result = self.find_line_bytes(line, line_num)
+        if result:
+            label, groups = result
+            self.log.debug("Handling %s on %d", label, line_num)
+            if self.hosts:
+                self.handler.dispatch(hosts.host_of(line), label, groups, line_num)
+            else:
+                self.handler.dispatch(label, groups, line_num)
+
+
+    def parse_window(self, path, since=None, until=None):
+        """
+        Processes the lines of the file <path> (or stdin for "-") between
+        the times <since> and <until> (see timestamps.parse_time()), either
+        but not both of which can be None, printing the messages that are
+        removed in between.  Line numbers count from where reading starts.
+        """
+
+        f = open_binary(path)
+        try:
+            clock = window.LineClock(until if since is None else since)
+            if is_regular(f):
+                self.parse_range(f, clock, since, until)
+            else:
+                self.parse_filtered(f, clock, since, until)
+        finally:
+            if path != '-':
+                f.close()
+        self.cleanup()
+
+
+    def parse_range(self, f, clock, since, until):
+        """Finds the window in a regular file by binary search (see window.py)."""
+
+        first, start, end = window.find_range(f, os.fstat(f.fileno()).st_size, clock,
+                                              since, until, self.lead_in)
+        self.log.debug("Reading bytes %d-%d, printing from %d", first, end, start)
+        f.seek(first)
+        offset = first
+        emit = self.handler.emit
+        self.handler.emit = lambda record: None
+        try:
+            for line_num, line in enumerate(iter_lines(f), 1):
+                if offset >= start:
+                    self.handler.emit = emit
+                    if offset >= end:
+                        break
+                offset += len(line)
+                self.parse_line_bytes(line, line_num)
+        finally:
+            self.handler.emit = emit
+
+
+    def parse_filtered(self, f, clock, since, until):
+        """Reads a stream from the start, skipping lines by their times."""
+
+        first = None if since is None else since - self.lead_in
+        emit = self.handler.emit
+        if since is not None:
+            self.handler.emit = lambda record: None
+        line_num = 0
+        try:
+            for line in iter_lines(f):
+                seconds = clock(line)
+                if first is not None:
+                    # Skip everything up to the first line of the lead-in
+                    if seconds is None or seconds < first:
+                        continue
+                    first = None
+                if seconds is not None:
+                    if since is not None and seconds >= since:
+                        self.handler.emit = emit
+                        since = None
+                    if until is not None and seconds >= until:
+                        break
+                line_num += 1
+                self.parse_line_bytes(line, line_num)
+        finally:
+            self.handler.emit = emit
+
+
+    def parse_two_pass(self, path):
+        """
+        Processes the file <path> in two passes, only correlating the
+        messages delivered to the --to address (see twopass.py).  Line
+        numbers only count the lines that are handled.
+        """
+
+        f = open_binary(path)
+        try:
+            targets = twopass.find_targets(f, self.handler.target_rcpt, self.find_line_bytes)
+        finally:
+            f.close()
+        self.log.debug("%d messages for %s", len(targets.queue_ids), self.handler.target_rcpt)
+
+        if targets.queue_ids:
+            # Messages without a Message-ID are only looked for in the range
+            # the second pass reads
+            f, end = self.open_targets_range(path, targets)
+            try:
+                targets.anonymous = twopass.find_anonymous(f, end)
+            finally:
+                f.close()
+            self.log.debug("%d messages without a Message-ID", len(targets.anonymous))
+
+            f, end = self.open_targets_range(path, targets)
+            try:
+                for line_num, line in enumerate(twopass.wanted_lines(f, targets.wanted(), end), 1):
+                    self.parse_line_bytes(line, line_num)
+            finally:
+                f.close()
+        self.cleanup()
+
+
+    def open_targets_range(self, path, targets):
+        """
+        Opens the file <path> at the start of the second pass, returning the
+        file and the offset at which to stop, or None for the end.  A
+        compressed file is read from the start each time.
+        """
+
+        f = open_binary(path)
+        end = None
+        if is_regular(f):
+            start, end = self.find_targets_range(f, targets)
+            f.seek(start)
+        return f, end
+
+
+    def find_targets_range(self, f, targets):
+        """
+        Returns the offsets in the regular file <f> at which to start and
+        stop the second pass: the lead-in (see window.py) before the
+        longest delay before the first delivery, so that the earliest of the
+        messages to arrive is covered, and as long again after the last
+        delivery.
+        """
+
+        first_offset = targets.start
+        f.seek(first_offset)
+        first_line = f.readline()
+        last_offset, last_line = targets.last
+        clock = window.LineClock(window.LineClock(time.time())(first_line))
+        start = window.find_offset(f, clock(first_line) - targets.delay - self.lead_in, clock,
+                                   0, first_offset)
+        end = window.find_offset(f, clock(last_line) + self.lead_in, clock, last_offset,
+                                 os.fstat(f.fileno()).st_size)
+        return start, end
+
+
+    def parse_hosts(self, path):
+        """
+        Processes the file <path> (or stdin for "-") from several hosts,
+        with a StateMachine for each.  With --jobs, the hosts are shared
+        between processes (see hosts.py).
+        """
+
+        if self.jobs > 1 and path != '-':
+            for record in hosts.scan_file(path, self.jobs, self.scanner_args, self.state_args,
+                                          self.encoding):
+                self.writer.write(record)
+        else:
+            f = open_binary(path)
+            try:
+                hosts.handle_lines(iter_lines(f), self.scanner, self.handler, self.encoding)
+            finally:
+                if path != '-':
+                    f.close()
+        self.cleanup()
+
+
+    def parse_journal(self, path):
+        """
+        Processes the systemd journal entries in the file <path> (or stdin
+        for "-"), as written by "journalctl -o export" or "-o json" (see
+        journal.py).  Line numbers count the entries.
+        """
+
+        scanner = journal.JournalScanner(self.scanner_args[0], self.log, self.hosts)
+        f = open_binary(path)
+        try:
+            for line_num, entry in enumerate(journal.read_entries(f), 1):
+                result = scanner.find(entry)
+                if result:
+                    label, groups = result
+                    self.log.debug("Handling %s on %d", label, line_num)
+                    if self.hosts:
+                        self.handler.dispatch(entry.get('_HOSTNAME'), label, groups, line_num)
+                    else:
+                        self.handler.dispatch(label, groups, line_num)
+        finally:
+            if path != '-':
+                f.close()
+        self.cleanup()
+
+
+    def parse_merged(self, paths):
+        """
+        Processes the files <paths> (or stdin for "-") together, in order of
+        their lines' timestamps (see merge.py).  Line numbers count the
+        merged lines.
+        """
+
+        files = []
+        # Each file's years are inferred from when it was last written to
+        times = [None if path == '-' else os.stat(path).st_mtime for path in paths]
+        try:
+            for path in paths:
+                files.append(open_binary(path))
+            for line_num, line in enumerate(merge.merge(files, times), 1):
+                self.parse_line_bytes(line, line_num)
+        finally:
+            for path, f in zip(paths, files):
+                if path != '-':
+                    f.close()
+        self.cleanup()
+
+
+    def parse_files_checkpointed(self, paths, checkpoint_path):
+        """
+        Processes the files, resuming from the state and file positions
+        saved in the checkpoint file by an earlier run (if any), and then
+        saves them for the next run.
+        """
+
+        state, positions = checkpoint.load(checkpoint_path)
+        if state:
+            self.handler.set_state(state)
+        # Files that aren't given this time are forgotten
+        new_positions = {}
+        for path in paths:
+            key, position = self.parse_file_from(path, positions)
+            new_positions[key] = position
+        self.cleanup()
+        checkpoint.save(checkpoint_path, self.handler.get_state(), new_positions)
+
+
+    def parse_file_from(self, path, positions):
+        """
+        Processes the file <path> from where an earlier run left off, as
+        recorded in <positions>.  Returns the file's key and position for
+        the next run; an incomplete line at the end is left for then.
+        """
+
+        st = os.stat(path)
+        key = (st.st_dev, st.st_ino)
+        offset, line_num = positions.get(key, (0, 0))
+        f = open_binary(path)
+        try:
+            if is_regular(f) and st.st_size < offset:
+                self.log.debug("%s has been truncated", path)
+                offset, line_num = 0, 0
+            skip_bytes(f, offset)
+            for line in iter_lines(f):
+                if not line.endswith((b'\n', b'\r')):
+                    break
+                offset += len(line)
+                line_num += 1
+                self.parse_line_bytes(line, line_num)
+        finally:
+            f.close()
+        return key, (offset, line_num)
@@ -0,0 +1,83 @@
+"""
+Compact records for the state of in-flight messages, which can number in
+the hundreds of thousands.  Using __slots__ rather than a dict per record
+saves the per-instance dict, and fields that haven't been seen yet are None.
+"""
+
+from __future__ import absolute_import
+
+import collections
+
+
+class Message(object):
+    """A queue ID that is in progress, from its client or pickup line."""
+
+    __slots__ = ('dt', 'ip', 'msg_id', 'msg_id_faked', 'envfrom', 'to',
+                 'blessed', 'seconds')
+
+    def __init__(self, dt, ip, seconds=None):
+        self.dt = dt
+        self.ip = ip
+        self.msg_id = None
+        self.msg_id_faked = False
+        self.envfrom = None
+        self.to = None              # List of (rcpt, envto, username)
+        self.blessed = False
+        self.seconds = seconds      # Arrival time, when evicting old messages
+
+
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+
+    def __setstate__(self, state):
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
+
+
+class Delivery(object):
+    """
+    A delivery of a Message-ID to one user, with its spam score.  A Sieve
+    line can be seen without a mailbox (e.g. "discard action"), so
+    <mailbox_seen> records whether there has been one, as its score isn't
+    then the message's default.
+    """
+
+    __slots__ = ('user', 'int_score', 'count', 'mailbox', 'mailbox_seen')
+
+    def __init__(self, user, int_score=None, mailbox=None):
+        self.user = user
+        self.int_score = int_score
+        self.count = 1
+        self.mailbox = mailbox
+        self.mailbox_seen = mailbox is not None
+
+
+    def __getstate__(self):
+        return self.user, self.int_score, self.count, self.mailbox, self.mailbox_seen
+
+
+    def __setstate__(self, state):
+        self.user, self.int_score, self.count, self.mailbox, self.mailbox_seen = state
+
+
+# A recipient of a completed message; user, mailbox and spam_level are None
+# if there's no delivery for the recipient's username
+Recipient = collections.namedtuple('Recipient', 'address orig_to user mailbox spam_level')
+
+
+class Completed(object):
+    """A message that has been removed (or evicted), as passed to the output."""
+
+    __slots__ = ('queue_id', 'dt', 'ip', 'envfrom', 'msg_id', 'recipients', 'incomplete', 'host')
+
+    def __init__(self, queue_id, dt, ip, envfrom, msg_id, recipients, incomplete=False,
+                 host=None):
+        self.queue_id = queue_id
+        self.dt = dt
+        self.ip = ip
+        self.envfrom = envfrom
+        self.msg_id = msg_id
+        self.recipients = recipients    # List of Recipient
+        self.incomplete = incomplete
+        self.host = host                # With --hosts, the host that logged it
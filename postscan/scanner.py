@@ -8,51 +8,88 @@ import re
 import socket
 
 
+# Program tag for each label's pattern, i.e. what appears before "[pid]:" (or
+# ":" for dovecot); used to index the patterns by tag
+PROGRAMS = {'connect': 'postfix/smtpd', 'client': 'postfix/smtpd',
+            'disconnect': 'postfix/smtpd', 'cleanup': 'postfix/cleanup',
+            'envfrom': 'postfix/qmgr', 'result': 'spamd', 'lda': 'dovecot',
+            'local': 'postfix/local', 'removed': 'postfix/qmgr',
+            'rejected': 'postfix/cleanup', 'pickup': 'postfix/pickup'}
+# smtpd_regex accepts anything starting with these, e.g. "postfix/submission/smtpd"
+SMTPD_PREFIXES = ('postfix/smtpd', 'postfix/submission')
+# In the list of hosts, matches any hostname
+ANY_HOST = '*'
+
+
+def decode(groups):
+    """Decodes the match groups from a binary pattern."""
+    return tuple([g if g is None else g.decode('utf-8', 'replace') for g in groups])
+
+
 class Scanner(object):
-    def __init__(self, include_local, logger):
+    def __init__(self, include_local, logger, binary=False, hosts=None):
+        """
+        In binary mode, the patterns are compiled as bytes for use with
+        find_bytes().  Only lines from the <hosts> are matched, by default
+        just this one.
+        """
+
         self.log = logger
+        self.binary = binary
+        if binary:
+            compile = lambda regex: re.compile(regex.encode('utf-8'))
+            tag = lambda prog: prog.encode('utf-8')
+        else:
+            compile = re.compile
+            tag = lambda prog: prog
 
-        hostname = socket.gethostname()
+        hosts = hosts or [socket.gethostname()]
+        if ANY_HOST in hosts:
+            host_regex = r'\S+'
+        else:
+            host_regex = '(?:%s)' % '|'.join(re.escape(host) for host in hosts)
 
         uuid_regex = r'[0-9a-fA-F]{8}(?:-[0-9a-fA-F]{4}){3}-[0-9a-fA-F]{12}'
 
         # These identify relevant log lines
         # Date & host, e.g. "Aug 10 16:14:36 cagney "
-        dh_regex =    '(\w{3} +\d+ \d{2}:\d{2}:\d{2}) %s ' % hostname
+        dh_regex =    '(\w{3} +\d+ \d{2}:\d{2}:\d{2}) %s ' % host_regex
+        # Every pattern starts with this (see journal.py)
+        self.dh_regex = dh_regex
         # E.g. "... postfix/smtpd[22878]: 1864B667736: client=unknown[192.187.99.250]"
         smtpd_regex = dh_regex + 'postfix/(?:submission|smtpd)[^[]*\[(\d+)\]: '
-        smtpd_re =    re.compile(smtpd_regex)
+        smtpd_re =    compile(smtpd_regex)
         host_ip_regex = '([\w\d\.-]+[\w\d\.-])\[(\d{1,3}\.\d{1,3}\.\d{1,3}.\d{1,3})\]'
         # https://stackoverflow.com/a/17644686/2067682
         # Modified to make the @... part optional; THANKS, APPLE.
         msg_id_regex = r'(?:(?:[a-zA-Z0-9!#$%&\'*+/=?^_`{|}~-]+(?:\.[a-zA-Z0-9!#$%&\'*+/=?^_`{|}~-]+)*)|(?:"(?:(?:[\x01-\x08\x0B\x0C\x0E-\x1F\x7F]|[\x21\x23-\x5B\x5D-\x7E])|(?:\\[\x01-\x09\x0B\x0C\x0E-\x7F]))*"))(?:@(?:(?:[a-zA-Z0-9!#$%&\'*+/=?^_`{|}~-]+(?:\.[a-zA-Z0-9!#$%&\'*+/=?^_`{|}~-]+)*)|(?:\[(?:(?:[\x01-\x08\x0B\x0C\x0E-\x1F\x7F]|[\x21-\x5A\x5E-\x7E])|(?:\\[\x01-\x09\x0B\x0C\x0E-\x7F]))*\])))?'
-        ## msg_id_re  = re.compile(msg_id_regex)
+        ## msg_id_re  = compile(msg_id_regex)
         # E.g. "... connect from o417.notify.sendle.com[167.89.105.135]"
-        connect_re =  re.compile(smtpd_regex + 'connect from ' + host_ip_regex)
+        connect_re =  compile(smtpd_regex + 'connect from ' + host_ip_regex)
         # E.g. "... disconnect from o417.notify.sendle.com[167.89.105.135]"
-        disconnect_re =  re.compile(smtpd_regex + 'disconnect from ' + host_ip_regex)
+        disconnect_re =  compile(smtpd_regex + 'disconnect from ' + host_ip_regex)
         # E.g. "... client=unknown[192.187.99.250]"
-        client_re =   re.compile(smtpd_regex + '(\w+): client=' + host_ip_regex)
+        client_re =   compile(smtpd_regex + '(\w+): client=' + host_ip_regex)
         # E.g. "... postfix/pickup[46180]: 16982667739: uid=0 from=<root>"
-        pickup_re =   re.compile(dh_regex + 'postfix/pickup\[(\d+)\]: (\w+): uid=(\d+) from=<([^>]+)>')
+        pickup_re =   compile(dh_regex + 'postfix/pickup\[(\d+)\]: (\w+): uid=(\d+) from=<([^>]+)>')
         # E.g. "... postfix/cleanup[44462]: EBA07667720: message-id=<1533884753792.b2c522e5-18f2-4b30-bd0d-1a622ab63539@notify.sendle.com>"
         #   or "Sep  3 12:16:47 cagney postfix/cleanup[30143]: 43877660443: message-id=<5B34496C16872430@smtp.telstra.com> (added by postmaster@smtp.telstra.com)
         # (The closing ">" at the end is optional, because it's missing when
         # there's a weird char at start of message-id, which isn't present in
         # this log line but is for spam result)
-        cleanup_re =  re.compile('{0}postfix/cleanup\[(\d+)\]: (\w+): message-id=<?({1})?>?'
+        cleanup_re =  compile('{0}postfix/cleanup\[(\d+)\]: (\w+): message-id=<?({1})?>?'
                                    .format(dh_regex, msg_id_regex))
         # E.g. "... postfix/qmgr[37259]: EBA07667720: "
         qmgr_regex =  dh_regex + 'postfix/qmgr\[(\d+)\]: (\w+): '
-        qmgr_re =     re.compile(qmgr_regex)
+        qmgr_re =     compile(qmgr_regex)
         # E.g. "... from=<melissa@pagetraffic.tech>, size=3900, nrcpt=1 (queue active)"
         envfrom_regex = qmgr_regex + 'from=<([-\w!#$%&\'*+/=?^_`{|}~.]+@[-\w.]+)>.* nrcpt=(\d+)'
-        envfrom_re  = re.compile(envfrom_regex)
+        envfrom_re  = compile(envfrom_regex)
         spamd_regex = dh_regex + 'spamd\[(\d+)\]: spamd: '
-        spamd_re =    re.compile(spamd_regex)
+        spamd_re =    compile(spamd_regex)
         # E.g. "... result: . 4 - BAYES_60,HTML_IMAGE_ONLY_24,HTML_MESSAGE,HTML_SHORT_LINK_IMG_3,MIME_HTML_ONLY,MIME_HTML_ONLY_MULTI,MPART_ALT_DIFF,UNPARSEABLE_RELAY scantime=1.7,size=3752,user=spamass-milter,uid=124,required_score=5.0,rhost=localhost,raddr=127.0.0.1,rport=35658,mid=<PBLLr6b5xX05qVzhu_RZ8Wi_0ry5k4PWu2@wCac.adeptus.com>,bayes=0.715496,autolearn=no"
         # or "......,mid=(unknown)..."
-        result_re =   re.compile('{0}result: . ([-\d]+) - (\S+) .*user=([^,]+).*mid=(?:<\??({1})\??>)?'
+        result_re =   compile('{0}result: . ([-\d]+) - (\S+) .*user=([^,]+).*mid=(?:<\??({1})\??>)?'
                                   .format(spamd_regex, msg_id_regex))
         # E.g. "... dovecot: lda(xyz): sieve: msgid=<f2f99cbdae05cab1de81cb0b3d519a98@RobertBanas.download>: stored mail into mailbox 'INBOX'"
         #   or "... dovecot: lda(xyz): sieve: msgid=<5B34496C16872430@smtp.telstra.com> (added by postmaster@smtp.telstra.com): stored mail into mailbox 'INBOX'
@@ -62,18 +99,18 @@ class Scanner(object):
         #   or "... dovecot: lda(xyz): sieve: msgid=unspecified: forwarded to <bob@example.com>"
         #   or "... dovecot: lda(xyz)<20453><gtTeEEIBGWTlTwAAPWRvRg>: sieve: msgid=<40DA6E9C-B3DC-476E-A279-7D843CB64848@xyz.com.au>: stored mail into mailbox 'INBOX'"
 
-        lda_re =      re.compile(r'{0}dovecot: lda\(([^)]+)\)(?:<[0-9]+><[/+a-zA-Z0-9]+>)?: sieve: '
+        lda_re =      compile(r'{0}dovecot: lda\(([^)]+)\)(?:<[0-9]+><[/+a-zA-Z0-9]+>)?: sieve: '
                                  r'msgid=(?:[? ]*(?:<({1})>|({2}))(?: \([^)]*\))?|unspecified)'
                                  r"(?:: fileinto action)?"
                                  r"(?:: stored mail into mailbox '([^']+)')?"
                                    .format(dh_regex, msg_id_regex, uuid_regex))
         # E.g. "... postfix/local[8270]: 2FECF667738: to=<user@xyz.com.au>, orig_to=<info@xyz.com.au>, relay=local, delay=3.3, delays=3.2/0/0/0.04, dsn=2.0.0, status=sent (delivered to command: /usr/lib/dovecot/dovecot-lda -f "$SENDER" -a "$ORIGINAL_RECIPIENT" -d "$USER")"
-        local_re =    re.compile(dh_regex + 'postfix/local\[(\d+)\]: (\w+): to=<([-\w\.]+@[-\w\.]+)>, (?:orig_to=<([-\w\.]+@[-\w\.]+)>)?')
+        local_re =    compile(dh_regex + 'postfix/local\[(\d+)\]: (\w+): to=<([-\w\.]+@[-\w\.]+)>, (?:orig_to=<([-\w\.]+@[-\w\.]+)>)?')
         # E.g. "... 2FECF667738: removed"
-        removed_re  = re.compile(qmgr_regex + 'removed')
+        removed_re  = compile(qmgr_regex + 'removed')
 
         # E.g. "... postfix/cleanup[4499]: CADB76676A3: milter-reject: END-OF-MESSAGE from zgz2.honeyanda.com[185.237.96.123]: 5.7.1 Blocked by SpamAssassin; from=<winona@honeyanda.com> to=<user@xyz.com.au> proto=ESMTP helo=<zgz2.honeyanda.com>"
-        rejected_re = re.compile(dh_regex + 'postfix/cleanup\[(\d+)\]: (\w+): milter-reject')
+        rejected_re = compile(dh_regex + 'postfix/cleanup\[(\d+)\]: (\w+): milter-reject')
 
         # E.g. "... postfix/bounce[2153401]: 7A27C540AF7: sender non-delivery notification: D9244547B99"
         ## bounced_re = 
@@ -82,13 +119,66 @@ class Scanner(object):
         if include_local:
             self.rd.append((pickup_re, 'pickup'))
 
+        # Picks out the syslog program tag, e.g. "postfix/qmgr" or "dovecot",
+        # so that only the patterns for that program need to be tried
+        self.prog_re = compile(dh_regex + r'([^[:\s]+)')
+        # Mapping of program tag to a list of (re_object, label) tuples, in
+        # the same order as self.rd
+        self.by_prog = {}
+        for r in self.rd:
+            self.by_prog.setdefault(tag(PROGRAMS[r[1]]), []).append(r)
+        self.smtpd_prefixes = tuple(tag(prog) for prog in SMTPD_PREFIXES)
+        self.smtpd_tag = tag('postfix/smtpd')
+        # Tags that aren't exact matches (see smtpd_regex) are looked up once
+        # by prefix and then cached here, including the misses
+        self.prog_cache = {}
+
+
+    def patterns(self, prog):
+        """
+        Return the list of (re_object, label) tuples that can match a line
+        from the program <prog>, which is empty for irrelevant programs.
+        """
+        try:
+            return self.prog_cache[prog]
+        except KeyError:
+            pass
+
+        rd = self.by_prog.get(prog)
+        if rd is None:
+            # E.g. "postfix/submission/smtpd"
+            if prog.startswith(self.smtpd_prefixes):
+                rd = self.by_prog.get(self.smtpd_tag, [])
+            else:
+                rd = []
+        self.prog_cache[prog] = rd
+        return rd
+
 
     def find(self, s, line_num):
         """
-        Iterates through a list of tuples of the form (re_object, label).
-        If one of those matches, return the label and the match group.
+        Looks up the line's program tag in the table of (re_object, label)
+        tuples and tries those in order.  If one of those matches, return
+        the label and the match group.
         """
-        for r in self.rd:
+        m = self.prog_re.match(s)
+        if not m:
+            return None
+        for r in self.patterns(m.group(2)):
             m = r[0].match(s)
             if m:
                 return r[1], m.groups()
+
+
+    def find_bytes(self, s, line_num):
+        """
+        Like find(), but in binary mode, for a line that's bytes.  Only the
+        groups of a matching line are decoded, replacing any invalid UTF-8.
+        """
+        m = self.prog_re.match(s)
+        if not m:
+            return None
+        for r in self.patterns(m.group(2)):
+            m = r[0].match(s)
+            if m:
+                return r[1], decode(m.groups())
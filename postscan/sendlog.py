@@ -0,0 +1,112 @@
+"""
+Sends a log to "postscan serve" as syslog messages at a steady rate, for
+tests and benchmarks.
+
+Each line is sent as an RFC 3164 message, e.g. "<22>Aug 10 16:14:36 host
+postfix/qmgr[37259]: ...", by UDP, unix datagram or TCP (with octet
+counting, or one message per line with --no-octet-counting).  Lines are sent
+in bursts every 10ms, as many as keep to the rate.
+
+E.g. python -m postscan.loggen -n 100000 | python -m postscan.sendlog --udp 127.0.0.1:5140 --rate 50000
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import sys
+import time
+import socket
+
+import click
+
+from .server import parse_address
+
+
+# Seconds between bursts, and the lines per burst without a rate
+TICK = 0.01
+BURST_SIZE = 1000
+# Priority of each message: mail.info
+PRI = b'<22>'
+
+
+def connect(udp=None, tcp=None, unix=None):
+    """Returns a socket connected to one of the addresses."""
+    if unix:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock.connect(unix)
+        return sock
+    host, port = parse_address(udp or tcp)
+    if tcp:
+        return socket.create_connection((host, port))
+    sock = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET, socket.SOCK_DGRAM)
+    sock.connect((host, port))
+    return sock
+
+
+def frame(line, octet_counting):
+    """Returns the line (as bytes) as a framed message for TCP."""
+    message = PRI + line.rstrip(b'\n')
+    if octet_counting:
+        return b"%d %s" % (len(message), message)
+    return message + b'\n'
+
+
+def send(lines, sock, stream=False, rate=None, octet_counting=True):
+    """
+    Sends each line (as bytes) to the connected socket <sock>, at up to
+    <rate> lines per second.  Returns the number of lines sent.
+    """
+
+    per_tick = max(int(rate * TICK), 1) if rate else BURST_SIZE
+    start = time.time()
+    count = 0
+    burst = []
+    for line in lines:
+        burst.append(line)
+        if len(burst) < per_tick:
+            continue
+        count += send_burst(burst, sock, stream, octet_counting)
+        burst = []
+        if rate:
+            delay = start + count / float(rate) - time.time()
+            if delay > 0:
+                time.sleep(delay)
+    if burst:
+        count += send_burst(burst, sock, stream, octet_counting)
+    return count
+
+
+def send_burst(lines, sock, stream, octet_counting):
+    if stream:
+        sock.sendall(b"".join(frame(line, octet_counting) for line in lines))
+    else:
+        for line in lines:
+            sock.send(PRI + line.rstrip(b'\n'))
+    return len(lines)
+
+
+@click.command()
+@click.option('--udp', type=click.STRING, help="Sends to <host:port> by UDP")
+@click.option('--tcp', type=click.STRING, help="Sends to <host:port> by TCP")
+@click.option('--unix', type=click.Path(dir_okay=False), help="Sends to the unix datagram socket <path>")
+@click.option('-r', '--rate', type=click.IntRange(1), help="Lines per second (default: as fast as possible)")
+@click.option('--octet-counting/--no-octet-counting', default=True,
+              help="Frames TCP messages with their length rather than a newline")
+@click.argument('log', type=click.File('rb'), default='-')
+def main(udp, tcp, unix, rate, octet_counting, log):
+    """Sends the lines of a log to "postscan serve"."""
+    if sum(1 for address in (udp, tcp, unix) if address) != 1:
+        raise click.UsageError("Give one of --udp, --tcp or --unix")
+    sock = connect(udp, tcp, unix)
+    start = time.time()
+    try:
+        count = send(log, sock, bool(tcp), rate, octet_counting)
+    finally:
+        sock.close()
+    elapsed = time.time() - start
+    print("Sent %d lines in %.2fs (%.0f lines/s)" % (count, elapsed, count / elapsed if elapsed else 0),
+          file=sys.stderr)
+
+
+if __name__ == "__main__":
+    sys.exit(main())  # pragma: no cover
@@ -0,0 +1,372 @@
+"""
+Receives syslog messages over the network, for "postscan serve", so that
+e.g. rsyslog can forward mail logs straight to postscan.
+
+Messages arrive as UDP or unix datagrams, one per datagram, or over TCP
+framed as in RFC 6587: either "<length> <message>" (octet counting) or one
+per line.  Each is parsed as RFC 3164 ("<PRI>Aug 10 16:14:36 host tag:
+...") or RFC 5424 ("<PRI>1 2023-03-27T14:00:05+11:00 host app procid
+msgid [sd] ...") and rewritten as the line that would have been logged to
+a file, so that it can be matched as usual; local messages without a
+hostname (e.g. from syslog(3)) get this host's name.
+
+Everything runs in one asyncio event loop.  Datagram sockets are drained
+several messages at a time when they become readable, and messages are
+queued and then handled in batches between reads, so that neither starves
+the other.  When the queue is full, TCP connections stop being read until
+it has gone down (back-pressure), while datagrams are dropped and counted,
+as their senders can't be slowed down.
+"""
+
+from __future__ import absolute_import
+
+import os
+import re
+import stat
+import time
+import errno
+import signal
+import socket
+import asyncio
+import collections
+
+from .timestamps import MONTHS
+
+
+# Number of messages handled at once before checking for more input
+BATCH_SIZE = 1000
+# Number of queued messages at which TCP connections are paused (until it
+# has halved) and datagrams dropped
+MAX_PENDING = 100000
+# Most datagrams read from a socket at once
+READ_COUNT = 256
+MAX_DATAGRAM = 65536
+# Longest message accepted over TCP, as for a datagram; a connection that
+# sends a longer one is closed rather than buffering it without limit
+MAX_MESSAGE = MAX_DATAGRAM
+# Receive buffer asked for on datagram sockets, to ride out bursts
+RCVBUF_SIZE = 4 * 1024 * 1024
+
+MONTH_NAMES = sorted(MONTHS, key=MONTHS.get)
+
+PRI_RE = re.compile(br'<\d{1,3}>')
+# E.g. "<22>Aug 10 16:14:36 cagney postfix/qmgr[37259]: ...", where the host
+# is often missing from local messages (a tag has a ":" or "[" in it)
+RFC3164_RE = re.compile(br'<\d{1,3}>(\w{3} +\d{1,2} \d{2}:\d{2}:\d{2}) ([^\s:\[\]]+ )?')
+# E.g. "<22>1 2023-03-27T14:00:05.003+11:00 cagney postfix/qmgr 37259 - - ..."
+RFC5424_RE = re.compile(br'<\d{1,3}>1 (?:(\d{4})-(\d\d)-(\d\d)T(\d\d):(\d\d):(\d\d)\S*|-) '
+                        br'(\S+) (\S+) (\S+) \S+ (?:-|(?:\[(?:"(?:[^"\\]|\\.)*"|[^\]"])*\])+) ?')
+BOM = b'\xef\xbb\xbf'
+
+
+def syslog_time(t=None):
+    """Returns e.g. b"Aug 10 16:14:36" for the struct_time <t>, or for now."""
+    t = t or time.localtime()
+    return ("%s %2d %02d:%02d:%02d" % (MONTH_NAMES[t.tm_mon - 1], t.tm_mday, t.tm_hour,
+                                       t.tm_min, t.tm_sec)).encode('ascii')
+
+
+def parse_message(data, default_host):
+    """
+    Returns the log line (as bytes, with a newline) for the syslog message
+    <data>, or None if it doesn't have a priority.
+    """
+
+    data = data.rstrip(b'\r\n\0')
+    m = RFC3164_RE.match(data)
+    if m:
+        if m.group(2):
+            # Already as logged to a file
+            return data[m.start(1):] + b'\n'
+        return b"%s %s %s\n" % (m.group(1), default_host, data[m.end():])
+
+    m = RFC5424_RE.match(data)
+    if m:
+        fields = m.groups()
+        if fields[0]:
+            dt = b"%s %2d %s:%s:%s" % (MONTH_NAMES[int(fields[1]) - 1].encode('ascii'),
+                                       int(fields[2]), fields[3], fields[4], fields[5])
+        else:
+            dt = syslog_time()
+        host, app, procid = fields[6:9]
+        if host == b'-':
+            host = default_host
+        tag = app if procid == b'-' else b"%s[%s]" % (app, procid)
+        msg = data[m.end():]
+        if msg.startswith(BOM):
+            msg = msg[len(BOM):]
+        return b"%s %s %s: %s\n" % (dt, host, tag, msg)
+
+    m = PRI_RE.match(data)
+    if m:
+        # Without a timestamp
+        return b"%s %s %s\n" % (syslog_time(), default_host, data[m.end():])
+    return None
+
+
+class StreamProtocol(asyncio.Protocol):
+    """A TCP connection, with messages framed as in RFC 6587."""
+
+    def __init__(self, server):
+        self.server = server
+        # Appended to in place, rather than copied for each read
+        self.buffer = bytearray()
+        self.count = 0
+
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.server.streams.add(transport)
+        if self.server.paused:
+            transport.pause_reading()
+
+
+    def data_received(self, data):
+        buffer = self.buffer
+        buffer += data
+        pos = 0
+        while pos < len(buffer):
+            end = None
+            if buffer[pos:pos + 1].isdigit():
+                # Octet counting, e.g. b"34 <22>Aug 10 ..."
+                space = buffer.find(b' ', pos)
+                if space < 0:
+                    if len(buffer) - pos > len(str(MAX_MESSAGE)):
+                        return self.abort("bad message length")
+                    break
+                length = buffer[pos:space]
+                if length.isdigit():
+                    if int(length) > MAX_MESSAGE:
+                        return self.abort("message length %d over %d" % (int(length), MAX_MESSAGE))
+                    end = space + 1 + int(length)
+                    if end > len(buffer):
+                        break
+                    message = bytes(buffer[space + 1:end])
+            if end is None:
+                # Non-transparent framing, with a newline after each message
+                end = buffer.find(b'\n', pos)
+                if end < 0:
+                    if len(buffer) - pos > MAX_MESSAGE:
+                        return self.abort("message over %d bytes without a newline" % MAX_MESSAGE)
+                    break
+                end += 1
+                message = bytes(buffer[pos:end])
+            pos = end
+            if message.strip():
+                self.server.receive(message, stream=True)
+                self.count += 1
+        del buffer[:pos]
+
+
+    def abort(self, reason):
+        self.server.log.warning("Closing connection from %s: %s",
+                                self.transport.get_extra_info('peername'), reason)
+        self.transport.close()
+
+
+    def connection_lost(self, exc):
+        self.server.streams.discard(self.transport)
+        self.server.log.debug("Connection from %s closed after %d messages",
+                              self.transport.get_extra_info('peername'), self.count)
+
+
+class Server(object):
+    """
+    Hands the messages received on the sockets to <controller> (see
+    postscan.Controller) as log lines.
+    """
+
+    def __init__(self, controller, logger, default_host=None, max_pending=None):
+        self.controller = controller
+        self.log = logger
+        self.default_host = (default_host or socket.gethostname()).encode('utf-8')
+        self.max_pending = max_pending or MAX_PENDING
+        self.resume_pending = self.max_pending // 2
+        self.loop = asyncio.new_event_loop()
+        self.pending = collections.deque()
+        self.scheduled = False
+        self.streams = set()
+        self.paused = False
+        self.datagram_sockets = []
+        self.servers = []
+        self.unix_paths = []
+        self.line_num = 0
+        # Counters, reported at the end
+        self.received = 0
+        self.dropped = 0
+        self.malformed = 0
+
+
+    def listen_udp(self, host, port):
+        sock = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET,
+                             socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((host, port))
+        self.add_datagram_socket(sock)
+
+
+    def listen_unix(self, path):
+        # Replaces a socket left behind by an earlier run, but nothing else
+        try:
+            if stat.S_ISSOCK(os.stat(path).st_mode):
+                os.unlink(path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock.bind(path)
+        self.unix_paths.append(path)
+        self.add_datagram_socket(sock)
+
+
+    def listen_tcp(self, host, port):
+        server = self.loop.run_until_complete(self.loop.create_server(
+            lambda: StreamProtocol(self), host, port, reuse_address=True))
+        self.servers.append(server)
+
+
+    def add_datagram_socket(self, sock):
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RCVBUF_SIZE)
+        except OSError:
+            pass
+        sock.setblocking(False)
+        self.datagram_sockets.append(sock)
+        self.loop.add_reader(sock.fileno(), self.read_datagrams, sock)
+
+
+    def read_datagrams(self, sock, count=READ_COUNT):
+        """Reads up to <count> datagrams that are waiting on <sock>."""
+        recv = sock.recv
+        for i in range(count):
+            try:
+                data = recv(MAX_DATAGRAM)
+            except (BlockingIOError, InterruptedError):
+                return False
+            self.receive(data)
+        return True
+
+
+    def receive(self, message, stream=False):
+        """Queues the <message> (as bytes) for handling."""
+        if len(self.pending) >= self.max_pending:
+            if not stream:
+                self.dropped += 1
+                return
+            self.pause()
+        self.pending.append(message)
+        self.received += 1
+        if not self.scheduled:
+            self.scheduled = True
+            self.loop.call_soon(self.handle_batch)
+
+
+    def pause(self):
+        if not self.paused:
+            self.log.debug("Pausing %d connections with %d messages queued",
+                           len(self.streams), len(self.pending))
+            self.paused = True
+            for transport in self.streams:
+                transport.pause_reading()
+
+
+    def resume(self):
+        if self.paused:
+            self.log.debug("Resuming %d connections", len(self.streams))
+            self.paused = False
+            for transport in self.streams:
+                transport.resume_reading()
+
+
+    def handle_batch(self):
+        """
+        Handles up to BATCH_SIZE queued messages, and then lets the loop read
+        more input before the next batch.  Output is flushed whenever the
+        queue is empty.
+        """
+
+        self.scheduled = False
+        pending = self.pending
+        parse = self.controller.parse_line_bytes
+        for i in range(min(len(pending), BATCH_SIZE)):
+            line = parse_message(pending.popleft(), self.default_host)
+            if line is None:
+                self.malformed += 1
+                continue
+            self.line_num += 1
+            parse(line, self.line_num)
+
+        if len(pending) <= self.resume_pending:
+            self.resume()
+        if pending:
+            self.scheduled = True
+            self.loop.call_soon(self.handle_batch)
+        else:
+            self.controller.writer.flush()
+
+
+    def report(self):
+        kernel = [kernel_drops(sock) for sock in self.datagram_sockets]
+        kernel = sum(count for count in kernel if count is not None)
+        self.log.info("Received %d messages, dropped %d (and %d by the kernel), %d malformed",
+                      self.received, self.dropped, kernel, self.malformed)
+
+
+    def run(self):
+        """
+        Runs until SIGINT or SIGTERM, then handles whatever datagrams are
+        still waiting and what's queued, and finishes the messages in progress.
+        """
+
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            self.loop.add_signal_handler(signum, self.loop.stop)
+        if hasattr(signal, 'SIGUSR1'):
+            self.loop.add_signal_handler(signal.SIGUSR1, self.report)
+        try:
+            self.loop.run_forever()
+        finally:
+            for server in self.servers:
+                server.close()
+            for sock in self.datagram_sockets:
+                self.loop.remove_reader(sock.fileno())
+                while True:
+                    more = self.read_datagrams(sock)
+                    while self.pending:
+                        self.handle_batch()
+                    if not more:
+                        break
+            while self.pending:
+                self.handle_batch()
+            self.report()
+            for sock in self.datagram_sockets:
+                sock.close()
+            for path in self.unix_paths:
+                os.unlink(path)
+            self.controller.cleanup()
+            self.loop.close()
+
+
+def kernel_drops(sock):
+    """
+    Returns the number of datagrams that the kernel has dropped for want of
+    buffer space on the UDP socket <sock>, or None if that isn't known.
+    """
+
+    inode = str(os.fstat(sock.fileno()).st_ino)
+    for path in ('/proc/net/udp', '/proc/net/udp6'):
+        try:
+            with open(path) as f:
+                for line in f:
+                    # ... inode ref pointer drops
+                    fields = line.split()
+                    if len(fields) > 12 and fields[9] == inode:
+                        return int(fields[12])
+        except (IOError, OSError):
+            pass
+    return None
+
+
+def parse_address(address):
+    """Returns the host and port for e.g. "0.0.0.0:514", "[::1]:514" or "514" (on localhost)."""
+    host, colon, port = address.rpartition(':')
+    return (host.strip('[]') if colon else '127.0.0.1'), int(port)
@@ -1,25 +1,87 @@
 from __future__ import absolute_import
 
+import sys
+import collections
+
 from .uuid_helper import UUIDs
+from .records import Message, Delivery, Recipient, Completed
+from .timestamps import SyslogClock
+from .output import TextWriter
 
 
 class StateMachine(object):
-    messages = {}
-    deliveries_by_id = {}     # Mapping of message-id to { <username>: {<delivery-data>}}
-    uuid_queue = UUIDs()
-    uuid_owners = {}          # Mapping of fake msg_id string to username string
-
-
-    def __init__(self, target_rcpt, discard_threshold, ip_re, logger):
+    def __init__(self, target_rcpt, discard_threshold, ip_re, logger,
+                 max_age=None, emit_incomplete=False, emit=None, host=None):
+        """
+        Each message that is finished and passes the filters is passed to
+        <emit> as a Completed record, which by default is printed as text.
+        Queue IDs are only unique per host, so with several hosts (see
+        hosts.py) each has a StateMachine of its own, named by <host>.
+        """
+
+        self.messages = {}            # Mapping of queue ID to Message
+        self.deliveries_by_id = {}    # Mapping of message-id to { <username>: Delivery }
+        self.uuid_queue = UUIDs()     # Fake msg_id strings, and the usernames that claimed them
+        self.host = host
         self.target_rcpt = target_rcpt
         self.discard_threshold = discard_threshold
         self.ip_re = ip_re
         self.log = logger
+        self.emit = emit or TextWriter(sys.stdout, 0).write
+
+        # Messages older than max_age seconds (by log time) are evicted, and
+        # printed as incomplete if emit_incomplete is set
+        self.max_age = max_age
+        self.emit_incomplete = emit_incomplete
+        self.evicted = 0
+        self.handlers = {}
+        self.clock = SyslogClock()
+        self.timeline = collections.deque()   # (seconds, queue_id) in order of arrival
+        if max_age is not None:
+            self.dispatch = self.dispatch_evicting
 
 
     def dispatch(self, label, match_groups, line_num):
-        method_name = 'handle_{0}'.format(label)
-        return getattr(self, method_name)(match_groups, line_num)
+        try:
+            handler = self.handlers[label]
+        except KeyError:
+            handler = self.handlers[label] = getattr(self, 'handle_' + label)
+        return handler(match_groups, line_num)
+
+
+    def dispatch_evicting(self, label, match_groups, line_num):
+        """Replaces dispatch() when evicting old messages."""
+        # Every label's first group is the date
+        now = self.clock.seconds(match_groups[0])
+        if now is not None and self.timeline and self.timeline[0][0] < now - self.max_age:
+            self.evict(now - self.max_age)
+        return StateMachine.dispatch(self, label, match_groups, line_num)
+
+
+    def add_message(self, queue_id, dt, ip):
+        seconds = None
+        if self.max_age is not None:
+            seconds = self.clock.seconds(dt)
+            if seconds is not None:
+                self.timeline.append((seconds, queue_id))
+        self.messages[queue_id] = Message(dt, ip, seconds)
+
+
+    def evict(self, cutoff):
+        """
+        Finishes messages that arrived before <cutoff> (in seconds) but
+        haven't been removed.  The cost is proportional to the number
+        evicted, plus any that were removed in the meantime.
+        """
+
+        while self.timeline and self.timeline[0][0] < cutoff:
+            seconds, queue_id = self.timeline.popleft()
+            # The queue ID could have been removed, or even reused
+            if queue_id in self.messages and \
+               self.messages[queue_id].seconds == seconds:
+                self.log.debug("evicting %s", queue_id)
+                self.evicted += 1
+                self.finish(queue_id, incomplete=True)
 
 
     def handle_connect(self, match_groups, line_num):
@@ -31,16 +93,13 @@ class StateMachine(object):
         dt, smtpd_pid, queue_id, host, ip = match_groups
         self.log.debug(queue_id)
         if self.ip_re is None or not self.ip_re.match(ip):
-            self.messages[queue_id] = {'dt': dt, 'ip': ip, 'msg_id_faked': False,
-                                       'duplicate_msg_id': False, 'blessed': False}
+            self.add_message(queue_id, dt, ip)
 
 
     def handle_pickup(self, match_groups, line_num):
         dt, pickup_pid, queue_id, uid, username = match_groups
         self.log.debug(queue_id)
-        self.messages[queue_id] = {'dt': dt, 'ip': "%s(%s)" % (username, uid),
-                                   'msg_id_faked': False,
-                                   'duplicate_msg_id': False, 'blessed': False}
+        self.add_message(queue_id, dt, "%s(%s)" % (username, uid))
 
 
     def handle_disconnect(self, match_groups, line_num):
@@ -59,26 +118,24 @@ class StateMachine(object):
                 # front of the queue, i.e. last in, first out order; this is done
                 # even if ignoring this message, to keep pushes and pops balanced.
                 msg_id = self.uuid_queue.create()
-                self.messages[queue_id]['msg_id_faked'] = True
+                self.messages[queue_id].msg_id_faked = True
                 self.log.debug("cleanup pushing id: %s", msg_id)
 
-            self.messages[queue_id]['to'] = []
-            self.messages[queue_id]['msg_id'] = msg_id
+            self.messages[queue_id].to = []
+            self.messages[queue_id].msg_id = msg_id
             if msg_id in self.deliveries_by_id:
                 # It's a duplicate
-                ## self.messages[queue_id]['msg_id_count'] += 1
                 pass
             else:
                 # Normal case
                 self.deliveries_by_id[msg_id] = {}
-            ## self.messages[queue_id]['deliveries'] = {}
 
 
     def handle_envfrom(self, match_groups, line_num):
         dt, qmgr_pid, queue_id, envfrom, num_rcpt = match_groups
         if queue_id in self.messages:
             self.log.debug(envfrom)
-            self.messages[queue_id]['envfrom'] = envfrom
+            self.messages[queue_id].envfrom = envfrom
 
 
     def handle_result(self, match_groups, line_num):
@@ -97,14 +154,10 @@ class StateMachine(object):
                 msg_id = self.uuid_queue.peek()
                 if user != 'spamass-milter':
                     # Check for the case where this is a "new" UUID
-                    if msg_id not in self.uuid_owners or \
-                       self.uuid_owners[msg_id] != user:
-                        # Cycle through UUIDs to find the first un-owned one and claim it
-                        queue_index = 0
-                        while msg_id in self.uuid_owners:
-                            queue_index += 1
-                            msg_id = self.uuid_queue.peek(queue_index)
-                        self.uuid_owners[msg_id] = user
+                    if self.uuid_queue.owners.get(msg_id) != user:
+                        # Find the first un-owned one and claim it
+                        msg_id = self.uuid_queue.first_unowned()
+                        self.uuid_queue.claim(msg_id, user)
 
                 uuid_del = True
 
@@ -137,8 +190,10 @@ class StateMachine(object):
             ## queue_id = self.deliveries_by_id[msg_id]
             # Record the delivery, with a spam score if available
             if user in self.deliveries_by_id[msg_id]:
-                self.deliveries_by_id[msg_id][user]['mailbox'] = mailbox
-                self.deliveries_by_id[msg_id][user]['count'] += 1
+                delivery = self.deliveries_by_id[msg_id][user]
+                delivery.mailbox = mailbox
+                delivery.mailbox_seen = True
+                delivery.count += 1
             else:
                 self.record_delivery(msg_id, user, None, mailbox)
         else:
@@ -146,11 +201,7 @@ class StateMachine(object):
 
 
     def record_delivery(self, msg_id, user, int_score=None, mailbox=None):
-        self.deliveries_by_id[msg_id][user] = { 'int_score': int_score,
-                                                'user': user,
-                                                'count': 1 }
-        if mailbox:
-            self.deliveries_by_id[msg_id][user]['mailbox'] = mailbox
+        self.deliveries_by_id[msg_id][user] = Delivery(user, int_score, mailbox or None)
 
 
     def handle_local(self, match_groups, line_num):
@@ -159,84 +210,125 @@ class StateMachine(object):
             ## if envto:
             ## print(line_num, file=sys.stderr)
             parts = rcpt.lower().split("@")
-            self.messages[queue_id]['to'].append((rcpt, envto, parts[0]))
-            self.messages[queue_id]['blessed'] = self.target_rcpt in (None, rcpt, envto)
+            self.messages[queue_id].to.append((rcpt, envto, parts[0]))
+            self.messages[queue_id].blessed = self.target_rcpt in (None, rcpt, envto)
 
 
     def handle_removed(self, match_groups, line_num):
         dt, qmgr_pid, queue_id = match_groups
-        self.log.debug(queue_id + " deleted")
+        self.log.debug("%s deleted", queue_id)
         if queue_id in self.messages:
-            msg_id = self.messages[queue_id]['msg_id']
-            if 'envfrom' not in self.messages[queue_id]:
-                # Bounce message
-                self.messages[queue_id]['envfrom'] = "<mail daemon>"
-            default_score = None
-            max_int_score = -1000
-            if msg_id in self.deliveries_by_id:
-                # Find the highest spame score across all users this message was delivered to
-                for username in self.deliveries_by_id[msg_id]:
-                    delivery = self.deliveries_by_id[msg_id][username]
-                    if delivery['int_score'] is not None and \
-                       max_int_score < delivery['int_score']:
-                        max_int_score = delivery['int_score']
-                    if 'mailbox' not in delivery:
-                        default_score = delivery['int_score']
-
-            if (self.discard_threshold is None or \
-                max_int_score < self.discard_threshold) and \
-               self.messages[queue_id]['blessed']:
-                self.print_info(queue_id, default_score)
-            else:
-                self.log.debug("X %s", queue_id)
-            if msg_id in self.deliveries_by_id:
-                del self.deliveries_by_id[msg_id]
-
-            if self.messages[queue_id]['msg_id_faked']:
-                fake_msg_id = self.uuid_queue.pop(msg_id)
-                self.log.debug("handle_removed() got id %s from queue", fake_msg_id)
-                assert fake_msg_id == msg_id
-                self.log.debug("handle_removed() popping id; %d left", len(self.uuid_queue.uuids))
-                self.log.debug("uuid_owners: %s", self.uuid_owners)
-                if msg_id in self.uuid_owners:
-                    # This is only present when the username is not "spamass-milter"
-                    del self.uuid_owners[msg_id]
-            del self.messages[queue_id]
-
-
-    def print_info(self, queue_id, default_score):
-        msg_id = self.messages[queue_id]['msg_id']
+            self.finish(queue_id)
+
+
+    def finish(self, queue_id, incomplete=False):
+        """
+        Prints the message if it passes the filters and forgets about it.
+        Messages that are <incomplete> (never removed) are only printed if
+        emit_incomplete is set, and may be missing some details.
+        """
+
+        m = self.messages[queue_id]
+        if incomplete:
+            if m.msg_id is None:
+                m.msg_id = "?"
+            if m.to is None:
+                m.to = []
+        msg_id = m.msg_id
+        if m.envfrom is None:
+            # Bounce message (or, if incomplete, not known yet)
+            m.envfrom = "<unknown>" if incomplete else "<mail daemon>"
+        default_score = None
+        max_int_score = -1000
+        if msg_id in self.deliveries_by_id:
+            # Find the highest spame score across all users this message was delivered to
+            for username in self.deliveries_by_id[msg_id]:
+                delivery = self.deliveries_by_id[msg_id][username]
+                if delivery.int_score is not None and \
+                   max_int_score < delivery.int_score:
+                    max_int_score = delivery.int_score
+                if not delivery.mailbox_seen:
+                    default_score = delivery.int_score
+
+        if incomplete:
+            # Undelivered messages haven't been checked against --to
+            wanted = self.emit_incomplete and \
+                     (m.blessed or self.target_rcpt is None)
+        else:
+            wanted = m.blessed
+        if (self.discard_threshold is None or \
+            max_int_score < self.discard_threshold) and wanted:
+            self.emit(self.record(queue_id, default_score, incomplete))
+        else:
+            self.log.debug("X %s", queue_id)
+        if msg_id in self.deliveries_by_id:
+            del self.deliveries_by_id[msg_id]
+
+        if m.msg_id_faked:
+            fake_msg_id = self.uuid_queue.pop(msg_id)
+            self.log.debug("handle_removed() got id %s from queue", fake_msg_id)
+            assert fake_msg_id == msg_id
+            self.log.debug("handle_removed() popping id; %d left", len(self.uuid_queue))
+        del self.messages[queue_id]
+
+
+    def record(self, queue_id, default_score, incomplete=False):
+        """Returns the message as a Completed record for the output."""
         m = self.messages[queue_id]
-        print(queue_id + ": ({dt}) {envfrom} [{ip}]\n  ({msg_id})".format(**m))
+        deliveries = self.deliveries_by_id.get(m.msg_id, {})
+        recipients = []
         # Note: each delivery is not currently tied to a recipient
-        for rcpt, envto, username in m['to']:
-            if envto:
-                print("  {0} = {1}".format(rcpt, envto))
+        for rcpt, envto, username in m.to:
+            delivery = deliveries.get(username)
+            if delivery is None:
+                recipients.append(Recipient(rcpt, envto, None, None, None))
             else:
-                print("  {0}".format(rcpt))
-            if msg_id in self.deliveries_by_id and username in self.deliveries_by_id[msg_id]:
-                delivery = self.deliveries_by_id[msg_id][username]
-                if delivery['int_score'] is None:
-                    delivery['int_score'] = default_score
-                fields = {'mailbox': "(none)"}
-                fields.update(delivery)
-                print("  ...{user}: saved to '{mailbox}', spam level {int_score}".format(**fields))
-        print("")
+                if delivery.int_score is None:
+                    delivery.int_score = default_score
+                recipients.append(Recipient(rcpt, envto, delivery.user, delivery.mailbox,
+                                            delivery.int_score))
+        return Completed(queue_id, m.dt, m.ip, m.envfrom, m.msg_id, recipients, incomplete,
+                         self.host)
 
 
     def handle_rejected(self, match_groups, line_num):
         dt, cleanup_pid, queue_id = match_groups
 
         if queue_id in self.messages:
-            msg_id = self.messages[queue_id]['msg_id']
-            if self.messages[queue_id]['msg_id_faked']:
-                self.uuid_queue.pop(msg_id)
+            m = self.messages[queue_id]
+            if m.msg_id_faked:
+                self.uuid_queue.pop(m.msg_id)
+                # Don't pop it again if the message is finished later
+                m.msg_id_faked = False
 
     # TODO
     def handle_bounce(self, match_groups, line_num):
         pass
 
 
+    def get_state(self):
+        """Returns the state of in-flight messages, for saving."""
+        return {'messages': self.messages,
+                'deliveries_by_id': self.deliveries_by_id,
+                'uuids': list(self.uuid_queue),
+                'uuid_owners': self.uuid_queue.owners,
+                'timeline': self.timeline,
+                # For placing later lines in the same year as the timeline
+                'clock': (self.clock.year, self.clock.month)}
+
+
+    def set_state(self, state):
+        """Restores state saved from get_state() in an earlier run."""
+        self.messages = state['messages']
+        self.deliveries_by_id = state['deliveries_by_id']
+        self.uuid_queue = UUIDs(state['uuids'], state['uuid_owners'])
+        self.timeline = state.get('timeline', collections.deque())
+        self.clock.year, self.clock.month = state['clock']
+
+
     def cleanup(self):
         self.log.debug("zombie messages: %d; zombie message IDs: %d",
                        len(self.messages), len(self.deliveries_by_id))
+        if self.evicted:
+            self.log.info("evicted %d messages older than %d seconds",
+                          self.evicted, self.max_age)
@@ -0,0 +1,122 @@
+"""
+Profiling statistics for --stats.
+
+Stats instruments an existing Scanner and StateMachine by wrapping their
+regexes and handlers in timing proxies, rather than by adding checks to
+the normal code path; when --stats isn't used, nothing is wrapped and
+nothing is measured.
+
+Regex times are only collected for lines scanned in this process, i.e. not
+by the worker processes used with --jobs; the lines they read are counted
+in the total, and the report says how many there were.
+"""
+
+from __future__ import absolute_import
+
+import time
+import collections
+
+
+class Timer(object):
+    """Counts the calls to a function, and the time spent in it."""
+
+    __slots__ = ('func', 'clock', 'calls', 'hits', 'seconds')
+
+    def __init__(self, func, clock):
+        self.func = func
+        self.clock = clock
+        self.calls = 0
+        self.hits = 0
+        self.seconds = 0.0
+
+
+    def __call__(self, *args):
+        start = self.clock()
+        result = self.func(*args)
+        self.seconds += self.clock() - start
+        self.calls += 1
+        if result:
+            self.hits += 1
+        return result
+
+
+class TimedPattern(object):
+    """Stands in for a compiled regex, timing each match() attempt."""
+
+    def __init__(self, pattern, clock):
+        self.pattern = pattern
+        self.match = Timer(pattern.match, clock)
+
+
+class Stats(object):
+    def __init__(self, scanner, state, clock=time.perf_counter):
+        self.scanner = scanner
+        self.state = state
+        self.clock = clock
+        self.start = clock()
+        # Lines scanned by --jobs worker processes, which the timers don't see
+        self.worker_lines = 0
+        self.peaks = collections.OrderedDict([('messages', 0), ('deliveries_by_id', 0),
+                                              ('uuid queue', 0), ('uuid owners', 0)])
+
+        # Replace each pattern in the scanner's index with a timed one
+        self.prog_pattern = scanner.prog_re = TimedPattern(scanner.prog_re, clock)
+        self.patterns = collections.OrderedDict()
+        for pattern, label in scanner.rd:
+            self.patterns[label] = TimedPattern(pattern, clock)
+        scanner.rd = [(self.patterns[label], label) for pattern, label in scanner.rd]
+        for rd in scanner.by_prog.values():
+            # In place, as the lists are shared with the prefix cache
+            rd[:] = [(self.patterns[label], label) for pattern, label in rd]
+
+        # Pre-fill StateMachine.dispatch()'s cache of handlers with timed ones
+        self.handlers = collections.OrderedDict()
+        for pattern, label in scanner.rd:
+            self.handlers[label] = Timer(self.tracking(getattr(state, 'handle_' + label)), clock)
+        state.handlers.update(self.handlers)
+
+
+    def count_lines(self, count):
+        """Adds <count> lines scanned by a worker process to the total."""
+        self.worker_lines += count
+
+
+    def tracking(self, handler):
+        """Wraps a handler to update the peak sizes after each call."""
+        peaks = self.peaks
+        state = self.state
+
+        def track(match_groups, line_num):
+            handler(match_groups, line_num)
+            for name, size in (('messages', len(state.messages)),
+                               ('deliveries_by_id', len(state.deliveries_by_id)),
+                               ('uuid queue', len(state.uuid_queue)),
+                               ('uuid owners', len(state.uuid_queue.owners))):
+                if size > peaks[name]:
+                    peaks[name] = size
+        return track
+
+
+    def report(self, out):
+        """Writes a report of the statistics so far to the file <out>."""
+
+        elapsed = self.clock() - self.start
+        lines = self.prog_pattern.match.calls
+        total = lines + self.worker_lines
+        out.write("postscan stats after %.1fs: %d lines read (%.0f lines/s)\n" %
+                  (elapsed, total, total / elapsed if elapsed else 0))
+        if self.worker_lines:
+            out.write("  %d lines were matched by worker processes and are not in the regex counts\n" %
+                      self.worker_lines)
+        out.write("  %-12s %10s %10s %10s %10s %10s\n" %
+                  ("label", "matched", "tries", "regex s", "handled", "handler s"))
+        out.write("  %-12s %10d %10d %10.3f\n" %
+                  ("(program)", self.prog_pattern.match.hits, lines, self.prog_pattern.match.seconds))
+        for label, pattern in self.patterns.items():
+            handler = self.handlers[label]
+            out.write("  %-12s %10d %10d %10.3f %10d %10.3f\n" %
+                      (label, pattern.match.hits, pattern.match.calls, pattern.match.seconds,
+                       handler.calls, handler.seconds))
+        out.write("  peak sizes: %s\n" %
+                  ", ".join("%s %d" % item for item in self.peaks.items()))
+        out.flush()
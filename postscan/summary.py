@@ -0,0 +1,251 @@
+"""
+Daily-style rollups of the completed messages, for --summary, instead of
+printing each one.
+
+Everything is counted in a fixed amount of memory, however much log goes
+in, as set by <keys> (--summary-keys):
+
+- envelope senders and client IPs, of which there can be millions, are
+  ranked with the Space-Saving algorithm: only <keys> counters are kept,
+  and a new key takes over the smallest one, inheriting its count as the
+  possible overcount (error), so any key with a true count above the
+  smallest is certain to be there
+- their numbers of distinct values, and of recipients, are estimated with
+  HyperLogLog sketches of 4096 one-byte registers (about 1.6% error)
+- Sieve mailboxes (per user) and the spam level histogram for each user
+  have small key spaces, so they are counted exactly, up to <keys> keys,
+  after which any new keys are lumped together as "(other)"
+"""
+
+from __future__ import absolute_import
+
+import json
+import math
+import heapq
+import hashlib
+import collections
+
+
+# Shown with --summary unless --summary-top says otherwise
+TOP = 10
+# Counters kept per rollup unless --summary-keys says otherwise
+KEYS = 1000
+# Lumps together the keys that don't fit in a BoundedCounter
+OTHER = "(other)"
+# Bits of the hash used to choose a HyperLogLog register
+HLL_BITS = 12
+
+
+class SpaceSaving(object):
+    """Approximate top-K counts of a stream of keys, with <capacity> counters."""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        # (count, key), with stale entries for keys whose counts have
+        # since gone up (or that have been replaced), checked when popped
+        self.heap = []
+
+
+    def add(self, key):
+        counts = self.counts
+        if key in counts:
+            counts[key] += 1
+            return
+        if len(counts) < self.capacity:
+            counts[key] = 1
+            self.errors[key] = 0
+            heapq.heappush(self.heap, (1, key))
+            return
+
+        heap = self.heap
+        while True:
+            count, smallest = heapq.heappop(heap)
+            current = counts.get(smallest)
+            if current == count:
+                break
+            if current is not None:
+                heapq.heappush(heap, (current, smallest))
+        del counts[smallest]
+        del self.errors[smallest]
+        counts[key] = count + 1
+        self.errors[key] = count
+        heapq.heappush(heap, (count + 1, key))
+
+
+    def top(self, n):
+        """Returns the <n> largest (key, count, error) tuples."""
+        return [(key, count, self.errors[key]) for key, count in
+                heapq.nlargest(n, self.counts.items(),
+                               key=lambda item: (item[1], -self.errors[item[0]]))]
+
+
+class HyperLogLog(object):
+    """Estimates the number of distinct keys (strings) added."""
+
+    def __init__(self, bits=HLL_BITS):
+        self.bits = bits
+        self.size = 1 << bits
+        self.registers = bytearray(self.size)
+
+
+    def add(self, key):
+        h = int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'big')
+        index = h & (self.size - 1)
+        rest = h >> self.bits
+        # Position of the lowest set bit of the remaining 64 - bits bits
+        rank = (rest & -rest).bit_length() if rest else 64 - self.bits + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+
+    def count(self):
+        size = self.size
+        estimate = 0.7213 / (1 + 1.079 / size) * size * size / \
+            sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * size and zeros:
+            # Linear counting, which is more accurate for small numbers
+            return int(round(size * math.log(float(size) / zeros)))
+        return int(round(estimate))
+
+
+class BoundedCounter(collections.Counter):
+    """A Counter that counts keys beyond the first <limit> as OTHER."""
+
+    def __init__(self, limit):
+        super(BoundedCounter, self).__init__()
+        self.limit = limit
+
+
+    def add(self, key, count=1):
+        if key not in self and len(self) >= self.limit:
+            key = OTHER
+        self[key] += count
+
+
+class Summary(object):
+    """
+    Stands in for one of the output writers (see output.py), adding each
+    record to the rollups, which report() writes to the text file <out> in
+    <output_format>.
+    """
+
+    def __init__(self, out, output_format='text', top=None, keys=None):
+        self.out = out
+        self.output_format = output_format
+        self.top = top or TOP
+        keys = keys or KEYS
+        self.messages = 0
+        self.incomplete = 0
+        self.senders = SpaceSaving(keys)
+        self.ips = SpaceSaving(keys)
+        self.distinct_senders = HyperLogLog()
+        self.distinct_ips = HyperLogLog()
+        self.distinct_recipients = HyperLogLog()
+        self.mailboxes = BoundedCounter(keys)
+        # Mapping of user to a Counter of spam levels; users beyond <keys>
+        # are lumped together
+        self.spam_levels = {}
+        self.keys = keys
+
+
+    def write(self, record):
+        self.messages += 1
+        if record.incomplete:
+            self.incomplete += 1
+        if record.envfrom:
+            self.senders.add(record.envfrom)
+            self.distinct_senders.add(record.envfrom)
+        if record.ip:
+            self.ips.add(record.ip)
+            self.distinct_ips.add(record.ip)
+        for r in record.recipients:
+            self.distinct_recipients.add(r.address)
+            if r.user is None:
+                continue
+            if r.mailbox is not None:
+                self.mailboxes.add((r.user, r.mailbox))
+            if r.spam_level is not None:
+                user = r.user
+                if user not in self.spam_levels:
+                    if len(self.spam_levels) >= self.keys:
+                        user = OTHER
+                    self.spam_levels.setdefault(user, collections.Counter())
+                self.spam_levels[user][r.spam_level] += 1
+
+
+    def flush(self):
+        """Nothing is written until report()."""
+
+
+    def results(self):
+        """Returns the rollups as a dict, as written with --format jsonl."""
+        mailboxes = sorted(self.mailboxes.items(), key=lambda item: (-item[1], str(item[0])))
+        return {
+            'messages': self.messages,
+            'incomplete': self.incomplete,
+            'distinct_senders': self.distinct_senders.count(),
+            'distinct_ips': self.distinct_ips.count(),
+            'distinct_recipients': self.distinct_recipients.count(),
+            'top_senders': [{'envfrom': key, 'count': count, 'error': error}
+                            for key, count, error in self.senders.top(self.top)],
+            'top_ips': [{'ip': key, 'count': count, 'error': error}
+                        for key, count, error in self.ips.top(self.top)],
+            'top_mailboxes': [{'user': key[0], 'mailbox': key[1], 'count': count} if key != OTHER
+                              else {'user': OTHER, 'mailbox': None, 'count': count}
+                              for key, count in mailboxes[:self.top]],
+            'spam_levels': dict((user, dict((str(level), count) for level, count in sorted(levels.items())))
+                                for user, levels in sorted(self.spam_levels.items())),
+        }
+
+
+    def report(self):
+        results = self.results()
+        if self.output_format == 'jsonl':
+            self.out.write(json.dumps(results) + "\n")
+        elif self.output_format == 'tsv':
+            self.out.write(format_tsv(results))
+        else:
+            self.out.write(format_text(results))
+        self.out.flush()
+
+
+def format_text(results):
+    lines = ["Messages: {0} ({1} incomplete)".format(results['messages'], results['incomplete']),
+             "Distinct senders: ~{0}".format(results['distinct_senders']),
+             "Distinct client IPs: ~{0}".format(results['distinct_ips']),
+             "Distinct recipients: ~{0}".format(results['distinct_recipients']),
+             "", "Top senders:"]
+    for row in results['top_senders']:
+        lines.append("  {0:8d}  {1}{2}".format(row['count'], row['envfrom'],
+                                               " (+/-{0})".format(row['error']) if row['error'] else ""))
+    lines += ["", "Top client IPs:"]
+    for row in results['top_ips']:
+        lines.append("  {0:8d}  {1}{2}".format(row['count'], row['ip'],
+                                               " (+/-{0})".format(row['error']) if row['error'] else ""))
+    lines += ["", "Top mailboxes:"]
+    for row in results['top_mailboxes']:
+        lines.append("  {0:8d}  {1}{2}".format(row['count'], row['user'],
+                                               ": " + row['mailbox'] if row['mailbox'] else ""))
+    lines += ["", "Spam levels (level:count):"]
+    for user, levels in sorted(results['spam_levels'].items()):
+        lines.append("  {0}  {1}".format(user, " ".join("{0}:{1}".format(level, count)
+                                                        for level, count in levels.items())))
+    return "\n".join(lines) + "\n"
+
+
+def format_tsv(results):
+    """One row per value: section, key, count."""
+    rows = [("messages", "", results['messages']), ("incomplete", "", results['incomplete']),
+            ("distinct_senders", "", results['distinct_senders']),
+            ("distinct_ips", "", results['distinct_ips']),
+            ("distinct_recipients", "", results['distinct_recipients'])]
+    rows += [("sender", row['envfrom'], row['count']) for row in results['top_senders']]
+    rows += [("ip", row['ip'], row['count']) for row in results['top_ips']]
+    rows += [("mailbox", "%s:%s" % (row['user'], row['mailbox'] or ""), row['count'])
+             for row in results['top_mailboxes']]
+    for user, levels in sorted(results['spam_levels'].items()):
+        rows += [("spam_level", "%s:%s" % (user, level), count) for level, count in levels.items()]
+    return "".join("%s\t%s\t%s\n" % row for row in rows)
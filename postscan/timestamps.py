@@ -0,0 +1,116 @@
+"""
+Converts syslog timestamps such as "Aug 10 16:14:36", which have no year,
+to seconds since the epoch.
+"""
+
+from __future__ import absolute_import
+
+import time
+import calendar
+
+
+MONTHS = dict((name, number) for number, name in enumerate(
+    ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
+     'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'], 1))
+
+# Formats accepted for --since and --until
+TIME_FORMATS = ["%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d"]
+# How far ahead of now (in UTC) a local timestamp can be, as a day later
+# than the one it's logged on could be in a time zone east of UTC
+MAX_AHEAD = 86400
+
+
+def parse(dt, year):
+    """Returns the timestamp in seconds (treating it as UTC), or None."""
+    try:
+        month, day, hms = dt.split()
+        hours, minutes, seconds = hms.split(':')
+        return calendar.timegm((year, MONTHS[month], int(day),
+                                int(hours), int(minutes), int(seconds)))
+    except (ValueError, KeyError):
+        return None
+
+
+def parse_time(s):
+    """Converts e.g. "2023-03-27 14:00" to seconds, treating it as UTC like parse()."""
+    for fmt in TIME_FORMATS:
+        try:
+            return calendar.timegm(time.strptime(s, fmt))
+        except ValueError:
+            pass
+    raise ValueError("invalid time %r; expected YYYY-MM-DD [HH:MM[:SS]]" % s)
+
+
+def first_year(day, now=None):
+    """
+    Returns the year of the date <day> (e.g. "Dec 30") that puts it no
+    later than <now> (by default the current time), allowing for time zones.
+    """
+
+    now = time.time() if now is None else now
+    year = time.gmtime(now).tm_year
+    midnight = parse(day + " 00:00:00", year)
+    if midnight is not None and midnight > now + MAX_AHEAD:
+        year -= 1
+    return year
+
+
+class SyslogClock(object):
+    """
+    Converts a sequence of timestamps, each assumed to be close to the one
+    before, so that the year can be inferred; a jump back of more than six
+    months (e.g. "Dec 31" to "Jan  1") means a new year, while a jump
+    forward of more than six months is a stray line from the previous one.
+    Without a <year>, the first timestamp is placed in the last year in
+    which it isn't in the future, as of <now>.
+    """
+
+    def __init__(self, year=None, now=None):
+        self.year = year
+        self.now = now
+        self.month = None
+        self.last_dt = None
+        self.last_seconds = None
+        # The date part of the last timestamp, e.g. "Aug 10", and its midnight
+        self.day = None
+        self.midnight = None
+
+
+    def seconds(self, dt):
+        if dt == self.last_dt:
+            return self.last_seconds
+
+        # The time is always the last 8 characters, but the day of the
+        # month may or may not be padded
+        day = dt[:-9]
+        if day != self.day:
+            self.day = day
+            self.midnight = parse(day + " 00:00:00", self.infer_year(day))
+
+        seconds = None
+        if self.midnight is not None:
+            try:
+                seconds = self.midnight + int(dt[-8:-6]) * 3600 + int(dt[-5:-3]) * 60 + int(dt[-2:])
+            except ValueError:
+                pass
+        self.last_dt = dt
+        self.last_seconds = seconds
+        return seconds
+
+
+    def infer_year(self, day):
+        month = MONTHS.get(day[:3])
+        if self.year is None:
+            self.year = first_year(day, self.now)
+        year = self.year
+        if month and self.month:
+            if month < self.month - 6:
+                self.year = year = year + 1
+                self.month = month
+            elif month > self.month + 6:
+                year -= 1
+            else:
+                self.month = month
+        elif month:
+            self.month = month
+        return year
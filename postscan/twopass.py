@@ -0,0 +1,171 @@
+"""
+Two-pass scanning of a log file for --to, with --two-pass.
+
+Normally every message is correlated in full, and only checked against
+--to when it's removed.  Instead, a first pass only looks at the
+postfix/local lines that contain the address (found by substring search,
+before any regex is tried), to find the queue IDs of the messages
+delivered to the address, where the first and last of those deliveries
+are, and the longest "delay=" (the time since the message arrived) of
+any of them, as a deferred message can be delivered long after it
+arrived.  Only those are kept, so the first pass's memory doesn't grow
+with the number of messages in the file.
+
+The second pass reads from the lead-in (see window.py) before the longest
+delay before the first delivery, which covers the client and cleanup
+lines of every one of those messages, to as long after the last delivery,
+in a regular file, and only hands the state machine the lines for those
+queue IDs, plus spamd and dovecot lda lines (which have Message-IDs
+instead), to be correlated as usual.  If any of the messages has no
+Message-ID, the lines of all such messages in that range are handed over
+too, as the fake IDs they're given are matched up to spamd and dovecot
+lines by the order in which they're allocated (see handle_result()).
+Lines for other messages are skipped without being matched; both passes
+search whole blocks of the file with bytes.find() and a regex rather than
+looking at each line in turn.
+"""
+
+from __future__ import absolute_import
+
+import re
+
+from .inputs import read_blocks, is_regular
+
+
+# The cleanup line of a message without a Message-ID
+ANONYMOUS_TAG = b': message-id=<>'
+LDA_TAG = b' dovecot: lda('
+# The queue ID (or "spamd") after the program tag
+QUEUE_ID_RE = re.compile(br'\]: (\w+): ')
+# Seconds from a message's arrival to its delivery, in a postfix/local line
+DELAY_RE = re.compile(br', delay=([0-9.]+),')
+
+
+class Targets(object):
+    """What the first pass found."""
+
+    def __init__(self):
+        self.queue_ids = set()      # Delivered to the address
+        # Offset of the first delivery, and the offset and line of the last
+        self.start = None
+        self.last = None
+        # The longest time from arrival to delivery of those messages
+        self.delay = 0.0
+        # Queue IDs without a Message-ID in the second pass's range, as found
+        # by find_anonymous()
+        self.anonymous = set()
+
+
+    def wanted(self):
+        """Returns the queue IDs of the messages to correlate, as bytes."""
+        queue_ids = self.queue_ids
+        if queue_ids & self.anonymous:
+            queue_ids = queue_ids | self.anonymous
+        return set(queue_id.encode('utf-8') for queue_id in queue_ids)
+
+
+def chunks(f):
+    """
+    Yields the offset and contents of each block of whole lines read from
+    the binary file <f>, starting at its current position.
+    """
+
+    offset = f.tell() if is_regular(f) else 0
+    tail = b''
+    for block in read_blocks(f):
+        chunk = tail + block if tail else block
+        end = chunk.rfind(b'\n') + 1
+        tail = chunk[end:]
+        if end:
+            yield offset, chunk[:end]
+            offset += end
+    if tail:
+        yield offset, tail
+
+
+def line_at(chunk, pos):
+    """Returns the start and end of the line of <chunk> that includes <pos>."""
+    return chunk.rfind(b'\n', 0, pos) + 1, (chunk.find(b'\n', pos) + 1) or len(chunk)
+
+
+def matching_lines(f, needles):
+    """
+    Yields the offset and contents of each line of the binary file <f> that
+    contains any of <needles>, in order.  Whole blocks are searched rather
+    than each line, which is several times faster.
+    """
+
+    for offset, chunk in chunks(f):
+        lines = set()
+        for needle in needles:
+            pos = chunk.find(needle)
+            while pos >= 0:
+                start, stop = line_at(chunk, pos)
+                lines.add((start, stop))
+                pos = chunk.find(needle, stop)
+        for start, stop in sorted(lines):
+            yield offset + start, chunk[start:stop]
+
+
+def find_targets(f, address, find):
+    """
+    Reads the binary file <f> for the first pass, using <find> to match a
+    line (as bytes) like Scanner.find().
+    """
+
+    targets = Targets()
+    for offset, line in matching_lines(f, [address.encode('utf-8')]):
+        result = find(line, 0)
+        if result:
+            label, groups = result
+            if label == 'local' and address in (groups[3], groups[4]):
+                targets.queue_ids.add(groups[2])
+                if targets.start is None:
+                    targets.start = offset
+                targets.last = offset, line
+                m = DELAY_RE.search(line)
+                if m:
+                    targets.delay = max(targets.delay, float(m.group(1)))
+    return targets
+
+
+def find_anonymous(f, end=None):
+    """
+    Returns the queue IDs of the messages without a Message-ID in the
+    binary file <f>, from its current position up to the offset <end>.
+    """
+
+    anonymous = set()
+    for offset, line in matching_lines(f, [ANONYMOUS_TAG]):
+        if end is not None and offset >= end:
+            break
+        m = QUEUE_ID_RE.search(line)
+        if m:
+            anonymous.add(m.group(1).decode('utf-8'))
+    return anonymous
+
+
+def wanted_lines(f, queue_ids, end=None):
+    """
+    Yields the lines of the binary file <f> (from its current position up
+    to the offset <end>) that the second pass needs: those with a queue ID
+    (e.g. "postfix/qmgr[37259]: EBA07667720: ...") in <queue_ids>, and spamd
+    and dovecot lda lines, which have Message-IDs instead.
+    """
+
+    queue_ids = set(queue_ids)
+    queue_ids.add(b'spamd')         # "spamd[1234]: spamd: result: ..."
+    for offset, chunk in chunks(f):
+        if end is not None and offset + len(chunk) > end:
+            chunk = chunk[:max(end - offset, 0)]
+        lines = [line_at(chunk, m.start()) for m in QUEUE_ID_RE.finditer(chunk)
+                 if m.group(1) in queue_ids]
+        pos = chunk.find(LDA_TAG)
+        while pos >= 0:
+            start, stop = line_at(chunk, pos)
+            lines.append((start, stop))
+            pos = chunk.find(LDA_TAG, stop)
+        for start, stop in sorted(set(lines)):
+            yield chunk[start:stop]
+        if end is not None and offset + len(chunk) >= end:
+            break
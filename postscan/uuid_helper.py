@@ -1,9 +1,23 @@
 import uuid
+import itertools
+import collections
 
 
 class UUIDs(object):
-    """A FIFO queue of auto-generated UUID strings."""
-    uuids = []
+    """
+    A FIFO queue of auto-generated UUID strings, each of which can be claimed
+    by one user.  Creating, popping and finding the first unclaimed UUID are
+    all O(1), however long the queue gets.
+    """
+
+    def __init__(self, uuids=(), owners=None):
+        # Ordered sets, as dicts with no values: every UUID in the queue, and
+        # those that haven't been claimed yet
+        self.uuids = collections.OrderedDict((u, None) for u in uuids)
+        self.owners = {} if owners is None else owners   # Mapping of UUID to username
+        self.unowned = collections.OrderedDict((u, None) for u in self.uuids
+                                               if u not in self.owners)
+
 
     def create(self):
         """
@@ -11,28 +25,54 @@ class UUIDs(object):
         """
 
         u = str(uuid.uuid4())
-        self.uuids.append(u)
+        self.uuids[u] = None
+        self.unowned[u] = None
         return u
 
 
     def pop(self, target_uuid=None):
         """Pop either the first element, or the specified one if present."""
 
-        for index, uuid in enumerate(self.uuids):
-            if self.uuids[index] == target_uuid:
-                target_index = index
-                break
+        if target_uuid in self.uuids:
+            u = target_uuid
+            del self.uuids[u]
+        elif self.uuids:
+            u = self.uuids.popitem(last=False)[0]
         else:
-            target_index = 0
-
-        u = self.uuids[target_index]
-        del self.uuids[target_index]
+            raise IndexError("pop from empty queue")
+        self.unowned.pop(u, None)
+        self.owners.pop(u, None)
         return u
 
 
     def peek(self, index=0):
-        return self.uuids[index]
+        if index == 0 and self.uuids:
+            return next(iter(self.uuids))
+        try:
+            return next(itertools.islice(self.uuids, index, None))
+        except StopIteration:
+            raise IndexError("queue index out of range")
+
+
+    def first_unowned(self):
+        """Returns the first UUID that hasn't been claimed."""
+        if not self.unowned:
+            raise IndexError("no unclaimed IDs in queue")
+        return next(iter(self.unowned))
+
+
+    def claim(self, u, user):
+        self.owners[u] = user
+        self.unowned.pop(u, None)
 
 
     def empty(self):
         return len(self.uuids) == 0
+
+
+    def __len__(self):
+        return len(self.uuids)
+
+
+    def __iter__(self):
+        return iter(self.uuids)
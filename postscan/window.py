@@ -0,0 +1,136 @@
+"""
+Finds the part of a log file between two times, for --since and --until.
+
+In a regular, uncompressed file, the lines at each end of the window are
+found by binary search on byte offsets: each probe skips to the next line
+boundary and reads the first timestamp after it, so only a few dozen
+lines are read however large the file is.  Anything else has to be read
+from the start, skipping lines by their timestamps.
+
+Syslog timestamps have no year, so each line is taken to be from whichever
+year puts it within six months of <since> (or <until>); e.g. for a window
+in early January, "Dec 31" is in the year before.
+
+Reading starts a while (the lead-in) before <since>, so that the earlier
+lines of messages that are removed within the window are seen; lines are
+assumed to be in order apart from a little jitter, which this also covers.
+"""
+
+from __future__ import absolute_import
+
+import re
+import time
+
+from .timestamps import parse
+
+
+# Default number of seconds to start reading before <since>
+LEAD_IN = 600
+# Once the search has narrowed down to this many bytes, lines are read in turn
+SCAN_SIZE = 64 * 1024
+# Lines are placed in the year that puts them within this of the window
+HALF_YEAR = 183 * 86400
+
+# Date at the start of a line, e.g. "Aug 10 16:14:36 "
+DT_RE = re.compile(br'(\w{3} +\d+ \d{2}:\d{2}:\d{2}) ')
+
+
+class LineClock(object):
+    """
+    Returns the time of a line (as bytes) in seconds, or None if it doesn't
+    start with a timestamp, choosing the year that puts it closest to <near>.
+    """
+
+    def __init__(self, near):
+        self.near = near
+        self.year = time.gmtime(near).tm_year
+        self.last_dt = None
+        self.last_seconds = None
+
+
+    def __call__(self, line):
+        m = DT_RE.match(line)
+        if not m:
+            return None
+        dt = m.group(1)
+        if dt != self.last_dt:
+            seconds = parse(dt.decode('ascii'), self.year)
+            if seconds is not None and seconds > self.near + HALF_YEAR:
+                seconds = parse(dt.decode('ascii'), self.year - 1)
+            elif seconds is not None and seconds < self.near - HALF_YEAR:
+                seconds = parse(dt.decode('ascii'), self.year + 1)
+            self.last_dt = dt
+            self.last_seconds = seconds
+        return self.last_seconds
+
+
+def line_start(f, offset):
+    """Returns the offset of the first line that starts at or after <offset>."""
+    if offset == 0:
+        return 0
+    f.seek(offset - 1)
+    f.readline()
+    return f.tell()
+
+
+def first_time(f, offset, end, clock):
+    """
+    Returns the offset and time of the first line with a timestamp that
+    starts between <offset> (the start of a line) and <end>, or <end> and None.
+    """
+
+    f.seek(offset)
+    while offset < end:
+        line = f.readline()
+        if not line:
+            break
+        seconds = clock(line)
+        if seconds is not None:
+            return offset, seconds
+        offset += len(line)
+    return end, None
+
+
+def find_offset(f, target, clock, lo, hi):
+    """
+    Returns the offset of the first line between <lo> and <hi> (both the
+    starts of lines) in the binary file <f> whose time is at or after
+    <target>, or <hi> if there isn't one.
+    """
+
+    while hi - lo > SCAN_SIZE:
+        mid = line_start(f, (lo + hi) // 2)
+        if mid >= hi:
+            break
+        offset, seconds = first_time(f, mid, hi, clock)
+        if seconds is not None and seconds < target:
+            lo = offset
+        else:
+            hi = mid
+
+    f.seek(lo)
+    offset = lo
+    while offset < hi:
+        line = f.readline()
+        if not line:
+            break
+        seconds = clock(line)
+        if seconds is not None and seconds >= target:
+            return offset
+        offset += len(line)
+    return hi
+
+
+def find_range(f, size, clock, since=None, until=None, lead_in=LEAD_IN):
+    """
+    Returns the offsets in the regular binary file <f> at which to start
+    reading (<lead_in> seconds before <since>), to start printing messages
+    (<since>) and to stop (<until>).
+    """
+
+    first = start = 0
+    if since is not None:
+        first = find_offset(f, since - lead_in, clock, 0, size)
+        start = find_offset(f, since, clock, first, size)
+    end = size if until is None else find_offset(f, until, clock, start, size)
+    return first, start, end
@@ -26,27 +26,33 @@ setup(
         'Intended Audience :: System Administrators',
         'License :: OSI Approved :: GNU General Public License v3 (GPLv3)',
         'Natural Language :: English',
-        "Programming Language :: Python :: 2",
-        'Programming Language :: Python :: 2.7',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.4',
-        'Programming Language :: Python :: 3.5',
-        'Programming Language :: Python :: 3.6',
+        'Programming Language :: Python :: 3 :: Only',
         'Programming Language :: Python :: 3.7',
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
+        'Programming Language :: Python :: 3.12',
     ],
     description="Tools, scripts and config for use with the Postfix MTA.",
     entry_points={
         'console_scripts': [
             'postscan=postscan.cli:main',
+            'postresolve=postresolve.cli:main',
+            'postresolved=postresolve.socketmap:main',
+            'postresolve-client=postresolve.client:main',
+            'postresolve-index=postresolve.index:main',
         ],
     },
-    scripts=['bin/postresolve', 'bin/tweak_clamav-milter'],
+    scripts=['bin/postresolve.sh', 'bin/tweak_clamav-milter'],
     install_requires=requirements,
     license="GNU General Public License v3",
     long_description=readme + '\n\n' + history,
     include_package_data=True,
     keywords='postscan',
-    packages=find_packages(include=['postscan']),
+    packages=find_packages(include=['postscan', 'postresolve']),
+    python_requires='>=3.7',
     setup_requires=setup_requirements,
     test_suite='tests',
     tests_require=test_requirements,
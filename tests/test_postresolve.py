@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `postresolve` package."""
+
+
+import io
+import os
+import sys
+import stat
+import time
+import shutil
+import signal
+import logging
+import tempfile
+import unittest
+import subprocess
+from click.testing import CliRunner
+from unittest import mock
+
+from postresolve import cli
+from postresolve import client
+from postresolve import index
+from postresolve import maps
+from postresolve import postconf
+from postresolve import resolver
+
+
+MAIN_CF = """\
+myhostname = mail.example.net
+mydomain = example.net
+myorigin = $myhostname
+mydestination = $myhostname, localhost.$mydomain, localhost
+inet_interfaces = loopback-only
+proxy_interfaces =
+alias_maps = hash:{dir}/aliases
+virtual_alias_maps = hash:{dir}/virtual, regexp:{dir}/virtual.regexp
+virtual_mailbox_maps = hash:{dir}/vmailbox
+virtual_mailbox_base = /var/vmail
+virtual_transport = virtual
+local_transport = local:$myhostname
+"""
+
+FILES = {
+    'aliases': """\
+# See aliases(5)
+postmaster: root
+root: alice, "|/usr/bin/procmail -a root",
+  /var/log/root.mail
+loop1: loop2
+loop2: loop1, alice
+self: self, bob
+staff: :include:{dir}/staff
+""",
+    'staff': "alice, bob\n",
+    'virtual': """\
+info@example.com    postmaster@mail.example.net, someone@example.org
+sales@example.com   info@example.com
+both@example.com    both@example.com, box@example.com
+""",
+    'virtual.regexp': """\
+if /@example\\.com$/
+/^(.*)-team@/       ${1}@example.com
+endif
+""",
+    'vmailbox': "box@example.com     example.com/box/\n",
+}
+
+USERS = ('alice', 'bob', 'root', 'self')
+
+
+class TestPostresolve(unittest.TestCase):
+    """Tests for `postresolve` package."""
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        for name, text in FILES.items():
+            with open(os.path.join(self.dir, name), 'w') as f:
+                f.write(text.replace("{dir}", self.dir))
+        self.main_cf = MAIN_CF.replace("{dir}", self.dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def make_resolver(self):
+        conf = postconf.PostConf(postconf.parse(self.main_cf))
+        return resolver.Resolver(conf, logging.getLogger("postresolve"),
+                                 user_exists=lambda user: user in USERS)
+
+    def test_postconf(self):
+        conf = postconf.PostConf(postconf.parse(self.main_cf + "a = ${mydomain?x$mydomain} ${none:y} $$\n"))
+        self.assertEqual(conf.get('mydestination'),
+                         "mail.example.net, localhost.example.net, localhost")
+        self.assertEqual(conf.get('a'), "xexample.net y $")
+        self.assertEqual(conf.get_list('mydestination')[1], "localhost.example.net")
+        self.assertEqual(conf.get('missing', 'default'), 'default')
+
+    def test_maps(self):
+        aliases = maps.open_map("hash:" + os.path.join(self.dir, 'aliases'), aliases=True)
+        self.assertEqual(aliases.lookup('ROOT'),
+                         'alice, "|/usr/bin/procmail -a root", /var/log/root.mail')
+        regexp = maps.open_map("regexp:" + os.path.join(self.dir, 'virtual.regexp'))
+        self.assertEqual(regexp.lookup('sales-team@example.com'), 'sales@example.com')
+        self.assertIsNone(regexp.lookup('sales-team@example.org'))
+        inline = maps.open_map("inline:{ a=b, { c = d e } }")
+        self.assertEqual(inline.lookup('C'), 'd e')
+        self.assertEqual(maps.split_maps("hash:/a, inline:{ a=b, c=d } static:x"),
+                         ["hash:/a", "inline:{ a=b, c=d }", "static:x"])
+
+    def test_resolve(self):
+        r = self.make_resolver()
+        root = ["... deliverable: mailer local, user alice", "run command: |/usr/bin/procmail -a root",
+                "/var/log/root.mail"]
+
+        def resolve(address, local_only=False):
+            return [line for line in (resolver.format_destination(d, 'compatible', local_only)
+                                      for d in r.resolve(address)) if line is not None]
+
+        self.assertEqual(resolve("<info@example.com>"), root + ["someone@example.org"])
+        self.assertEqual(resolve("info@example.com", local_only=True), root)
+        self.assertEqual(resolve("sales-team@example.com"), root + ["someone@example.org"])
+        # Both virtual aliases and aliases that lead back to themselves
+        self.assertEqual(resolve("both@example.com"), ["both@example.com", "/var/vmail/example.com/box/"])
+        self.assertEqual(resolve("self"), ["... deliverable: mailer local, user self",
+                                           "... deliverable: mailer local, user bob"])
+        self.assertEqual(resolve("loop1"), ["loop1 not found!", "... deliverable: mailer local, user alice"])
+        self.assertEqual(resolve("staff"), ["... deliverable: mailer local, user alice",
+                                            "... deliverable: mailer local, user bob"])
+        self.assertEqual(resolve("nobody@localhost"), ["nobody not found!"])
+        # Shared expansions are remembered, except those that depend on where
+        # a loop was entered
+        self.assertIn('root', r.expansions)
+        self.assertIn('loop1', r.expansions)
+        self.assertNotIn('loop2', r.expansions)
+        with mock.patch.object(maps.TextMap, 'lookup') as lookup:
+            resolve("sales@example.com")
+            lookup.assert_not_called()
+
+    def test_cli_modes(self):
+        runner = CliRunner()
+        with mock.patch.object(postconf, 'run_postconf', return_value=self.main_cf) as run_postconf, \
+                mock.patch.object(resolver, 'passwd_user_exists', lambda user: user in USERS):
+            result = runner.invoke(cli.main, ['postmaster@mail.example.net'])
+            self.assertEqual(result.output, "alice: local\nrun command: |/usr/bin/procmail -a root\n"
+                                            "/var/log/root.mail\n")
+            result = runner.invoke(cli.main, ['-b', 'info@example.com'])
+            self.assertEqual(result.output.splitlines()[0], "alice")
+            self.assertEqual(result.output.splitlines()[-1], "someone@example.org")
+            # As spamass-milter runs "sendmail -bv"
+            result = runner.invoke(cli.main, ['-bv', 'sales@example.com'])
+            self.assertEqual(result.output.splitlines(), [
+                "... deliverable: mailer local, user alice", "run command: |/usr/bin/procmail -a root",
+                "/var/log/root.mail"])
+            result = runner.invoke(cli.main, ['--batch', '-f'], input="info@example.com\n\nbob\n")
+            self.assertEqual(result.output, "info@example.com\talice: local\nbob\tbob: local\n")
+            self.assertEqual(run_postconf.call_count, 4)
+            result = runner.invoke(cli.main, [])
+            self.assertEqual(result.exit_code, 2)
+
+    def test_socketmap(self):
+        path = os.path.join(self.dir, 'postresolve.sock')
+        postconf_file = os.path.join(self.dir, 'postconf')
+        with open(postconf_file, 'w') as f:
+            f.write(self.main_cf)
+        daemon = subprocess.Popen([sys.executable, '-m', 'postresolve.socketmap', '-S', path,
+                                   '-P', postconf_file])
+        try:
+            for i in range(500):
+                if os.path.exists(path):
+                    break
+                time.sleep(0.01)
+            sock = client.connect(path)
+            self.assertEqual(client.query(sock, 'standard', 'both@example.com'),
+                             ('OK', "both@example.com\n/var/vmail/example.com/box/"))
+            self.assertEqual(client.query(sock, 'brief-local', 'someone@example.org'), ('NOTFOUND', ''))
+            self.assertEqual(client.query(sock, 'other', 'someone@example.org')[0], 'PERM')
+            # The same whichever capitalisation was asked for first
+            self.assertEqual(client.query(sock, 'compatible', 'Other@Example.org'),
+                             ('OK', "other@example.org"))
+            self.assertEqual(client.query(sock, 'compatible', 'other@example.org'),
+                             ('OK', "other@example.org"))
+            self.assertEqual(stat.S_IMODE(os.stat(path).st_mode), 0o660)
+            # Pipelined requests
+            sock.sendall(b"22:standard a@example.org,22:standard b@example.org,")
+            with sock.makefile('rb') as f:
+                self.assertEqual(client.read_netstring(f), b"OK a@example.org")
+                self.assertEqual(client.read_netstring(f), b"OK b@example.org")
+            sock.close()
+
+            # Reloads when a table changes
+            vmailbox = os.path.join(self.dir, 'vmailbox')
+            with open(vmailbox, 'w') as f:
+                f.write("box@example.com     example.com/moved/\n")
+            os.utime(vmailbox, (time.time() + 10, time.time() + 10))
+            time.sleep(1.1)
+            with mock.patch('sys.stdout', new_callable=io.StringIO) as stdout:
+                self.assertEqual(client.main(['-S', path, '-b', '<box@example.com>']), 0)
+            self.assertEqual(stdout.getvalue(), "/var/vmail/example.com/moved/\n")
+        finally:
+            daemon.send_signal(signal.SIGTERM)
+            daemon.wait()
+        self.assertFalse(os.path.exists(path))
+
+    def test_index(self):
+        postconf_file = os.path.join(self.dir, 'postconf')
+        with open(postconf_file, 'w') as f:
+            f.write(self.main_cf)
+        db = index.connect(os.path.join(self.dir, 'index.db'))
+
+        def build():
+            conf = postconf.PostConf(postconf.parse(self.main_cf))
+            builder = index.IndexBuilder(db, index.TracingResolver(conf, logging.getLogger("postresolve"),
+                                                                   user_exists=lambda user: user in USERS),
+                                         [postconf_file], logging.getLogger("postresolve"))
+            return builder.build()
+
+        # Every key of the three tables that can be listed
+        self.assertEqual(build(), (10, 10))
+        self.assertEqual(build(), (0, 10))
+        self.assertEqual([resolver.format_destination(d, 'brief') for d in index.forward(db, 'Sales@example.com')],
+                         ["alice", "run command: |/usr/bin/procmail -a root", "/var/log/root.mail", "someone@example.org"])
+        self.assertIsNone(index.forward(db, 'nobody@example.com'))
+        self.assertEqual(index.reverse(db, 'alice'),
+                         ['info@example.com', 'loop1', 'loop2', 'postmaster', 'root', 'sales@example.com', 'staff'])
+
+        # Only what leads to a changed key is expanded again
+        aliases = os.path.join(self.dir, 'aliases')
+        with open(aliases, 'w') as f:
+            f.write(FILES['aliases'].replace("{dir}", self.dir).replace("postmaster: root", "postmaster: bob"))
+        os.utime(aliases, (time.time() + 10, time.time() + 10))
+        self.assertEqual(build(), (3, 10))
+        self.assertEqual(index.reverse(db, 'bob'),
+                         ['info@example.com', 'postmaster', 'sales@example.com', 'self', 'staff'])
+        self.assertEqual(index.reverse(db, 'alice'), ['loop1', 'loop2', 'root', 'staff'])
+        db.close()
+
+        # Queries open the index read-only
+        runner = CliRunner()
+        result = runner.invoke(index.main, ['query', '-i', os.path.join(self.dir, 'index.db'),
+                                            '-r', 'bob'])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertEqual(result.output.split(), ['info@example.com', 'postmaster', 'sales@example.com',
+                                                 'self', 'staff'])
+        empty = os.path.join(self.dir, 'empty.db')
+        open(empty, 'w').close()
+        result = runner.invoke(index.main, ['query', '-i', empty, 'alice'])
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn("isn't a postresolve index", result.output)
+        self.assertEqual(os.path.getsize(empty), 0)
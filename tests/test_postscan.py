@@ -4,11 +4,138 @@
 """Tests for `postscan` package."""
 
 
+import os
+import json
+import re
+import sys
+import bz2
+import calendar
+import collections
+import gc
+import gzip
+import io
+import heapq
+import lzma
+import random
+import shutil
+import signal
+import tempfile
+import threading
+import time
+import socket
+import subprocess
+import struct
+import logging
 import unittest
+import warnings
 from click.testing import CliRunner
+from unittest import mock
 
 from postscan import postscan
 from postscan import cli
+from postscan.scanner import Scanner
+from postscan import parallel
+from postscan import inputs
+from postscan import follow
+from postscan import loggen
+from postscan import database
+from postscan import window
+from postscan import journal
+from postscan import hosts
+from postscan import server
+from postscan import sendlog
+from postscan import summary
+from postscan import timestamps
+from postscan import output
+from postscan import merge
+from postscan import checkpoint
+from postscan.state import StateMachine
+from postscan.parser import Parser, parse_lines
+from postscan.uuid_helper import UUIDs
+
+
+HOST = socket.gethostname()
+
+# Log lines in the format Scanner expects, minus the date & host
+SAMPLE_LINES = [
+    "postfix/smtpd[22878]: connect from o417.notify.sendle.com[167.89.105.135]",
+    "postfix/smtpd[22878]: 1864B667736: client=unknown[192.187.99.250]",
+    "postfix/submission/smtpd[22879]: 1864B667737: client=mail.example.com[10.0.0.1]",
+    "postfix/pickup[46180]: 16982667739: uid=0 from=<root>",
+    "postfix/cleanup[44462]: EBA07667720: message-id=<1533884753792.b2c522e5-18f2-4b30-bd0d-1a622ab63539@notify.sendle.com>",
+    "postfix/cleanup[30143]: 43877660443: message-id=<5B34496C16872430@smtp.telstra.com> (added by postmaster@smtp.telstra.com)",
+    "postfix/cleanup[30143]: 43877660444: message-id=<>",
+    "postfix/qmgr[37259]: EBA07667720: from=<melissa@pagetraffic.tech>, size=3900, nrcpt=1 (queue active)",
+    "postfix/qmgr[37259]: EBA07667721: from=<>, size=3900, nrcpt=1 (queue active)",
+    "spamd[1234]: spamd: result: . 4 - BAYES_60,HTML_MESSAGE scantime=1.7,size=3752,user=spamass-milter,uid=124,required_score=5.0,rhost=localhost,raddr=127.0.0.1,rport=35658,mid=<PBLLr6b5xX05qVzhu_RZ8Wi_0ry5k4PWu2@wCac.adeptus.com>,bayes=0.715496,autolearn=no",
+    "spamd[1234]: spamd: result: Y 12 - BAYES_99 scantime=1.7,size=3752,user=xyz,uid=124,mid=(unknown),autolearn=no",
+    "dovecot: lda(xyz): sieve: msgid=<f2f99cbdae05cab1de81cb0b3d519a98@RobertBanas.download>: stored mail into mailbox 'INBOX'",
+    "dovecot: lda(xyz)<20453><gtTeEEIBGWTlTwAAPWRvRg>: sieve: msgid=unspecified: stored mail into mailbox ' Spam'",
+    "postfix/local[8270]: 2FECF667738: to=<user@xyz.com.au>, orig_to=<info@xyz.com.au>, relay=local, delay=3.3, dsn=2.0.0, status=sent (delivered to command: /usr/lib/dovecot/dovecot-lda)",
+    "postfix/local[8270]: 2FECF667739: to=<user@xyz.com.au>, relay=local, delay=3.3, dsn=2.0.0, status=sent",
+    "postfix/qmgr[37259]: 2FECF667738: removed",
+    "postfix/cleanup[4499]: CADB76676A3: milter-reject: END-OF-MESSAGE from zgz2.honeyanda.com[185.237.96.123]: 5.7.1 Blocked by SpamAssassin",
+    "postfix/smtpd[22878]: disconnect from o417.notify.sendle.com[167.89.105.135] ehlo=1 mail=1 quit=1 commands=3",
+    "postfix/anvil[123]: statistics: max connection rate 1/60s for (smtp:1.2.3.4)",
+    "postfix/smtp[999]: 1234ABC: to=<x@example.org>, relay=mx.example.org[5.6.7.8]:25, status=sent (250 ok)",
+    "dovecot: imap(user1): Logged out in=12 out=345",
+    "kernel: [12345.6789] eth0: link up",
+]
+
+
+def log_line(text, dt="Aug 10 16:14:36", host=HOST):
+    return "{0} {1} {2}\n".format(dt, host, text)
+
+
+def message_lines(count, seed=0):
+    """
+    Makes a corpus of log lines for <count> complete messages, some without
+    a Message-ID, interleaved with each other and with irrelevant lines.
+    """
+    return loggen.generate(count, seed, no_msg_id=0.2, fanout=2, host=HOST)
+
+
+def journal_entry(line):
+    """Returns the fields journald would store for a log line from loggen."""
+    m = re.match(r'(\w{3} +\d+ \d{2}:\d{2}:\d{2}) (\S+) ([^[:]+)(?:\[(\d+)\])?: (.*)', line)
+    dt, host, prog, pid, message = m.groups()
+    t = time.strptime("2018 " + dt, "%Y %b %d %H:%M:%S")
+    entry = {'__REALTIME_TIMESTAMP': str(int(time.mktime(t)) * 1000000 + 123456),
+             '_HOSTNAME': host, 'SYSLOG_IDENTIFIER': prog, 'MESSAGE': message,
+             'PRIORITY': '6'}
+    if pid:
+        entry['SYSLOG_PID'] = pid
+    return entry
+
+
+def normalise_uuids(text):
+    return re.sub(r'[0-9a-f]{8}(?:-[0-9a-f]{4}){3}-[0-9a-f]{12}', 'UUID', text)
+
+
+def exit_worker(*args):
+    """Stands in for hosts.run_worker(), as if the worker were killed."""
+    os._exit(3)
+
+
+def mutated_lines(count, seed=0):
+    """
+    Makes a corpus of log lines by randomly corrupting the sample lines,
+    favouring the characters that delimit fields.
+    """
+    rng = random.Random(seed)
+    chars = "<>[]:@., _-+=0123456789aZ\u00e9\u0663\u00b2\n"
+    for i in range(count):
+        text = list(rng.choice(SAMPLE_LINES))
+        for j in range(rng.randint(0, 3)):
+            pos = rng.randrange(len(text))
+            action = rng.randint(0, 2)
+            if action == 0:
+                del text[pos]
+            elif action == 1:
+                text.insert(pos, rng.choice(chars))
+            else:
+                text[pos] = rng.choice(chars)
+        yield log_line("".join(text))
 
 
 class TestPostscan(unittest.TestCase):
@@ -23,6 +150,808 @@ class TestPostscan(unittest.TestCase):
     def test_000_something(self):
         """Test something."""
 
+    def test_scanner_program_index(self):
+        """Test that the per-program lookup matches trying every pattern."""
+        scanner = Scanner(True, logging.getLogger("postscan"))
+        lines = [log_line(text) for text in SAMPLE_LINES]
+        lines.append(log_line(SAMPLE_LINES[0], host="otherhost"))
+        lines.extend(mutated_lines(5000))
+        for line_num, line in enumerate(lines, 1):
+            expected = None
+            for r in scanner.rd:
+                m = r[0].match(line)
+                if m:
+                    expected = r[1], m.groups()
+                    break
+            self.assertEqual(scanner.find(line, line_num), expected)
+
+    def test_parallel_output(self):
+        """Test that --jobs gives the same output as a serial run."""
+        with tempfile.NamedTemporaryFile('w', suffix='.log', delete=False) as f:
+            f.writelines(message_lines(500))
+        self.addCleanup(os.unlink, f.name)
+
+        runner = CliRunner()
+        serial = runner.invoke(cli.main, [f.name])
+        with mock.patch.object(parallel, 'CHUNK_SIZE', 4096):
+            parallel_result = runner.invoke(cli.main, ['--jobs', '3', f.name])
+        self.assertEqual(serial.exit_code, 0)
+        self.assertEqual(parallel_result.exit_code, 0)
+        self.assertIn("sender499@example.net", serial.output)
+        self.assertEqual(normalise_uuids(parallel_result.output),
+                         normalise_uuids(serial.output))
+
+    def test_compressed_input(self):
+        """Test that compressed files are detected and read in full."""
+        lines = list(message_lines(200))
+        data = "".join(lines).encode()
+        for suffix, compress in ('.gz', gzip.compress), ('.bz2', bz2.compress), \
+                                ('.xz', lzma.compress), ('.log', bytes):
+            with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as f:
+                f.write(compress(data))
+            self.addCleanup(os.unlink, f.name)
+            # Small blocks to exercise the read-ahead queue
+            with mock.patch.object(inputs, 'BLOCK_SIZE', 1000):
+                stream = inputs.open_input(f.name)
+                try:
+                    self.assertEqual(list(stream), lines)
+                finally:
+                    stream.close()
+            # The compressed file itself is closed too
+            with warnings.catch_warnings(record=True) as caught:
+                warnings.simplefilter('always', ResourceWarning)
+                for stream in inputs.open_input(f.name), inputs.open_binary(f.name):
+                    stream.read()
+                    stream.close()
+                del stream
+                gc.collect()
+            self.assertEqual([w for w in caught if issubclass(w.category, ResourceWarning)], [])
+
+    def test_binary_invalid_utf8(self):
+        """Test that binary mode copes with invalid UTF-8 in spam."""
+        lines = list(message_lines(50))
+        lines[1:1] = [log_line("postfix/smtpd[100]: 1A2B3C4D5: client=mail.example.net[10.0.0.1]"),
+                      log_line("postfix/cleanup[101]: 1A2B3C4D5: message-id=<1a2b@example.net>"),
+                      log_line("postfix/local[104]: 1A2B3C4D5: to=<user1@example.com>, relay=local"),
+                      log_line("dovecot: lda(user1): sieve: msgid=<1a2b@example.net>: stored mail into mailbox 'Junk\udcff'"),
+                      log_line("postfix/qmgr[103]: 1A2B3C4D5: removed")]
+        data = "".join(lines).encode('utf-8', 'surrogateescape')
+        with tempfile.NamedTemporaryFile(suffix='.log', delete=False) as f:
+            f.write(data)
+        self.addCleanup(os.unlink, f.name)
+
+        runner = CliRunner()
+        result = runner.invoke(cli.main, ['-B', f.name])
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn("...user1: saved to 'Junk\ufffd'", result.output)
+        self.assertIn("sender49@example.net", result.output)
+
+    def check_follow(self, poll):
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, "mail.log")
+        self.addCleanup(shutil.rmtree, directory)
+        with open(path, 'wb') as f:
+            f.write(b"a1\na2\na3\nx")
+
+        lines = []
+        follower = follow.Follower(path, logging.getLogger("postscan"), poll=poll)
+        thread = threading.Thread(target=lambda: lines.extend(follower))
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(follower.stop)
+
+        def wait_for(*expected):
+            deadline = time.time() + 5
+            while lines != list(expected) and time.time() < deadline:
+                time.sleep(0.01)
+            self.assertEqual(lines, list(expected))
+            del lines[:]
+
+        def append(name, data):
+            with open(os.path.join(directory, name), 'ab') as f:
+                f.write(data)
+
+        wait_for(b"a1\n", b"a2\n", b"a3\n")
+        append("mail.log", b"yz\n")
+        wait_for(b"xyz\n")
+        # Rotation, with a late write to the old file
+        append("mail.log", b"b1\n")
+        os.rename(path, path + ".1")
+        append("mail.log.1", b"b2\n")
+        append("mail.log", b"c1\n")
+        wait_for(b"b1\n", b"b2\n", b"c1\n")
+        # Rotation with the new file created at once, while syslogd carries
+        # on writing to the old one for a while
+        os.rename(path, path + ".2")
+        append("mail.log", b"")
+        time.sleep(0.2)
+        append("mail.log.2", b"e1\n")
+        wait_for(b"e1\n")
+        append("mail.log.2", b"e2\n")
+        append("mail.log", b"f1\n")
+        wait_for(b"e2\n", b"f1\n")
+        # No longer read
+        append("mail.log.2", b"lost\n")
+        # Truncation
+        with open(path, 'wb') as f:
+            f.write(b"d\n")
+        wait_for(b"d\n")
+
+    def test_follow_inotify(self):
+        """Test following a file with rotation and truncation."""
+        with mock.patch.object(follow, 'WATCH_TIMEOUT', 0.5), \
+                mock.patch.object(follow, 'POLL_INTERVAL', 0.05):
+            self.check_follow(False)
+
+        # Events for other files don't put off the timeout
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        watcher = follow.Inotify(os.path.join(directory, "mail.log"))
+        self.addCleanup(watcher.close)
+        stop = threading.Event()
+
+        def write_other():
+            with open(os.path.join(directory, "other.log"), 'wb') as f:
+                while not stop.wait(0.02):
+                    f.write(b"x\n")
+                    f.flush()
+
+        thread = threading.Thread(target=write_other)
+        thread.start()
+        try:
+            start = time.time()
+            watcher.wait(0.3)
+            self.assertLess(time.time() - start, 1.0)
+        finally:
+            stop.set()
+            thread.join()
+
+    def test_follow_rotated_twice(self):
+        """Test that a file rotated again while the last one is open keeps the lines in order."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, "mail.log")
+        with open(path, 'wb') as f:
+            f.write(b"a1\n")
+        follower = follow.Follower(path, logging.getLogger("postscan"), poll=True)
+        self.addCleanup(follower.close)
+        follower.open()
+        self.assertEqual(follower.read_lines(), [b"a1\n"])
+        os.rename(path, path + ".1")
+        open(path, 'wb').close()
+        self.assertEqual(follower.check_file(), ([], True))
+        with open(path + ".1", 'ab') as f:
+            f.write(b"r1\nr2")
+        with open(path, 'ab') as f:
+            f.write(b"g1\n")
+        os.rename(path, path + ".2")
+        open(path, 'wb').close()
+        self.assertEqual(follower.check_file(), ([b"r1\n", b"r2", b"g1\n"], True))
+
+    def test_follow_poll(self):
+        """Test following a file by polling."""
+        with mock.patch.object(follow, 'POLL_INTERVAL', 0.05):
+            self.check_follow(True)
+
+    def test_checkpoint_resume(self):
+        """
+        Test that runs resumed from a checkpoint give the same output as a
+        single run, across log rotation and messages spanning runs.
+        """
+        lines = list(message_lines(300))
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, "mail.log")
+        state = os.path.join(directory, "state")
+        with open(path, 'w') as f:
+            f.writelines(lines)
+
+        runner = CliRunner()
+        expected = runner.invoke(cli.main, [path]).output
+        output = []
+        with open(path, 'w') as f:
+            # The partial line should be left for the next run
+            f.writelines(lines[:500])
+            f.write(lines[500][:20])
+        output.append(runner.invoke(cli.main, ['-k', state, path]).output)
+        with open(path, 'a') as f:
+            f.write(lines[500][20:])
+            f.writelines(lines[501:1000])
+        output.append(runner.invoke(cli.main, ['-k', state, path]).output)
+        os.rename(path, path + ".1")
+        with open(path, 'w') as f:
+            f.writelines(lines[1000:])
+        output.append(runner.invoke(cli.main, ['-k', state, path + ".1", path]).output)
+        self.assertEqual(normalise_uuids("".join(output)), normalise_uuids(expected))
+
+        # The year carries on from the saved state, so that a run resumed
+        # after New Year doesn't take the saved messages to be a year old
+        scanner = Scanner(False, logging.getLogger("postscan"))
+        machine = StateMachine(None, None, None, logging.getLogger("postscan"), max_age=3600)
+        machine.clock = timestamps.SyslogClock(2020)
+        text = "postfix/smtpd[100]: 5A1F00001: client=mail.example.net[10.1.2.3]"
+        machine.dispatch(*scanner.find(log_line(text, "Dec 31 23:50:00"), 1), line_num=1)
+        checkpoint.save(state, machine.get_state(), {})
+        resumed = StateMachine(None, None, None, logging.getLogger("postscan"), max_age=3600)
+        resumed.set_state(checkpoint.load(state)[0])
+        text = "postfix/smtpd[100]: 5A1F00002: client=mail.example.net[10.1.2.4]"
+        resumed.dispatch(*scanner.find(log_line(text, "Jan  1 00:10:00"), 1), line_num=1)
+        self.assertEqual(resumed.evicted, 0)
+        self.assertEqual(sorted(resumed.messages), ["5A1F00001", "5A1F00002"])
+
+        # Checkpoints are JSON, and anything else (e.g. a pickle, which could
+        # run code when loaded) is refused
+        with open(state) as f:
+            self.assertEqual(json.load(f)['version'], checkpoint.VERSION)
+        with open(state, 'wb') as f:
+            f.write(b"\x80\x04\x95\x00")
+        with self.assertRaisesRegex(ValueError, "not a checkpoint file"):
+            checkpoint.load(state)
+
+    def test_max_age_eviction(self):
+        """
+        Test that a message which is never removed is evicted once the log
+        has moved on by --max-age seconds, and only printed if asked.
+        """
+        zombie = [
+            "postfix/smtpd[100]: 5A1F00001: client=mail.example.net[10.1.2.3]",
+            "postfix/cleanup[101]: 5A1F00001: message-id=<zombie@example.net>",
+            "postfix/qmgr[102]: 5A1F00001: from=<a@example.net>, size=100, nrcpt=1 (queue active)",
+        ]
+        complete = [
+            "postfix/smtpd[100]: 5A1F00002: client=mail.example.net[10.1.2.4]",
+            "postfix/cleanup[101]: 5A1F00002: message-id=<alive@example.net>",
+            "postfix/qmgr[102]: 5A1F00002: from=<b@example.net>, size=100, nrcpt=1 (queue active)",
+            "postfix/local[103]: 5A1F00002: to=<user@example.net>, relay=local, status=sent",
+            "postfix/qmgr[102]: 5A1F00002: removed",
+        ]
+        with tempfile.NamedTemporaryFile('w', suffix=".log") as f:
+            f.writelines(log_line(text, "Dec 31 23:00:00") for text in zombie)
+            f.writelines(log_line(text, "Jan  1 00:30:00") for text in complete)
+            f.flush()
+
+            runner = CliRunner()
+            result = runner.invoke(cli.main, ['--max-age', '3600', f.name])
+            self.assertNotIn("5A1F00001", result.output)
+            self.assertIn("5A1F00002", result.output)
+            result = runner.invoke(cli.main, ['--max-age', '3600', '--emit-incomplete', f.name])
+            self.assertIn("5A1F00001: (Dec 31 23:00:00) a@example.net [10.1.2.3] INCOMPLETE",
+                          result.output)
+            self.assertLess(result.output.index("5A1F00001"), result.output.index("5A1F00002"))
+            # Only an hour and a half old
+            result = runner.invoke(cli.main, ['--max-age', '7200', '--emit-incomplete', f.name])
+            self.assertNotIn("5A1F00001", result.output)
+
+    def test_delivery_without_mailbox(self):
+        """
+        Test that a Sieve line without a mailbox (e.g. "discard action")
+        keeps that delivery's score from being the message's default.
+        """
+        lines = [log_line(text) for text in [
+            "postfix/smtpd[100]: 5A1F00003: client=mail.example.net[10.1.2.3]",
+            "postfix/cleanup[101]: 5A1F00003: message-id=<m1@example.net>",
+            "postfix/qmgr[102]: 5A1F00003: from=<a@example.net>, size=100, nrcpt=2 (queue active)",
+            "spamd[104]: spamd: result: Y 7 - BAYES_99 scantime=1.7,size=3752,user=alice,uid=124,"
+            "mid=<m1@example.net>,autolearn=no",
+            "dovecot: lda(alice): sieve: msgid=<m1@example.net>: marked message to be discarded "
+            "if not explicitly delivered (discard action)",
+            "dovecot: lda(bob): sieve: msgid=<m1@example.net>: stored mail into mailbox 'INBOX'",
+            "postfix/local[103]: 5A1F00003: to=<alice@example.com>, relay=local, status=sent",
+            "postfix/local[103]: 5A1F00003: to=<bob@example.com>, relay=local, status=sent",
+            "postfix/qmgr[102]: 5A1F00003: removed",
+        ]]
+        records = list(parse_lines(lines))
+        self.assertEqual([(r.user, r.mailbox, r.spam_level) for r in records[0].recipients],
+                         [("alice", None, 7), ("bob", "INBOX", None)])
+        # Printed as before
+        text = output.TextWriter(io.StringIO()).format(records[0])
+        self.assertIn("  ...alice: saved to 'None', spam level 7\n", text)
+
+    def test_rejected_without_message_id(self):
+        """
+        Test that a rejected message without a Message-ID only gives back its
+        own fake ID, even if it is removed afterwards.
+        """
+        lines = [log_line(text) for text in [
+            "postfix/smtpd[100]: 5A1F00004: client=mail.example.net[10.1.2.3]",
+            "postfix/cleanup[101]: 5A1F00004: message-id=<>",
+            "postfix/smtpd[100]: 5A1F00005: client=mail.example.net[10.1.2.4]",
+            "postfix/cleanup[101]: 5A1F00005: message-id=<>",
+            "postfix/cleanup[101]: 5A1F00004: milter-reject: END-OF-MESSAGE from "
+            "mail.example.net[10.1.2.3]: 5.7.1 Blocked by SpamAssassin",
+            "postfix/qmgr[102]: 5A1F00004: removed",
+            "postfix/qmgr[102]: 5A1F00005: from=<b@example.net>, size=100, nrcpt=1 (queue active)",
+            "postfix/local[103]: 5A1F00005: to=<bob@example.com>, relay=local, status=sent",
+            "postfix/qmgr[102]: 5A1F00005: removed",
+        ]]
+        records = list(parse_lines(lines))
+        self.assertEqual([r.queue_id for r in records], ["5A1F00005"])
+
+    def test_uuid_queue(self):
+        """Test the UUID queue's ordering and claiming."""
+        queue = UUIDs()
+        a, b, c = queue.create(), queue.create(), queue.create()
+        self.assertEqual(list(queue), [a, b, c])
+        self.assertEqual(queue.peek(), a)
+        self.assertEqual(queue.peek(2), c)
+        queue.claim(a, "user1")
+        self.assertEqual(queue.first_unowned(), b)
+        self.assertEqual(queue.pop(b), b)
+        self.assertEqual(queue.first_unowned(), c)
+        # Pops the first when the target isn't there
+        self.assertEqual(queue.pop("missing"), a)
+        self.assertEqual(queue.owners, {})
+        restored = UUIDs(list(queue), {c: "user2"})
+        self.assertRaises(IndexError, restored.first_unowned)
+        self.assertEqual(restored.pop(), c)
+        self.assertTrue(restored.empty())
+        self.assertRaises(IndexError, restored.pop)
+
+    def test_loggen(self):
+        """Test that generated logs are reproducible and fully parsed."""
+        lines = list(loggen.generate(300, seed=1, zombies=0.1, fanout=3))
+        self.assertEqual(lines, list(loggen.generate(300, seed=1, zombies=0.1, fanout=3)))
+        self.assertNotEqual(lines, list(loggen.generate(300, seed=2, zombies=0.1, fanout=3)))
+        removed = sum(1 for line in lines if line.endswith(": removed\n"))
+        self.assertLess(removed, 300)
+
+        with tempfile.NamedTemporaryFile('w', suffix=".log") as f:
+            f.writelines(lines)
+            f.flush()
+            result = CliRunner().invoke(cli.main, [f.name])
+        self.assertEqual(result.exit_code, 0)
+        self.assertEqual(len(re.findall(r"^[0-9A-F]+: \(", result.output, re.M)), removed)
+
+    def test_stats(self):
+        """Test that --stats reports without changing the output."""
+        lines = list(message_lines(100))
+        with tempfile.NamedTemporaryFile('w', suffix=".log") as f:
+            f.writelines(lines)
+            f.flush()
+            runner = CliRunner()
+            expected = runner.invoke(cli.main, [f.name])
+            result = runner.invoke(cli.main, ['--stats', f.name])
+            parallel_result = runner.invoke(cli.main, ['--stats', '--jobs', '2', f.name])
+        # The report is written last, and older versions of Click mix stderr
+        # into stdout, so it's split off the output rather than read apart
+        output, report = result.output.split("postscan stats after ")
+        self.assertEqual(normalise_uuids(output), normalise_uuids(expected.output))
+        self.assertRegex(report, r"^[0-9.]+s: %d lines read" % len(lines))
+        self.assertRegex(report, r"\n  removed +100 +\d+ +[0-9.]+ +100 ")
+        self.assertIn("peak sizes: messages ", report)
+        self.assertNotIn("worker processes", report)
+        output, report = parallel_result.output.split("postscan stats after ")
+        self.assertEqual(normalise_uuids(output), normalise_uuids(expected.output))
+        self.assertRegex(report, r"^[0-9.]+s: %d lines read" % len(lines))
+        self.assertIn("\n  %d lines were matched by worker processes" % len(lines), report)
+        # Matched in the workers, but handled here
+        self.assertRegex(report, r"\n  removed +0 +0 +0\.000 +100 ")
+
+    def test_output_formats(self):
+        """Test that each --format gives the same messages."""
+        with tempfile.NamedTemporaryFile('w', suffix=".log") as f:
+            f.writelines(message_lines(100))
+            f.flush()
+            runner = CliRunner()
+            text = normalise_uuids(runner.invoke(cli.main, [f.name]).output)
+            jsonl = normalise_uuids(runner.invoke(cli.main, ['--format', 'jsonl', f.name]).output)
+            tsv = runner.invoke(cli.main, ['--format', 'tsv', f.name]).output
+
+        headers = re.findall(r"^([0-9A-F]+): \((.*?)\) (\S+) \[(.*?)\]\n  \((.*?)\)$", text, re.M)
+        records = [json.loads(line) for line in jsonl.splitlines()]
+        self.assertEqual(len(headers), 100)
+        self.assertEqual([(r['queue_id'], r['time'], r['envfrom'], r['ip'], r['msg_id'])
+                          for r in records], headers)
+        self.assertEqual(sum(1 for r in records for rcpt in r['recipients'] if rcpt['user']),
+                         text.count("saved to"))
+
+        rows = [line.split("\t") for line in tsv.splitlines()]
+        self.assertEqual(rows[0][:3], ["queue_id", "time", "ip"])
+        self.assertEqual(len(rows), 101)
+        for row, record in zip(rows[1:], records):
+            self.assertEqual(len(row), 12)
+            self.assertEqual(row[0], record['queue_id'])
+            self.assertEqual(row[6].split(","), [r['address'] for r in record['recipients']])
+
+    def test_database(self):
+        """Test storing messages with --db and looking them up with query."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, "mail.log")
+        db = os.path.join(directory, "mail.db")
+        with open(path, 'w') as f:
+            f.writelines(message_lines(200))
+
+        runner = CliRunner()
+        text = normalise_uuids(runner.invoke(cli.main, [path]).output)
+        # Small batches, as if it were a bigger log
+        with mock.patch.object(database, 'BATCH_SIZE', 30):
+            result = runner.invoke(cli.main, ['--db', db, path])
+        self.assertEqual(result.exit_code, 0)
+        self.assertEqual(result.output, "")
+
+        def query(*args):
+            result = runner.invoke(cli.main, ['query', '--db', db] + list(args))
+            self.assertEqual(result.exit_code, 0, result.output)
+            return normalise_uuids(result.output)
+
+        # In order of arrival rather than removal
+        everything = query()
+        self.assertEqual(sorted(everything.split("\n\n")), sorted(text.split("\n\n")))
+        messages = everything.split("\n\n")
+        sender7 = [m for m in messages if " sender7@example.net " in m]
+        self.assertEqual(query('--from', "SENDER7@example.net"), sender7[0] + "\n\n")
+        msg_id = re.search(r"^  \((.*@.*)\)$", everything, re.M).group(1)
+        self.assertEqual(query('--msg-id', msg_id),
+                         "".join(m + "\n\n" for m in messages if "(%s)" % msg_id in m))
+        for message in query('--to', "user3@example.com").split("\n\n")[:-1]:
+            self.assertIn("  user3@example.com", message)
+        self.assertEqual(query('--to', "nobody@example.com"), "")
+        self.assertEqual(query('--limit', '2'), "".join(m + "\n\n" for m in messages[:2]))
+        year = timestamps.first_year("Aug 10")
+        self.assertEqual(query('--since', "%d-08-10" % year), everything)
+        self.assertEqual(query('--until', "%d-08-10" % year), "")
+        self.assertEqual(runner.invoke(cli.main, ['query', '--db', db, '--since', "yesterday"]).exit_code, 2)
+        # Lookups don't write to the database, e.g. to create the tables
+        empty = os.path.join(directory, "empty.db")
+        open(empty, 'w').close()
+        result = runner.invoke(cli.main, ['query', '--db', empty])
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn("isn't a postscan database", result.output)
+        self.assertEqual(os.path.getsize(empty), 0)
+
+        # Logs have no year, and are never from the future
+        now = calendar.timegm((2026, 10, 18, 12, 0, 0))
+        clock = timestamps.SyslogClock(now=now)
+        self.assertEqual(time.gmtime(clock.seconds("Dec 30 23:59:59"))[:3], (2025, 12, 30))
+        self.assertEqual(time.gmtime(clock.seconds("Jan  2 00:00:01"))[:3], (2026, 1, 2))
+        self.assertEqual(time.gmtime(timestamps.SyslogClock(now=now).seconds("Oct 19 01:00:00"))[:3],
+                         (2026, 10, 19))
+
+    def test_since_until(self):
+        """Test that --since and --until print the messages removed in between."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, "mail.log")
+        with open(path, 'w') as f:
+            f.writelines(message_lines(500))
+
+        runner = CliRunner()
+        everything = runner.invoke(cli.main, [path]).output
+        args = ['--since', "2018-08-10 00:03", '--until', "2018-08-10 00:05:30", path]
+        # Small enough that the search takes several steps
+        with mock.patch.object(window, 'SCAN_SIZE', 1024):
+            result = runner.invoke(cli.main, args)
+        self.assertEqual(result.exit_code, 0, result.output)
+        part = result.output
+        self.assertTrue(0 < len(part) < len(everything) / 2)
+        self.assertIn(normalise_uuids(part), normalise_uuids(everything))
+
+        # Read from a pipe, which can't be searched
+        with open(path, 'rb') as f:
+            piped = runner.invoke(cli.main, args[:-1], input=f.read()).output
+        self.assertEqual(normalise_uuids(piped), normalise_uuids(part))
+        self.assertEqual(runner.invoke(cli.main, ['--until', "2018-08-10", path]).output, "")
+        self.assertEqual(normalise_uuids(runner.invoke(cli.main, ['--since', "2018-08-10", path]).output),
+                         normalise_uuids(everything))
+
+        # Across the end of a year
+        clock = window.LineClock(calendar.timegm((2019, 1, 1, 0, 0, 0)))
+        self.assertEqual(clock(b"Dec 31 23:59:59 host x"), calendar.timegm((2018, 12, 31, 23, 59, 59)))
+        self.assertEqual(clock(b"Jan  1 00:00:01 host x"), calendar.timegm((2019, 1, 1, 0, 0, 1)))
+
+    def test_two_pass(self):
+        """Test that --two-pass finds the same messages for --to."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, "mail.log")
+        data = "".join(message_lines(500)).encode()
+        with open(path, 'wb') as f:
+            f.write(data)
+        with open(path + ".gz", 'wb') as f:
+            f.write(gzip.compress(data))
+
+        runner = CliRunner()
+        for address in "user13@example.com", "info@example.com", "nobody@example.com":
+            expected = normalise_uuids(runner.invoke(cli.main, ['-t', address, path]).output)
+            self.assertEqual("saved to" in expected, address != "nobody@example.com")
+            for args in ['-2', path], ['-2', '-B', path], ['--two-pass', path + ".gz"]:
+                result = runner.invoke(cli.main, ['-t', address] + args)
+                self.assertEqual(result.exit_code, 0, result.output)
+                self.assertEqual(normalise_uuids(result.output), expected)
+        self.assertEqual(runner.invoke(cli.main, ['-2', path]).exit_code, 2)
+
+        # A deferred message, delivered long after it arrived
+        with open(path, 'w') as f:
+            f.writelines(log_line(text, "Aug  9 23:00:00") for text in [
+                "postfix/smtpd[100]: 5A1F00004: client=mail.example.net[10.1.2.3]",
+                "postfix/cleanup[101]: 5A1F00004: message-id=<deferred@example.net>",
+                "postfix/qmgr[102]: 5A1F00004: from=<a@example.net>, size=100, nrcpt=1 (queue active)"])
+            f.writelines(message_lines(500))
+            f.writelines(log_line(text, "Aug 10 01:00:00") for text in [
+                "postfix/local[103]: 5A1F00004: to=<late@example.com>, relay=local, "
+                "delay=7200, delays=7200/0/0/0, dsn=2.0.0, status=sent",
+                "postfix/qmgr[102]: 5A1F00004: removed"])
+        expected = runner.invoke(cli.main, ['-t', "late@example.com", path]).output
+        self.assertIn("5A1F00004", expected)
+        self.assertEqual(runner.invoke(cli.main, ['-2', '-t', "late@example.com", path]).output, expected)
+
+    def test_hosts(self):
+        """Test that --hosts keeps each host's messages apart, with and without --jobs."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, "mail.log")
+        # The same seed for mx1 and mx2, so that their queue IDs collide
+        logs = dict((host, list(loggen.generate(150, seed, no_msg_id=0.2, host=host)))
+                    for host, seed in (("mx1", 0), ("mx2", 0), ("mx3", 1)))
+        with open(path, 'w') as f:
+            f.writelines(heapq.merge(*logs.values(), key=lambda line: line[:15]))
+
+        runner = CliRunner()
+        separate = {}
+        for host, lines in logs.items():
+            output = runner.invoke(cli.main, ['--hosts', host], input="".join(lines)).output
+            separate[host] = normalise_uuids(output).split("\n\n")[:-1]
+            self.assertEqual(len(separate[host]), 150)
+
+        serial = runner.invoke(cli.main, ['--hosts', '*', path])
+        sharded = runner.invoke(cli.main, ['--hosts', 'mx1, mx2,mx3', '--jobs', '2', path])
+        self.assertEqual(sharded.exit_code, 0, sharded.output)
+        self.assertEqual(normalise_uuids(sharded.output), normalise_uuids(serial.output))
+        combined = normalise_uuids(serial.output).split("\n\n")[:-1]
+        for host in logs:
+            self.assertEqual([m for m in combined if m.split("\n")[0].endswith(" on " + host)],
+                             separate[host])
+        self.assertEqual(runner.invoke(cli.main, ['--hosts', 'mx3', path]).output.count(" on "), 150)
+
+        # A worker that dies is reported rather than waited for
+        with mock.patch.object(hosts, 'run_worker', exit_worker), \
+                mock.patch.object(hosts, 'WORKER_CHECK_INTERVAL', 0.1):
+            with self.assertRaisesRegex(RuntimeError, "exited with status 3"):
+                list(hosts.scan_file(path, 2, (False, False, ['*']), None, 'utf-8'))
+
+    def test_journal(self):
+        """Test that --journal reads journalctl's export and JSON formats like the text log."""
+        lines = list(loggen.generate(150, 0, no_msg_id=0.2))
+        entries = [journal_entry(line) for line in lines]
+        export = []
+        for i, entry in enumerate(entries):
+            fields = []
+            for name, value in sorted(entry.items()):
+                value = value.encode('utf-8')
+                if name == 'MESSAGE' and i % 2:
+                    # As for a value that isn't plain text
+                    fields.append(name.encode('ascii') + b'\n' + struct.pack('<Q', len(value))
+                                  + value + b'\n')
+                else:
+                    fields.append(name.encode('ascii') + b'=' + value + b'\n')
+            export.append(b"".join(fields) + b'\n')
+        as_json = "".join(json.dumps(dict(entry, MESSAGE=list(entry['MESSAGE'].encode('utf-8'))
+                                          if i % 3 == 0 else entry['MESSAGE'])) + "\n"
+                          for i, entry in enumerate(entries))
+
+        entry, = journal.read_entries(io.BytesIO(export[0]))
+        self.assertEqual(entry, dict((k, v) for k, v in entries[0].items() if k != 'PRIORITY'))
+        runner = CliRunner()
+        expected = normalise_uuids(runner.invoke(cli.main, input="".join(lines)).output)
+        self.assertEqual(expected.count("\n\n"), 150)
+        for data in (b"".join(export), as_json.encode('utf-8')):
+            result = runner.invoke(cli.main, ['--journal'], input=data)
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertEqual(normalise_uuids(result.output), expected)
+        result = runner.invoke(cli.main, ['--journal', '--hosts', 'elsewhere'], input=as_json)
+        self.assertEqual(result.output, "")
+
+    def test_summary(self):
+        """Test that --summary matches exact counts of the messages."""
+        lines = list(loggen.generate(300, 0, fanout=3))
+        runner = CliRunner()
+        records = [json.loads(line) for line in
+                   runner.invoke(cli.main, ['--format', 'jsonl'], input="".join(lines)).output.splitlines()]
+        result = runner.invoke(cli.main, ['--summary', '--format', 'jsonl', '--summary-top', '3'],
+                               input="".join(lines))
+        self.assertEqual(result.exit_code, 0, result.output)
+        rollups = json.loads(result.output)
+        self.assertEqual(rollups['messages'], 300)
+        senders = collections.Counter(r['envfrom'] for r in records)
+        self.assertEqual([(s['count'], s['error']) for s in rollups['top_senders']],
+                         [(senders[s['envfrom']], 0) for s in rollups['top_senders']])
+        self.assertEqual([s['count'] for s in rollups['top_senders']],
+                         sorted(senders.values(), reverse=True)[:3])
+        self.assertAlmostEqual(rollups['distinct_ips'], len(set(r['ip'] for r in records)), delta=5)
+        recipients = [r for record in records for r in record['recipients']]
+        mailboxes = collections.Counter((r['user'], r['mailbox']) for r in recipients)
+        self.assertEqual(rollups['top_mailboxes'][0]['count'], max(mailboxes.values()))
+        levels = collections.Counter(r['spam_level'] for r in recipients if r['user'] == 'user1')
+        self.assertEqual(rollups['spam_levels']['user1'],
+                         dict((str(level), count) for level, count in sorted(levels.items())))
+        self.assertIn("Top senders:", runner.invoke(cli.main, ['--summary'], input="".join(lines)).output)
+
+        # With fewer counters than keys, the heavy hitters are still found
+        top = summary.SpaceSaving(10)
+        rng = random.Random(0)
+        for i in range(20000):
+            top.add("heavy" if i % 10 == 0 else "key%d" % rng.randrange(5000))
+        key, count, error = top.top(1)[0]
+        self.assertEqual(key, "heavy")
+        self.assertTrue(count - error <= 2000 <= count)
+        self.assertLessEqual(len(top.heap), 10)
+        hll = summary.HyperLogLog()
+        for i in range(50000):
+            hll.add("key%d" % i)
+        self.assertAlmostEqual(hll.count(), 50000, delta=50000 * 0.05)
+
+    def test_parse_syslog(self):
+        """Test that syslog messages are turned back into log lines."""
+        parse = server.parse_message
+        line = log_line("postfix/qmgr[37259]: EBA07667720: removed", "Aug  1 16:14:36")
+        self.assertEqual(parse(b"<22>" + line.encode(), b"mx1"), line.encode())
+        self.assertEqual(parse(b"<22>Aug 10 16:14:36 dovecot: lda(x): sieve: msgid=unspecified\0", b"mx1"),
+                         b"Aug 10 16:14:36 mx1 dovecot: lda(x): sieve: msgid=unspecified\n")
+        self.assertEqual(parse(b'<22>1 2023-03-27T14:00:05.003+11:00 mx2 postfix/qmgr 37259 - '
+                               b'[meta x="a\\]b"][y@1 z="2"] \xef\xbb\xbf123: removed\n', b"mx1"),
+                         b"Mar 27 14:00:05 mx2 postfix/qmgr[37259]: 123: removed\n")
+        self.assertEqual(parse(b"<22>1 2023-03-07T04:00:05Z - dovecot - - - hi", b"mx1"),
+                         b"Mar  7 04:00:05 mx1 dovecot: hi\n")
+        self.assertIsNone(parse(b"Aug 10 16:14:36 mx1 kernel: no priority", b"mx1"))
+
+    def test_stream_framing(self):
+        """Test that TCP messages are split however they arrive, and that too long ones are refused."""
+        messages = [b"<22>Aug 10 16:14:36 mx1 postfix/qmgr[1]: 1A2B: removed",
+                    b"<22>Aug 10 16:14:37 mx1 postfix/qmgr[1]: 1A2C: removed"]
+        data = b"%d %s%s\n" % (len(messages[0]), messages[0], messages[1])
+        for size in 1, 7, len(data):
+            protocol = server.StreamProtocol(mock.Mock(paused=False))
+            protocol.connection_made(mock.Mock())
+            for pos in range(0, len(data), size):
+                protocol.data_received(data[pos:pos + size])
+            self.assertEqual([call[0][0] for call in protocol.server.receive.call_args_list],
+                             [messages[0], messages[1] + b"\n"])
+            self.assertFalse(protocol.transport.close.called)
+
+        for data in (b"%d " % (server.MAX_MESSAGE + 1), b"1" * 10,
+                     b"<22>" + b"x" * server.MAX_MESSAGE):
+            protocol = server.StreamProtocol(mock.Mock(paused=False))
+            protocol.connection_made(mock.Mock())
+            protocol.data_received(data)
+            self.assertTrue(protocol.transport.close.called)
+            self.assertFalse(protocol.server.receive.called)
+
+    def test_serve(self):
+        """Test that "serve" handles lines received over TCP and unix sockets like a file."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        lines = list(loggen.generate(100, 0, no_msg_id=0.2))
+        expected = normalise_uuids(CliRunner().invoke(cli.main, input="".join(lines)).output)
+        self.assertEqual(expected.count("\n\n"), 100)
+
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        port = str(listener.getsockname()[1])
+        listener.close()
+        path = os.path.join(directory, "log.sock")
+        for listen, octet_counting in ((['--tcp', port], True), (['--tcp', port], False),
+                                       (['--unix', path], None)):
+            with open(os.path.join(directory, "out"), 'w+') as out, \
+                    open(os.path.join(directory, "err"), 'w+') as err:
+                proc = subprocess.Popen([sys.executable, '-m', 'postscan.cli', 'serve', '-v']
+                                        + listen, stdout=out, stderr=err)
+                try:
+                    for i in range(100):
+                        try:
+                            sock = sendlog.connect(tcp=port) if listen[0] == '--tcp' else \
+                                sendlog.connect(unix=path)
+                            break
+                        except OSError:
+                            time.sleep(0.1)
+                    sent = sendlog.send([line.encode() for line in lines], sock,
+                                        listen[0] == '--tcp', octet_counting=octet_counting)
+                    sock.close()
+                    self.assertEqual(sent, len(lines))
+                    if listen[0] == '--tcp':
+                        # Wait until everything sent has been read
+                        for i in range(100):
+                            err.seek(0)
+                            if "closed after %d messages" % len(lines) in err.read():
+                                break
+                            time.sleep(0.1)
+                finally:
+                    proc.send_signal(signal.SIGTERM)
+                    proc.wait()
+                out.seek(0)
+                self.assertEqual(normalise_uuids(out.read()), expected)
+                err.seek(0)
+                self.assertIn("Received %d messages, dropped 0" % len(lines), err.read())
+        self.assertFalse(os.path.exists(path))
+
+    def test_parser_instances_isolated(self):
+        """
+        Test that Parsers run at once in threads, fed chunks split anywhere,
+        give the same records as each stream parsed on its own.
+        """
+        text = output.TextWriter(io.StringIO()).format
+        corpora = [list(message_lines(300, seed)) for seed in range(4)]
+        expected = [normalise_uuids("".join(text(record) for record in parse_lines(lines)))
+                    for lines in corpora]
+        self.assertTrue(all(expected))
+        self.assertEqual(len(set(expected)), len(corpora))
+
+        results = [[] for lines in corpora]
+
+        def run(index):
+            rng = random.Random(index)
+            data = "".join(corpora[index]).encode('utf-8')
+            parser = Parser(callback=results[index].append)
+            pos = 0
+            while pos < len(data):
+                size = rng.randint(1, 4096)
+                parser.feed(data[pos:pos + size])
+                pos += size
+                time.sleep(0)
+            parser.close()
+
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(len(corpora))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([normalise_uuids("".join(text(record) for record in records))
+                          for records in results], expected)
+
+    def test_merge(self):
+        """
+        Test that --merge reads rotated files given in any order, and logs
+        from different hosts, as if they were one log.
+        """
+        lines = list(message_lines(300))
+        runner = CliRunner()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        whole = os.path.join(directory, "mail.log")
+        with open(whole, 'w') as f:
+            f.writelines(lines)
+        expected = normalise_uuids(runner.invoke(cli.main, [whole]).output)
+
+        # Rotated in the middle of messages, the older half compressed
+        older = os.path.join(directory, "mail.log.1.gz")
+        with open(older, 'wb') as f:
+            f.write(gzip.compress("".join(lines[:len(lines) // 2]).encode()))
+        with open(whole, 'w') as f:
+            f.writelines(lines[len(lines) // 2:])
+        result = runner.invoke(cli.main, ['--merge', whole, older])
+        self.assertEqual(normalise_uuids(result.output), expected)
+        self.assertNotEqual(normalise_uuids(runner.invoke(cli.main, [whole, older]).output), expected)
+
+        # Ties go to the file that starts first, then the one given first
+        a = io.BytesIO(b"Aug 10 16:14:36 a 1\nAug 10 16:14:37 a 2\nnot a timestamp\n")
+        b = io.BytesIO(b"Aug 10 16:14:36 b 1\nAug 10 16:14:37 b 2\n")
+        c = io.BytesIO(b"Aug 10 16:14:37 c 1\n")
+        self.assertEqual([line.split()[-1] for line in merge.merge([c, a, b])],
+                         [b"1", b"1", b"2", b"timestamp", b"2", b"1"])
+
+        # Logs from either side of New Year, merged most of a year later, are
+        # placed in the years they were written in
+        older = io.BytesIO(b"Dec 30 10:00:00 a old\nDec 31 23:59:59 a old\n")
+        newer = io.BytesIO(b"Dec 31 23:59:59 a new\nJan  1 00:00:01 a new\nJan  2 09:00:00 a new\n")
+        written = [calendar.timegm((2026, 1, 2, 10, 0, 0)), calendar.timegm((2026, 1, 1, 0, 0, 0))]
+        self.assertEqual([line[:15] for line in merge.merge([newer, older], written,
+                                                            now=calendar.timegm((2026, 8, 20, 0, 0, 0)))],
+                         [b"Dec 30 10:00:00", b"Dec 31 23:59:59", b"Dec 31 23:59:59",
+                          b"Jan  1 00:00:01", b"Jan  2 09:00:00"])
+
+        # The logs of two hosts, each correlated on its own
+        paths = []
+        for host in ("mx1", "mx2"):
+            paths.append(os.path.join(directory, host + ".log"))
+            with open(paths[-1], 'w') as f:
+                f.writelines(loggen.generate(100, seed=len(paths), no_msg_id=0.2, host=host))
+        separate = "".join(runner.invoke(cli.main, ['--hosts', '*', path]).output for path in paths)
+        result = runner.invoke(cli.main, ['--hosts', '*', '--merge'] + paths)
+        self.assertEqual(sorted(normalise_uuids(result.output).splitlines()),
+                         sorted(normalise_uuids(separate).splitlines()))
+        result = runner.invoke(cli.main, ['--merge', '--follow', whole])
+        self.assertEqual(result.exit_code, 2)
+
     def test_command_line_interface(self):
         """Test the CLI."""
         runner = CliRunner()